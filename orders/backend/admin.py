@@ -1,7 +1,172 @@
+import itertools
+import json
+
+from django.conf import settings
 from django.contrib import admin
-from .models import User
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import Order, OrderItem, Product, ProductInfo, Shop, User
+from .sharding import get_shard_map
+from .transitions import change_orders_state
+
+BATCH_SIZE = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    # On PostgreSQL the page count comes from the planner's statistics (pg_class.reltuples for a whole table,
+    # the EXPLAIN row estimate for a filtered list); only lists under ADMIN_EXACT_COUNT_LIMIT rows are counted.
+    @cached_property
+    def count(self):
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql':
+            if self.object_list.query.where:
+                plan = json.loads(self.object_list.explain(format='json'))
+                estimate = int(plan[0]['Plan']['Plan Rows'])
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                                   [connection.ops.quote_name(self.object_list.model._meta.db_table)])
+                    estimate = cursor.fetchone()[0]
+            if estimate >= settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # Lists newest first by primary key, sorts by nothing else and never counts the whole table.
+    # A search term of up to 18 digits (any bigint) matches id_search_fields exactly; anything else is matched
+    # as a whole against search_fields, which name their (indexed) lookups.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    sortable_by = ('id',)
+    id_search_fields = ('id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        is_id = term.isascii() and term.isdigit() and len(term) <= 18
+        fields, value = (self.id_search_fields, int(term)) if is_id else (self.search_fields, term)
+        return queryset.filter(Q.create([(field, value) for field in fields], connector=Q.OR)), False
+
+
+class InStockFilter(admin.SimpleListFilter):
+    title = 'stock'
+    parameter_name = 'in_stock'
+
+    def lookups(self, request, model_admin):
+        return ('1', 'In stock'), ('0', 'Out of stock')
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            return queryset.filter(quantity__gt=0)
+        if self.value() == '0':
+            return queryset.filter(quantity=0)
+
+
+def state_action(state):
+    @admin.action(description=f'Move selected orders to {state}', permissions=['change'])
+    def action(modeladmin, request, queryset):
+        # the selection can be the whole table, so ids are read and changed in batches
+        ids = queryset.order_by().values_list('id', flat=True).iterator(chunk_size=BATCH_SIZE)
+        changed = 0
+        while batch := set(itertools.islice(ids, BATCH_SIZE)):
+            changed += len(change_orders_state(batch, state, sender=modeladmin.__class__))
+        modeladmin.message_user(request, f'{changed} orders moved to {state}')
+    action.__name__ = f'make_{state}'
+    return action
 
 
 @admin.register(User)
-class UsersAdmin(admin.ModelAdmin):
+class UsersAdmin(LargeTableAdmin):
     list_display = ('id', 'username', 'first_name', 'last_name')
+    search_fields = ('email__exact',)
+    search_help_text = 'User id or exact email'
+
+
+@admin.register(Shop)
+class ShopAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'user', 'state')
+    list_select_related = ('user',)
+    list_filter = ('state',)
+    search_fields = ('name__istartswith',)
+    autocomplete_fields = ('user',)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'category')
+    list_select_related = ('category',)
+    search_fields = ('name__startswith',)
+    search_help_text = 'Product id or the start of its name (case-sensitive)'
+
+
+class ShardNoteMixin:
+    # The lists read 'default' only: orders of users placed on other DATABASE_SHARDS are not shown there
+    # (state actions still reach every shard by id).
+    def changelist_view(self, request, extra_context=None):
+        others = [alias for alias in get_shard_map().shards if alias != DEFAULT_DB_ALIAS]
+        if others:
+            extra_context = {'subtitle': f'Only the {DEFAULT_DB_ALIAS} shard is listed; orders on '
+                                         f'{", ".join(others)} are not shown', **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(ProductInfo)
+class ProductInfoAdmin(LargeTableAdmin):
+    # offers come from price list imports, which also keep price history, stock counters, best offers and the
+    # catalog version up to date, so only the name can be changed here
+    list_display = ('id', 'name', 'product', 'shop', 'external_id', 'quantity', 'price', 'price_rrc')
+    list_select_related = ('product', 'shop')
+    list_filter = (InStockFilter,)
+    search_fields = ('name__startswith',)
+    search_help_text = 'Offer id or the start of its name (case-sensitive)'
+    readonly_fields = ('product', 'shop', 'external_id', 'quantity', 'price', 'price_rrc')
+
+    def has_add_permission(self, request):
+        return False
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    readonly_fields = ('product_info', 'quantity')
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Order)
+class OrderAdmin(ShardNoteMixin, LargeTableAdmin):
+    # states change only through the actions, i.e. change_orders_state and its transitions and notifications;
+    # items and totals through the basket
+    list_display = ('id', 'user', 'state', 'total_sum', 'dt', 'completed_at')
+    list_select_related = ('user',)
+    list_filter = ('state',)
+    search_fields = ('user__email__exact',)
+    search_help_text = 'Order or user id, or the exact email of the customer'
+    id_search_fields = ('id', 'user_id')
+    readonly_fields = ('user', 'state', 'total_sum', 'dt', 'completed_at', 'updated_at')
+    inlines = (OrderItemInline,)
+    actions = [state_action(state) for state in ('in_progress', 'completed', 'rejected')]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(ShardNoteMixin, LargeTableAdmin):
+    list_display = ('id', 'order', 'product_info', 'quantity')
+    list_select_related = ('order', 'product_info')
+    search_fields = ('product_info__name__startswith',)
+    search_help_text = 'Item or order id, or the start of the offer name (case-sensitive)'
+    id_search_fields = ('id', 'order_id')
+    readonly_fields = ('order', 'product_info', 'quantity')
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,133 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import token_cache
+from .basket import CacheBasket
+from .events import get_bus
+from .models import Category, Order, ProductInfo, Shop
+from .performance import serialized
+from .serializers import CategorySerializer, OrderSerializer, ProductInfoSerializer, ShopSerializer
+from .sharding import get_shard_map
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def render(data, status=200):
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+    if status == 401:
+        response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def get_user(request):
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return None
+    # same messages as rest_framework.authentication.TokenAuthentication
+    if len(auth) == 1:
+        raise InvalidToken('Invalid token header. No credentials provided.')
+    if len(auth) > 2:
+        raise InvalidToken('Invalid token header. Token string should not contain spaces.')
+    cached = await token_cache.aget(auth[1])
+    if cached is None:
+        user_id = await Token.objects.filter(key=auth[1]).values_list('user_id', flat=True).afirst()
+        if user_id is None:
+            raise InvalidToken('Invalid token.')
+        version = await token_cache.aversion(user_id)
+        token = await Token.objects.select_related('user').filter(key=auth[1]).afirst()
+        if token is None:
+            raise InvalidToken('Invalid token.')
+        if not token.user.is_active:
+            raise InvalidToken('User inactive or deleted.')
+        cached = (token.user, token)
+        token_cache.set(auth[1], cached, version)
+    return cached[0]
+
+
+def authenticated(view, required=True):
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await get_user(request)
+        except InvalidToken as error:
+            return render({'detail': str(error)}, status=401)
+        if required and user is None:
+            return render({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        return await view(request, user, *args, **kwargs)
+    return wrapper
+
+
+async def products(request, user):
+    query = Q(shop__state=True)
+    shop_id = request.GET.get('shop_id')
+    category_id = request.GET.get('category_id')
+    if request.GET.get('in_stock') in ('1', 'true'):
+        query = query & Q(quantity__gt=0)
+    if shop_id:
+        query = query & Q(shop_id=shop_id)
+    if category_id:
+        query = query & Q(product__category_id=category_id)
+    queryset = [product_info async for product_info in ProductInfo.objects.filter(query)]
+    return render(serialized(ProductInfoSerializer(queryset, many=True)))
+
+
+async def categories(request, user):
+    queryset = [category async for category in Category.objects.all()]
+    return render(serialized(CategorySerializer(queryset, many=True)))
+
+
+async def shops(request, user):
+    queryset = [shop async for shop in Shop.objects.all()]
+    return render(serialized(ShopSerializer(queryset, many=True)))
+
+
+async def basket(request, user):
+    if settings.BASKET_STORE == 'cache':
+        return render(await sync_to_async(CacheBasket(user.id).to_representation)())
+    alias = await sync_to_async(get_shard_map().shard_for)(user.id)
+    queryset = [order async for order in Order.objects.using(alias).filter(user_id=user.id, state='new')
+                .prefetch_related('order_item__product_info')]
+    return render(serialized(OrderSerializer(queryset, many=True)))
+
+
+async def orders(request, user):
+    alias = await sync_to_async(get_shard_map().shard_for)(user.id)
+    queryset = [order async for order in Order.objects.using(alias).filter(user_id=user.id)
+                .prefetch_related('order_item__product_info')]
+    return render(serialized(OrderSerializer(queryset, many=True)))
+
+
+async def partner_events(request, user):
+    if user.type != 'partner':
+        return render({'Status': False, 'Comment': 'Error', 'Error': 'Function is available only for partners'},
+                      status=403)
+    last_event_id = request.headers.get('Last-Event-ID', request.GET.get('last_event_id'))
+    if last_event_id is not None and not last_event_id.isdigit():
+        return render({'Status': False, 'Comment': 'Error', 'Errors': 'Last-Event-ID must be integer'}, status=400)
+    if last_event_id is not None:
+        last_event_id = int(last_event_id)
+    response = StreamingHttpResponse(get_bus().stream(user.id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def read_view(view_class, async_get, login_required=True):
+    sync_view = view_class.as_view()
+    if not settings.ASYNC_READ_VIEWS:
+        return sync_view
+    async_view = authenticated(async_get, required=login_required)
+    sync_handler = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_view(request, *args, **kwargs)
+        return await sync_handler(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
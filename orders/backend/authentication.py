@@ -0,0 +1,114 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    # Entries live in this process for at most `ttl` seconds and are checked against a per-user version in
+    # the shared cache, which invalidate_user replaces, so a change made by one worker is seen by all of them.
+    def __init__(self, ttl, max_size, shared):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._user_keys = {}
+
+    @staticmethod
+    def version_key(user_id):
+        return f'token-user:{user_id}'
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            return entry
+
+    def _fresh(self, key, entry, version):
+        with self._lock:
+            if entry[1] != version:
+                self._remove(key)
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def get(self, key):
+        entry = self._entry(key)
+        return entry and self._fresh(key, entry, self.shared.get(self.version_key(entry[2][0].id)))
+
+    async def aget(self, key):
+        entry = self._entry(key)
+        return entry and self._fresh(key, entry, await self.shared.aget(self.version_key(entry[2][0].id)))
+
+    def set(self, key, value, version):
+        # `version` has to be read before `value` is loaded, so a change made in between leaves the entry stale
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._user_keys.setdefault(value[0].id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def version(self, user_id):
+        return self.shared.get(self.version_key(user_id))
+
+    async def aversion(self, user_id):
+        return await self.shared.aget(self.version_key(user_id))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            user_id = entry[2][0].id
+            keys = self._user_keys.get(user_id, set())
+            keys.discard(key)
+            if not keys:
+                self._user_keys.pop(user_id, None)
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        # a new, never reused version; it only has to outlive entries cached before it, i.e. `ttl`
+        self.shared.set(self.version_key(user_id), time.time_ns(), self.ttl)
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_TTL, settings.TOKEN_CACHE_SIZE, caches[settings.TOKEN_CACHE])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            user_id = self.get_model().objects.filter(key=key).values_list('user_id', flat=True).first()
+            version = token_cache.version(user_id)
+            cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached, version)
+        user, token = cached
+        return copy.copy(user), token
@@ -0,0 +1,159 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+
+from .models import Order, OrderItem, ProductInfo
+
+
+def basket_total(order_id):
+    # order items can be on a shard while prices are in the catalog, so they are not joined
+    items = list(OrderItem.objects.filter(order_id=order_id).values_list('product_info_id', 'quantity'))
+    prices = dict(ProductInfo.objects.filter(id__in={offer_id for offer_id, quantity in items})
+                  .values_list('id', 'price'))
+    return sum(prices.get(offer_id, 0) * quantity for offer_id, quantity in items)
+
+
+class BasketBusy(Exception):
+    pass
+
+
+class CacheBasket:
+    # Changes run under a per-user lock taken with cache.add (atomic on every backend), so concurrent
+    # requests of one user do not overwrite each other. BASKET_CACHE must be shared by all workers.
+    poll_interval = 0.01
+    # the Order row's updated_at is refreshed at most this often (seconds), so maintenance keeps baskets in use
+    touch_interval = 24 * 60 * 60
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.key = f'basket:{user_id}'
+        self.lock_key = f'basket-lock:{user_id}'
+        self.cache = caches[settings.BASKET_CACHE]
+
+    def acquire(self):
+        # an abandoned lock expires after BASKET_LOCK_TIMEOUT
+        deadline = time.monotonic() + settings.BASKET_LOCK_TIMEOUT
+        while not self.cache.add(self.lock_key, True, settings.BASKET_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise BasketBusy('Basket is being changed by another request')
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        self.cache.delete(self.lock_key)
+
+    @contextmanager
+    def locked(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def load(self):
+        return self.cache.get(self.key)
+
+    def save(self, basket):
+        now = time.time()
+        if now - basket.get('touched', 0) >= self.touch_interval:
+            Order.objects.filter(id=basket['id']).update(updated_at=timezone.now())
+            basket['touched'] = now
+        self.cache.set(self.key, basket, settings.BASKET_CACHE_TTL)
+
+    def clear(self):
+        self.cache.delete(self.key)
+
+    def load_or_create(self):
+        basket = self.load()
+        if basket is None:
+            order, i = Order.objects.get_or_create(user_id=self.user_id, state='new')
+            basket = {'id': order.id, 'dt': DateTimeField().to_representation(order.dt),
+                      'next_item_id': 1, 'items': {}}
+        return basket
+
+    def add(self, items):
+        with self.locked():
+            basket = self.load_or_create()
+            for item in items:
+                basket['items'][basket['next_item_id']] = {'product_info': item['product_info'],
+                                                           'quantity': item['quantity']}
+                basket['next_item_id'] += 1
+            self.save(basket)
+        return len(items)
+
+    def update(self, items):
+        with self.locked():
+            basket = self.load()
+            if basket is None:
+                return 0
+            updated = 0
+            for item in items:
+                if item['id'] in basket['items']:
+                    basket['items'][item['id']]['quantity'] = item['quantity']
+                    updated += 1
+            self.save(basket)
+        return updated
+
+    def delete(self, ids):
+        with self.locked():
+            basket = self.load()
+            if basket is None:
+                return 0
+            deleted = 0
+            for item_id in ids:
+                if basket['items'].pop(item_id, None) is not None:
+                    deleted += 1
+            self.save(basket)
+        return deleted
+
+    def to_representation(self):
+        basket = self.load()
+        if basket is None:
+            return []
+        items = basket['items']
+        prices = ProductInfo.objects.in_bulk({item['product_info'] for item in items.values()})
+        order_items = []
+        total_sum = 0
+        for item_id, item in items.items():
+            pi = prices.get(item['product_info'])
+            if pi is None:
+                continue
+            total_sum += pi.price * item['quantity']
+            order_items.append({'id': item_id, 'quantity': item['quantity'],
+                                'product_info': {'name': pi.name, 'price': pi.price, 'price_rrc': pi.price_rrc}})
+        return [{'id': basket['id'], 'user': self.user_id, 'dt': basket['dt'], 'state': 'new',
+                 'total_sum': total_sum, 'order_item': order_items}]
+
+    def checkout(self, order_id):
+        # the lock is held until the basket is cleared after commit, so no change can slip in between
+        self.acquire()
+        try:
+            is_updated = self._checkout(order_id)
+        except BaseException:
+            self.release()
+            raise
+        transaction.on_commit(self.release)
+        return is_updated
+
+    def _checkout(self, order_id):
+        basket = self.load()
+        with transaction.atomic():
+            order = Order.objects.filter(user_id=self.user_id, id=order_id)
+            if basket is not None and basket['id'] == order_id:
+                # the basket can outlive its Order row (e.g. purged by maintenance); it is put back under its id
+                Order.objects.get_or_create(id=order_id, defaults={'user_id': self.user_id, 'state': 'new'})
+                existing = set(ProductInfo.objects.filter(
+                    id__in={item['product_info'] for item in basket['items'].values()}).values_list('id', flat=True))
+                OrderItem.objects.bulk_create([
+                    OrderItem(order_id=order_id, product_info_id=item['product_info'], quantity=item['quantity'])
+                    for item in basket['items'].values() if item['product_info'] in existing
+                ])
+                is_updated = order.update(state='in_progress', total_sum=basket_total(order_id))
+                transaction.on_commit(self.clear)
+            else:
+                is_updated = order.update(state='in_progress')
+        return is_updated
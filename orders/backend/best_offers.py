@@ -0,0 +1,47 @@
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models import Count, Min
+
+from .models import BestOffer, ProductInfo
+
+# advisory lock serializing refreshes, so the last one to run sees every committed offer change
+LOCK_KEY = 0x424f
+BATCH_SIZE = 1000
+
+
+def _offers(product_ids):
+    return ProductInfo.objects.filter(product_id__in=product_ids, quantity__gt=0, shop__state=True)
+
+
+def refresh_best_offers(product_ids):
+    product_ids = sorted(set(product_ids))
+    refreshed = 0
+    for index in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[index:index + BATCH_SIZE]
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_KEY])
+            stats = {row[0]: row for row in _offers(batch)
+                     .values_list('product_id', 'product__name', 'product__category_id')
+                     .annotate(Min('price'), Count('shop_id', distinct=True)).order_by()}
+            cheapest = _offers(batch).order_by('product_id', 'price', 'shop_id')
+            if connection.features.can_distinct_on_fields:
+                cheapest = cheapest.distinct('product_id')
+            best_shops = {}
+            for product_id, shop_id in cheapest.values_list('product_id', 'shop_id'):
+                best_shops.setdefault(product_id, shop_id)
+            BestOffer.objects.bulk_create(
+                [BestOffer(product_id=product_id, name=name, category_id=category_id, min_price=min_price,
+                           shop_count=shops, best_shop_id=best_shops[product_id])
+                 for product_id, name, category_id, min_price, shops in stats.values()],
+                update_conflicts=True, unique_fields=['product'],
+                update_fields=['name', 'category', 'min_price', 'shop_count', 'best_shop'])
+            BestOffer.objects.filter(product_id__in=set(batch) - set(stats)).delete()
+            refreshed += len(batch)
+    return refreshed
+
+
+def schedule_refresh(product_ids):
+    transaction.on_commit(partial(refresh_best_offers, list(product_ids)))
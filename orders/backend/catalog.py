@@ -0,0 +1,78 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from .models import Category, ProductInfo, ShopCategory
+
+VERSION_KEY = 'catalog:version'
+
+
+def _cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def catalog_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+
+
+def build_catalog(using='default'):
+    categories = {category['id']: dict(category, offers=0, shops={})
+                  for category in Category.objects.using(using).order_by('id').values('id', 'name')}
+    links = (ShopCategory.objects.using(using).filter(shop__state=True)
+             .values_list('category_id', 'shop_id', 'shop__name').order_by('shop_id'))
+    for category_id, shop_id, name in links:
+        categories[category_id]['shops'][shop_id] = {'id': shop_id, 'name': name, 'offers': 0}
+    counts = (ProductInfo.objects.using(using).filter(shop__state=True)
+              .values_list('product__category_id', 'shop_id').annotate(offers=Count('id')).order_by())
+    for category_id, shop_id, offers in counts:
+        category = categories[category_id]
+        category['offers'] += offers
+        shop = category['shops'].get(shop_id)
+        if shop is not None:
+            shop['offers'] = offers
+    return [dict(category, shops=list(category['shops'].values())) for category in categories.values()]
+
+
+class CatalogTree:
+    def __init__(self):
+        self.rendered = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = catalog_version()
+        rendered = self.rendered
+        if rendered[0] != version:
+            with self._lock:
+                rendered = self.rendered
+                if rendered[0] != version:
+                    rendered = self.rendered = (version, JSONRenderer().render(build_catalog()))
+        return rendered
+
+
+catalog_tree = CatalogTree()
+
+
+def catalog_view(request):
+    version, content = catalog_tree.get()
+    etag = f'"catalog-{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+    return HttpResponse(content, content_type='application/json', headers={'ETag': etag})
@@ -0,0 +1,10 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def shared_cache_check(app_configs, **kwargs):
+    if settings.CACHES['shared']['BACKEND'].endswith('LocMemCache'):
+        return [Warning("The 'shared' cache is kept per process, so workers do not see each other's baskets, "
+                        "placements and invalidations.", hint='Set REDIS_URL.', id='backend.W001')]
+    return []
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import name_key
+
+# natural keys of the deduplicated models; works with the historical models of migrations too
+NATURAL_KEYS = {'Product': ('category_id', 'name_key'), 'Parameter': ('name_key',)}
+
+
+def fill_name_keys(model, batch_size=1000):
+    rows = [model(id=row_id, name_key=name_key(name))
+            for row_id, name in model.objects.filter(name_key='').values_list('id', 'name').iterator()]
+    model.objects.bulk_update(rows, ['name_key'], batch_size=batch_size)
+    return len(rows)
+
+
+def merge_duplicates(model, dry_run=False):
+    # keeps the oldest row of every natural key, repoints foreign keys to it and deletes the rest
+    fields = NATURAL_KEYS[model.__name__]
+    groups = (model.objects.values(*fields).annotate(rows=Count('id'), keep=Min('id'))
+              .filter(rows__gt=1).order_by())
+    relations = [(related.related_model, related.field.name) for related in model._meta.related_objects
+                 if not related.many_to_many]
+    merged = 0
+    for group in groups:
+        keep = group.pop('keep')
+        del group['rows']
+        duplicates = list(model.objects.filter(**group).exclude(id=keep).values_list('id', flat=True))
+        merged += len(duplicates)
+        if dry_run:
+            continue
+        with transaction.atomic():
+            for related_model, field in relations:
+                related_model.objects.filter(**{f'{field}__in': duplicates}).update(**{field: keep})
+            model.objects.filter(id__in=duplicates).delete()
+    return merged
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import OrderItem, ProductInfo
+
+
+class MemoryBackend:
+    # Numbers events and keeps the last `buffer` of them for Last-Event-ID resumes. Ids start at the
+    # microsecond clock so they keep growing across restarts. Other backends (e.g. Redis pub/sub for several
+    # processes) implement the same publish/listen/since and call the listeners with every event they receive.
+    def __init__(self, buffer=10000):
+        self._ids = itertools.count(time.time_ns() // 1000)
+        self._events = deque(maxlen=buffer)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def listen(self, callback):
+        self._listeners.append(callback)
+
+    def publish(self, partner_ids, name, data):
+        with self._lock:
+            event = (next(self._ids), frozenset(partner_ids), name, data)
+            self._events.append(event)
+            for callback in self._listeners:
+                callback(event)
+        return event[0]
+
+    def since(self, partner_id, last_id):
+        with self._lock:
+            events = list(itertools.takewhile(lambda event: event[0] > last_id, reversed(self._events)))
+        return [event for event in reversed(events) if partner_id in event[1]]
+
+
+class Subscription:
+    __slots__ = ('partner_id', 'loop', 'queue', 'lost')
+
+    def __init__(self, partner_id, queue_size):
+        self.partner_id = partner_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.lost = False
+
+
+def _deliver(subscriptions, event):
+    for subscription in subscriptions:
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a stalled client is dropped after it drains its queue and resumes from the buffer on reconnect
+            subscription.lost = True
+
+
+class EventBus:
+    def __init__(self, backend, queue_size):
+        self.backend = backend
+        self.queue_size = queue_size
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        backend.listen(self._dispatch)
+
+    def publish(self, partner_ids, name, data):
+        if partner_ids:
+            return self.backend.publish(partner_ids, name, data)
+
+    def subscribe(self, partner_id):
+        subscription = Subscription(partner_id, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(partner_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.partner_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.partner_id, None)
+
+    def _dispatch(self, event):
+        # one wakeup per event loop, however many connections it serves
+        loops = {}
+        with self._lock:
+            for partner_id in event[1]:
+                for subscription in self._subscriptions.get(partner_id, ()):
+                    loops.setdefault(subscription.loop, []).append(subscription)
+        for loop, subscriptions in loops.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, subscriptions, event)
+            except RuntimeError:
+                pass
+
+    async def stream(self, partner_id, last_event_id=None):
+        subscription = self.subscribe(partner_id)
+        try:
+            last = -1
+            if last_event_id is not None:
+                for event in self.backend.since(partner_id, last_event_id):
+                    last = event[0]
+                    yield format_event(event)
+            yield ': connected\n\n'
+            while not (subscription.lost and subscription.queue.empty()):
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), settings.ORDER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event[0] > last:
+                    last = event[0]
+                    yield format_event(event)
+        finally:
+            self.unsubscribe(subscription)
+
+
+def format_event(event):
+    event_id, partner_ids, name, data = event
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                config = settings.ORDER_EVENTS_BACKEND
+                backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+                _bus = EventBus(backend, settings.ORDER_EVENTS_QUEUE_SIZE)
+    return _bus
+
+
+def publish_orders(order_ids, name, state, using=None):
+    # order items may live on a shard, so the offers' partners are looked up separately in the catalog
+    items = OrderItem.objects.using(using) if using else OrderItem.objects
+    items = list(items.filter(order_id__in=order_ids).values_list('order_id', 'product_info_id').distinct())
+    owners = dict(ProductInfo.objects.filter(id__in={offer_id for order_id, offer_id in items})
+                  .values_list('id', 'shop__user_id'))
+    partners = {}
+    for order_id, offer_id in items:
+        if offer_id in owners:
+            partners.setdefault(order_id, set()).add(owners[offer_id])
+    bus = get_bus()
+    for order_id in sorted(partners):
+        bus.publish(partners[order_id], name, {'order': order_id, 'state': state})
@@ -0,0 +1,147 @@
+import csv
+import itertools
+import zlib
+
+import yaml
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS
+from django.http import StreamingHttpResponse
+
+from .models import Category, OrderItem, ProductInfo, ProductParameter
+from .sharding import get_shard_map
+
+ORDER_COLUMNS = ('order', 'dt', 'state', 'offer', 'external_id', 'model', 'quantity', 'price', 'sum')
+
+
+def _buffered(chunks, compress):
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer, size = [], 0
+    for chunk in chunks:
+        chunk = chunk.encode()
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= settings.EXPORT_BUFFER_BYTES:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    yield compressor.compress(data) + compressor.flush() if compressor else data
+
+
+async def _iterate_async(iterator):
+    # under ASGI the export is produced chunk by chunk in the request's sync thread, which owns its connection
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(iterator, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def accepts_gzip(accept_encoding):
+    # gzip, x-gzip or '*' with a q-value above zero
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = (part.strip() for part in coding.split(';'))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+
+def stream_response(request, chunks, content_type, filename):
+    compress = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    content = _buffered(chunks, compress)
+    # views pass the DRF request, which wraps Django's
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        content = _iterate_async(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _dump(data):
+    return yaml.dump(data, allow_unicode=True, sort_keys=False, width=1000)
+
+
+def _indent(text):
+    return ''.join(f'  {line}' for line in text.splitlines(keepends=True))
+
+
+def catalog_chunks(shop):
+    # offers and their parameters come from two server-side cursors walked in product_info order
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    yield _dump({'shop': shop.name})
+    categories = Category.objects.filter(shop_category__shop=shop).order_by('id').values('id', 'name')
+    yield 'categories:\n'
+    for category in categories.iterator(chunk_size=chunk_size):
+        yield _indent(_dump([category]))
+    yield '\ngoods:\n'
+    offers = (ProductInfo.objects.filter(shop=shop).order_by('id')
+              .values_list('id', 'external_id', 'product__category_id', 'name', 'product__name', 'price',
+                           'price_rrc', 'quantity'))
+    parameters = (ProductParameter.objects.filter(product_info__shop=shop).order_by('product_info_id', 'id')
+                  .values_list('product_info_id', 'parameter__name', 'value').iterator(chunk_size=chunk_size))
+    parameter = next(parameters, None)
+    for offer_id, external_id, category_id, model, name, price, price_rrc, quantity in \
+            offers.iterator(chunk_size=chunk_size):
+        values = {}
+        while parameter is not None and parameter[0] <= offer_id:
+            if parameter[0] == offer_id:
+                values[parameter[1]] = parameter[2]
+            parameter = next(parameters, None)
+        yield _indent(_dump([{'id': external_id, 'category': category_id, 'model': model, 'name': name,
+                              'price': price, 'price_rrc': price_rrc, 'quantity': quantity,
+                              'parameters': values}]))
+
+
+class _Line:
+    def write(self, value):
+        return value
+
+
+def _shard_items(alias, user_id, state):
+    # no catalog on this shard: walk the partner's offers in chunks and look up their order items
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    offers = (ProductInfo.objects.filter(shop__user_id=user_id).order_by('id')
+              .values_list('id', 'external_id', 'name', 'price').iterator(chunk_size=chunk_size))
+    while chunk := {offer_id: details for offer_id, *details in itertools.islice(offers, chunk_size)}:
+        items = OrderItem.objects.using(alias).filter(product_info_id__in=chunk)
+        if state:
+            items = items.filter(order__state=state)
+        for order_id, dt, order_state, offer_id, quantity in items.order_by('order_id', 'id').values_list(
+                'order_id', 'order__dt', 'order__state', 'product_info_id', 'quantity').iterator(chunk_size=chunk_size):
+            external_id, model, price = chunk[offer_id]
+            yield order_id, dt, order_state, offer_id, external_id, model, quantity, price
+
+
+def order_chunks(user_id, state=None):
+    writer = csv.writer(_Line())
+    yield writer.writerow(ORDER_COLUMNS)
+    for alias in get_shard_map().shards:
+        if alias == DEFAULT_DB_ALIAS:
+            items = OrderItem.objects.using(alias).filter(product_info__shop__user_id=user_id)
+            if state:
+                items = items.filter(order__state=state)
+            items = items.order_by('order_id', 'id').values_list(
+                'order_id', 'order__dt', 'order__state', 'product_info_id', 'product_info__external_id',
+                'product_info__name', 'quantity', 'product_info__price').iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        else:
+            items = _shard_items(alias, user_id, state)
+        for order_id, dt, order_state, offer_id, external_id, model, quantity, price in items:
+            yield writer.writerow((order_id, dt.isoformat(), order_state, offer_id, external_id, model, quantity,
+                                   price, quantity * price))
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyMismatch(Exception):
+    pass
+
+
+class MemoryIdempotencyStore:
+    def __init__(self, ttl, max_keys):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()
+        self._in_flight = {}
+
+    def reserve(self, key, fingerprint, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._purge(time.monotonic())
+                if key in self._responses:
+                    expires, stored_fingerprint, status, data = self._responses[key]
+                    if stored_fingerprint != fingerprint:
+                        raise IdempotencyMismatch(key)
+                    return status, data
+                if key not in self._in_flight:
+                    self._in_flight[key] = (threading.Event(), fingerprint)
+                    return None
+                event, stored_fingerprint = self._in_flight[key]
+                if stored_fingerprint != fingerprint:
+                    raise IdempotencyMismatch(key)
+            if not event.wait(deadline - time.monotonic()):
+                raise IdempotencyConflict(key)
+
+    def save(self, key, status, data):
+        with self._lock:
+            event, fingerprint = self._in_flight.pop(key)
+            self._responses[key] = (time.monotonic() + self.ttl, fingerprint, status, data)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_keys:
+                self._responses.popitem(last=False)
+            event.set()
+
+    def release(self, key):
+        with self._lock:
+            self._in_flight.pop(key)[0].set()
+
+    def _purge(self, now):
+        while self._responses:
+            key, (expires, fingerprint, status, data) = next(iter(self._responses.items()))
+            if expires > now:
+                break
+            del self._responses[key]
+
+
+class DatabaseIdempotencyStore:
+    poll_interval = 0.05
+
+    def __init__(self, ttl, lease):
+        self.ttl = ttl
+        self.lease = lease
+
+    def reserve(self, key, fingerprint, timeout):
+        # the reservation holds until the first request saves or releases it, or for `lease` seconds if its worker
+        # died; save() keeps the response for the full TTL
+        deadline = time.monotonic() + timeout
+        while True:
+            now = timezone.now()
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(key=key, fingerprint=fingerprint,
+                                                  expires=now + timedelta(seconds=self.lease))
+                return None
+            except IntegrityError:
+                pass
+            row = IdempotencyKey.objects.filter(key=key).values('fingerprint', 'status', 'response', 'expires').first()
+            if row is None:
+                continue
+            if row['expires'] <= now:
+                IdempotencyKey.objects.filter(key=key, expires__lte=now).delete()
+                continue
+            if row['fingerprint'] != fingerprint:
+                raise IdempotencyMismatch(key)
+            if row['status'] is not None:
+                return row['status'], row['response']
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict(key)
+            time.sleep(self.poll_interval)
+
+    def save(self, key, status, data):
+        IdempotencyKey.objects.filter(key=key).update(status=status, response=data,
+                                                      expires=timezone.now() + timedelta(seconds=self.ttl))
+
+    def release(self, key):
+        IdempotencyKey.objects.filter(key=key, status__isnull=True).delete()
+
+    @staticmethod
+    def purge_expired():
+        return IdempotencyKey.objects.filter(expires__lte=timezone.now()).delete()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.IDEMPOTENCY_BACKEND == 'db':
+                    _store = DatabaseIdempotencyStore(settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_LEASE)
+                else:
+                    _store = MemoryIdempotencyStore(settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_MAX_KEYS)
+    return _store
+
+
+def fingerprint(request):
+    data = request.data
+    data = sorted(data.lists()) if hasattr(data, 'lists') else data
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def idempotent(method):
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        header = request.META.get(IDEMPOTENCY_HEADER)
+        if not header or not request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        if len(header) > 255:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Idempotency-Key is too long'}, status=400)
+        scope = f'{request.user.id}:{request.method}:{request.path}:{header}'
+        key = hashlib.sha256(scope.encode()).hexdigest()
+        store = get_store()
+        try:
+            stored = store.reserve(key, fingerprint(request), settings.IDEMPOTENCY_WAIT_TIMEOUT)
+        except IdempotencyConflict:
+            return Response({'Status': False, 'Comment': 'Error',
+                             'Errors': 'Request with this Idempotency-Key is in progress'}, status=409)
+        except IdempotencyMismatch:
+            return Response({'Status': False, 'Comment': 'Error',
+                             'Errors': 'Idempotency-Key was used with a different request'}, status=422)
+        if stored is not None:
+            status, data = stored
+            response = Response(data, status=status)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            store.release(key)
+            raise
+        if response.status_code < 500:
+            store.save(key, response.status_code, response.data)
+        else:
+            store.release(key)
+        return response
+
+    return wrapper
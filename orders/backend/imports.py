@@ -0,0 +1,166 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+from requests import get
+from yaml import load as load_yaml, Loader
+
+from .best_offers import schedule_refresh
+from .catalog import bump_catalog_version
+from .metrics import IMPORT_ROWS, IMPORT_ROWS_PER_SECOND, IMPORT_SECONDS
+from .models import Category, Parameter, Product, ProductInfo, ProductParameter, Shop, name_key
+from .price_history import record_prices
+from .stock import replace_shop_stock
+
+# first key of the advisory locks: (namespace, partner id) serializes a shop, (slot namespace, n) caps imports
+LOCK_NAMESPACE = 0x494d
+SLOT_NAMESPACE = 0x494e
+
+
+class ImportBusy(Exception):
+    pass
+
+
+def _lock_shop(user_id):
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [LOCK_NAMESPACE, user_id])
+        if not settings.IMPORT_DB_SLOTS:
+            return
+        deadline = time.monotonic() + settings.IMPORT_QUEUE_TIMEOUT
+        while True:
+            for slot in range(settings.IMPORT_DB_SLOTS):
+                cursor.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', [SLOT_NAMESPACE, slot])
+                if cursor.fetchone()[0]:
+                    return
+            if time.monotonic() > deadline:
+                raise ImportBusy('All import slots are busy')
+            time.sleep(0.05)
+
+
+def import_price_list(user_id, url):
+    data = load_yaml(get(url).content, Loader=Loader)
+    started = time.perf_counter()
+    goods = data['goods']
+    with transaction.atomic():
+        _lock_shop(user_id)
+        shop, i = Shop.objects.get_or_create(name=data['shop'], url=url, user_id=user_id)
+        categories = sorted(data['categories'], key=lambda category: category['id'])
+        Category.objects.bulk_create([Category(id=category['id'], name=category['name']) for category in categories],
+                                     update_conflicts=True, unique_fields=['id'], update_fields=['name'])
+        shop.categories.add(*(category['id'] for category in categories))
+        previous_products = set(ProductInfo.objects.filter(shop_id=shop.id).values_list('product_id', flat=True))
+        ProductInfo.objects.filter(shop_id=shop.id).delete()
+        products = {}
+        parameters = {}
+        in_stock = {}
+        for item in goods:
+            in_stock[item['category']] = in_stock.get(item['category'], 0) + (item['quantity'] > 0)
+            key = (item['category'], name_key(item['name']))
+            products.setdefault(key, Product(name=item['name'], name_key=key[1], category_id=item['category']))
+            for name in item['parameters']:
+                parameters.setdefault(name_key(name), Parameter(name=name, name_key=name_key(name)))
+        # upserts lock the conflicting rows; a fixed key order keeps concurrent imports from deadlocking
+        Product.objects.bulk_create([products[key] for key in sorted(products)], update_conflicts=True,
+                                    unique_fields=['category', 'name_key'], update_fields=['name'])
+        Parameter.objects.bulk_create([parameters[key] for key in sorted(parameters)], update_conflicts=True,
+                                      unique_fields=['name_key'], update_fields=['name'])
+        product_infos = ProductInfo.objects.bulk_create(
+            ProductInfo(product=products[item['category'], name_key(item['name'])], external_id=item['id'],
+                        name=item['model'], price=item['price'], price_rrc=item['price_rrc'],
+                        quantity=item['quantity'], shop_id=shop.id) for item in goods)
+        ProductParameter.objects.bulk_create(
+            ProductParameter(product_info=product_info, parameter=parameters[name_key(name)], value=value)
+            for item, product_info in zip(goods, product_infos) for name, value in item['parameters'].items())
+        record_prices(shop.id, [(item['id'], product_info.product_id, item['price'], item['price_rrc'],
+                                 item['quantity']) for item, product_info in zip(goods, product_infos)])
+        replace_shop_stock(shop.id, in_stock)
+        schedule_refresh(previous_products | {product.id for product in products.values()})
+        transaction.on_commit(bump_catalog_version)
+    elapsed = time.perf_counter() - started
+    IMPORT_ROWS.inc(len(goods))
+    IMPORT_SECONDS.inc(elapsed)
+    IMPORT_ROWS_PER_SECOND.set(len(goods) / elapsed if elapsed else 0)
+    return len(goods)
+
+
+class _Batch:
+    __slots__ = ('job', 'future', 'turn', 'claimed')
+
+    def __init__(self, job=None, claimed=False):
+        self.job = job
+        self.future = Future()
+        self.turn = threading.Event()
+        self.claimed = claimed
+
+
+class ImportCoordinator:
+    # One run per shop at a time in this process. Requests arriving while a shop is importing join a single
+    # pending batch that runs the latest of them once; every caller of the batch gets its result. At most
+    # max_concurrency runs hold a slot at once, the rest wait up to queue_timeout and fail with ImportBusy.
+    def __init__(self, max_concurrency, queue_timeout):
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pending = {}
+        self.runs = 0
+        self.coalesced = 0
+
+    def run(self, key, job):
+        with self._lock:
+            if key in self._running:
+                batch = self._pending.get(key)
+                if batch is None:
+                    batch = self._pending[key] = _Batch()
+                else:
+                    self.coalesced += 1
+                batch.job = job
+                leader = False
+            else:
+                self._running.add(key)
+                batch = _Batch(job, claimed=True)
+                leader = True
+        if not leader:
+            batch.turn.wait()
+            with self._lock:
+                leader = not batch.claimed
+                batch.claimed = True
+        if leader:
+            self._execute(key, batch)
+        return batch.future.result()
+
+    def _execute(self, key, batch):
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise ImportBusy('Too many imports are running')
+            try:
+                self.runs += 1
+                batch.future.set_result(batch.job())
+            finally:
+                self._slots.release()
+        except Exception as error:
+            batch.future.set_exception(error)
+        finally:
+            with self._lock:
+                next_batch = self._pending.pop(key, None)
+                if next_batch is None:
+                    self._running.discard(key)
+            if next_batch is not None:
+                next_batch.turn.set()
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator():
+    global _coordinator
+    if _coordinator is None:
+        with _coordinator_lock:
+            if _coordinator is None:
+                _coordinator = ImportCoordinator(settings.IMPORT_MAX_CONCURRENCY, settings.IMPORT_QUEUE_TIMEOUT)
+    return _coordinator
@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken, get_password_reset_token_expiry_time
+from rest_framework.authtoken.models import Token
+
+from .models import ConfirmToken, EmailOutbox, IdempotencyKey, Order
+from .sharding import get_shard_map
+
+
+def _ago(seconds):
+    return timezone.now() - timedelta(seconds=seconds)
+
+
+# name -> rows to purge on a shard; run once per database in DATABASE_SHARDS
+SHARDED_TASKS = {
+    'abandoned baskets': lambda alias: Order.objects.using(alias).filter(
+        state='new', updated_at__lt=_ago(settings.MAINTENANCE_BASKET_TTL)),
+}
+# name -> rows to purge; each query is evaluated again for every batch
+TASKS = {
+    'confirm tokens': lambda: ConfirmToken.objects.filter(created_at__lt=_ago(settings.MAINTENANCE_CONFIRM_TOKEN_TTL)),
+    'inactive user tokens': lambda: Token.objects.filter(user__is_active=False),
+    'password reset tokens': lambda: ResetPasswordToken.objects.filter(
+        created_at__lt=_ago(get_password_reset_token_expiry_time() * 60 * 60)),
+    'sent emails': lambda: EmailOutbox.objects.filter(state='sent', created__lt=_ago(settings.MAINTENANCE_OUTBOX_TTL)),
+    'idempotency keys': lambda: IdempotencyKey.objects.filter(expires__lte=timezone.now()),
+}
+
+
+def off_peak():
+    return timezone.localtime().hour not in settings.MAINTENANCE_PEAK_HOURS
+
+
+def purge(rows, batch_size, duty_cycle, wait_off_peak=True, sleep=time.sleep):
+    # Deletes in batches of at most batch_size rows, one short transaction each (related rows such as a
+    # basket's items go with it). After a batch that took t seconds it sleeps t * (1 - duty_cycle) / duty_cycle.
+    removed = 0
+    while True:
+        while wait_off_peak and not off_peak():
+            sleep(60)
+        started = time.monotonic()
+        ids = list(rows().order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        with transaction.atomic(using=rows().db):
+            rows().filter(pk__in=ids).delete()
+        removed += len(ids)
+        if len(ids) < batch_size:
+            return removed
+        sleep((time.monotonic() - started) * (1 - duty_cycle) / duty_cycle)
+
+
+def run_maintenance(batch_size=None, duty_cycle=None, wait_off_peak=True, sleep=time.sleep):
+    batch_size = batch_size or settings.MAINTENANCE_BATCH_SIZE
+    duty_cycle = duty_cycle or settings.MAINTENANCE_DUTY_CYCLE
+    removed = {name: sum(purge(partial(rows, alias), batch_size, duty_cycle, wait_off_peak, sleep)
+                         for alias in get_shard_map().shards)
+               for name, rows in SHARDED_TASKS.items()}
+    removed.update((name, purge(rows, batch_size, duty_cycle, wait_off_peak, sleep)) for name, rows in TASKS.items())
+    return removed
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.loadclient import HttpClient, summarize
+
+DEFAULT_PATHS = ['/api/v1/products', '/api/v1/categories', '/api/v1/shops', '/api/v1/basket', '/api/v1/order']
+
+
+class Command(BaseCommand):
+    help = ('Compare requests/sec and latency percentiles of running servers under many concurrent clients, '
+            'e.g. --target wsgi=http://127.0.0.1:8000 (gunicorn orders.wsgi) '
+            '--target asgi=http://127.0.0.1:8001 (uvicorn orders.asgi:application with ASYNC_READ_VIEWS=true)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, help='NAME=BASE_URL, may be repeated')
+        parser.add_argument('--path', action='append', help='Request path, may be repeated')
+        parser.add_argument('--token', help='API token sent with every request')
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep:
+                raise CommandError(f'Target must be NAME=BASE_URL, got {target}')
+            targets.append((name, url))
+        paths = options['path'] or DEFAULT_PATHS
+        results = {}
+        for name, url in targets:
+            results[name] = asyncio.run(self.run(url, paths, options))
+            self.stdout.write(f"{name}: {results[name]['rps']:.1f} req/s, p50 {results[name]['p50_ms']:.1f} ms, "
+                              f"p99 {results[name]['p99_ms']:.1f} ms, {results[name]['errors']} errors")
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    async def run(self, url, paths, options):
+        latencies = []
+        errors = 0
+        deadline = time.monotonic() + options['duration']
+
+        async def client(number):
+            nonlocal errors
+            http = HttpClient(url)
+            if options['token']:
+                http.headers['Authorization'] = f"Token {options['token']}"
+            request_number = number
+            while time.monotonic() < deadline:
+                path = paths[request_number % len(paths)]
+                request_number += 1
+                started = time.perf_counter()
+                try:
+                    response = await http.request('GET', path)
+                    if response.status >= 400:
+                        errors += 1
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+            await http.close()
+
+        started = time.monotonic()
+        await asyncio.gather(*(client(number) for number in range(options['clients'])))
+        return summarize(latencies, errors, time.monotonic() - started)
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.postgresql.base import DatabaseWrapper as DirectDatabaseWrapper
+
+from backend.loadclient import summarize
+from backend.pooled_postgresql.base import DatabaseWrapper as PooledDatabaseWrapper
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of opening a database connection with and without the pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        results = {}
+        for name, wrapper_class in (('direct', DirectDatabaseWrapper), ('pooled', PooledDatabaseWrapper)):
+            wrapper = wrapper_class(settings_dict, alias=f"bench-{name}")
+            latencies = []
+            started = time.monotonic()
+            for i in range(options['requests']):
+                request_started = time.perf_counter()
+                wrapper.ensure_connection()
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                wrapper.close()
+                latencies.append(time.perf_counter() - request_started)
+            results[name] = summarize(latencies, 0, time.monotonic() - started)
+            self.stdout.write(f"{name}: p50 {results[name]['p50_ms']:.2f} ms, p99 {results[name]['p99_ms']:.2f} ms")
+        self.stdout.write(f'pool: {wrapper.pool.stats()}')
+        wrapper.pool.close_all()
+        saved = results['direct']['p50_ms'] - results['pooled']['p50_ms']
+        self.stdout.write(f'Saved per request (p50): {saved:.2f} ms')
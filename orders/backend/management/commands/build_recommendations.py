@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from backend.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = ('Update the "frequently bought together" table behind products/<id>/related with the orders completed '
+            'since the last run. Schedule it (e.g. hourly); the first run and --full rebuild from every completed '
+            'order.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Discard the stored matrix and start over')
+        parser.add_argument('--top', type=int, help='Neighbours kept per product')
+        parser.add_argument('--batch-lines', type=int, help='Order lines read per block')
+
+    def handle(self, *args, **options):
+        refreshed = build_recommendations(options['full'], options['top'], options['batch_lines'])
+        self.stdout.write(f'{refreshed} products refreshed')
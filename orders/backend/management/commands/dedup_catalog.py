@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.dedup import fill_name_keys, merge_duplicates
+from backend.models import Parameter, Product
+
+
+class Command(BaseCommand):
+    help = ('Merge products and parameters whose normalized names collide, repointing offers and product '
+            'parameters to the oldest row. Run it between migrations 0023 and 0024 to keep the unique '
+            'index migration short on large catalogs; 0024 runs the same merge otherwise.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would be merged')
+
+    def handle(self, *args, **options):
+        for model in (Parameter, Product):
+            filled = 0 if options['dry_run'] else fill_name_keys(model)
+            merged = merge_duplicates(model, dry_run=options['dry_run'])
+            self.stdout.write(f'{model.__name__}: {filled} name keys filled, '
+                              f'{merged} duplicates {"found" if options["dry_run"] else "merged"}')
@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backend.outbox import drain
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox in batches over one SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = drain(options['batch_size'])
+            if sent:
+                self.stdout.write(f'{sent} emails sent')
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from backend.loadclient import HttpClient, summarize
+from backend.models import ConfirmToken, EmailOutbox, ProductInfo, User
+
+EMAIL_PREFIX = 'loadtest-'
+STUB_EMAIL_BACKENDS = ('django.core.mail.backends.dummy.EmailBackend', 'django.core.mail.backends.locmem.EmailBackend',
+                       'django.core.mail.backends.console.EmailBackend',
+                       'django.core.mail.backends.filebased.EmailBackend')
+
+
+class Command(BaseCommand):
+    help = ('Run shopper (register, confirm, login, browse, basket, order) and partner (partner/update) scenarios '
+            'against a running server and report throughput, latency percentiles and error rates per endpoint. '
+            'The server and this command must run with an EMAIL_BACKEND that delivers nothing (e.g. '
+            'EMAIL_BACKEND=django.core.mail.backends.dummy.EmailBackend) and a catalog with products in stock.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/v1')
+        parser.add_argument('--shoppers', type=int, default=20, help='Concurrent shopper sessions')
+        parser.add_argument('--partners', type=int, default=2, help='Concurrent partner import sessions')
+        parser.add_argument('--duration', type=float, default=60)
+        parser.add_argument('--catalog', default=str(Path(settings.BASE_DIR).parent / 'data' / 'shop1.yaml'),
+                            help='YAML price list served to partner/update')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the users created by the test')
+
+    def handle(self, *args, **options):
+        if settings.EMAIL_BACKEND not in STUB_EMAIL_BACKENDS:
+            raise CommandError(f'EMAIL_BACKEND is {settings.EMAIL_BACKEND}: the test registers users and places '
+                               f'orders, so run it (and the server) with one of {", ".join(STUB_EMAIL_BACKENDS)}')
+        if not ProductInfo.objects.filter(quantity__gt=0, shop__state=True).exists():
+            raise CommandError('No products in stock: load a price list (partner/update) before the test')
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        server = self.serve_catalog(Path(options['catalog']).read_bytes())
+        catalog_url = f'http://127.0.0.1:{server.server_address[1]}/shop.yaml'
+        partner_tokens = [self.create_partner() for i in range(options['partners'])]
+        started = time.monotonic()
+        try:
+            asyncio.run(self.run(options, catalog_url, partner_tokens))
+        finally:
+            elapsed = time.monotonic() - started
+            server.shutdown()
+            if not options['keep_data']:
+                self.cleanup()
+        results = {
+            'url': options['url'],
+            'shoppers': options['shoppers'],
+            'partners': options['partners'],
+            'duration': elapsed,
+            'endpoints': {label: summarize(latencies, self.errors[label], elapsed)
+                          for label, latencies in sorted(self.latencies.items())},
+            'total': summarize([latency for latencies in self.latencies.values() for latency in latencies],
+                               sum(self.errors.values()), elapsed),
+        }
+        for label, summary in list(results['endpoints'].items()) + [('TOTAL', results['total'])]:
+            self.stdout.write(f"{label:32} {summary['requests']:7} req {summary['rps']:8.1f} req/s "
+                              f"p50 {summary['p50_ms']:8.1f} ms p99 {summary['p99_ms']:8.1f} ms "
+                              f"errors {summary['error_rate']:.2%}")
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    async def run(self, options, catalog_url, partner_tokens):
+        deadline = time.monotonic() + options['duration']
+        await asyncio.gather(
+            *(self.shopper(options['url'], deadline) for i in range(options['shoppers'])),
+            *(self.partner(options['url'], token, catalog_url, deadline) for token in partner_tokens),
+        )
+
+    async def call(self, client, method, path, data=None, label=None):
+        label = label or f'{method} {path.split("?")[0]}'
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, f'/{path}', data=data)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            response = None
+        self.latencies[label].append(time.perf_counter() - started)
+        if response is None or response.status >= 400:
+            self.errors[label] += 1
+            return None
+        return response
+
+    async def shopper(self, url, deadline):
+        while time.monotonic() < deadline:
+            client = HttpClient(url)
+            try:
+                await self.shopping_session(client)
+            finally:
+                await client.close()
+
+    async def shopping_session(self, client):
+        email = f'{EMAIL_PREFIX}{uuid.uuid4().hex}@example.com'
+        password = uuid.uuid4().hex
+        if not await self.call(client, 'POST', 'user/register', {
+                'first_name': 'Load', 'last_name': 'Test', 'email': email, 'password': password,
+                'company': 'Load test', 'position': 'Shopper'}):
+            return
+        key = await sync_to_async(self.confirm_token)(email)
+        if not key or not await self.call(client, 'POST', 'user/register/confirm', {'email': email, 'token': key}):
+            return
+        response = await self.call(client, 'POST', 'user/login', {'username': email, 'password': password})
+        if not response:
+            return
+        client.headers['Authorization'] = f"Token {response.json()['Token']}"
+        response = await self.call(client, 'GET', 'products')
+        if not response or not response.json():
+            return
+        offers = response.json()
+        for offer in random.sample(offers, min(3, len(offers))):
+            await self.call(client, 'GET', f"products?shop_id={offer['shop']}")
+        await self.call(client, 'GET', 'categories')
+        items = [{'product_info': offer['id'], 'quantity': 1} for offer in random.sample(offers, min(2, len(offers)))]
+        if not await self.call(client, 'POST', 'basket', {'items': json.dumps(items)}):
+            return
+        response = await self.call(client, 'GET', 'basket')
+        if not response or not response.json() or not response.json()[0]['order_item']:
+            return
+        basket = response.json()[0]
+        await self.call(client, 'PUT', 'basket', {'items': json.dumps([{'id': basket['order_item'][0]['id'],
+                                                                        'quantity': 2}])})
+        await self.call(client, 'GET', 'basket')
+        phone = str(random.randint(10 ** 10, 10 ** 11 - 1))
+        if not await self.call(client, 'POST', 'user/contact', {
+                'city': 'Moscow', 'street': 'Tverskaya', 'house': '1', 'structure': '1', 'building': '1',
+                'apartment': '1', 'phone': phone}):
+            return
+        response = await self.call(client, 'GET', 'user/contact')
+        contact_ids = [contact['id'] for contact in response.json() if contact['phone'] == phone] if response else []
+        if not contact_ids:
+            return
+        await self.call(client, 'POST', 'order', {'id': str(basket['id']), 'contact': str(contact_ids[0])})
+        await self.call(client, 'GET', 'order')
+
+    async def partner(self, url, token, catalog_url, deadline):
+        client = HttpClient(url, timeout=300)
+        client.headers['Authorization'] = f'Token {token}'
+        while time.monotonic() < deadline:
+            await self.call(client, 'POST', 'partner/update', {'url': catalog_url})
+            await self.call(client, 'GET', 'partner/state')
+        await client.close()
+
+    @staticmethod
+    def confirm_token(email):
+        return ConfirmToken.objects.filter(user__email=email).values_list('key', flat=True).first()
+
+    @staticmethod
+    def create_partner():
+        user = User.objects.create_user(email=f'{EMAIL_PREFIX}{uuid.uuid4().hex}@example.com',
+                                        password=uuid.uuid4().hex, username='loadtest-partner', type='partner',
+                                        company='Load test', position='Partner')
+        return Token.objects.create(user=user).key
+
+    @staticmethod
+    def cleanup():
+        EmailOutbox.objects.filter(to__0__startswith=EMAIL_PREFIX).delete()
+        User.objects.filter(email__startswith=EMAIL_PREFIX).delete()
+
+    @staticmethod
+    def serve_catalog(content):
+        class CatalogHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-yaml')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CatalogHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.maintenance import run_maintenance
+
+
+class Command(BaseCommand):
+    help = ('Purge abandoned baskets, stale confirm and password reset tokens, tokens of inactive users, sent '
+            'emails and expired idempotency keys in small throttled batches, outside MAINTENANCE_PEAK_HOURS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--duty-cycle', type=float, help='Share of the time spent deleting, e.g. 0.2')
+        parser.add_argument('--now', action='store_true', help='Run during peak hours too')
+        parser.add_argument('--loop', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60 * 60)
+
+    def handle(self, *args, **options):
+        while True:
+            removed = run_maintenance(options['batch_size'], options['duty_cycle'], wait_off_peak=not options['now'])
+            for name, count in removed.items():
+                self.stdout.write(f'{name}: {count} removed')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import UserShard
+from backend.sharding import get_shard_map
+
+
+class Command(BaseCommand):
+    help = ('Move users between DATABASE_SHARDS one at a time while the site keeps running; without --to every '
+            'user goes to the shard its id is placed on now (e.g. after adding a shard)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', help='User ids to move')
+        parser.add_argument('--from', dest='source', help='Move the users placed on this shard')
+        parser.add_argument('--to', dest='target', help='Shard to move the users to')
+        parser.add_argument('--limit', type=int, help='Move at most this many users')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to wait between users')
+
+    def handle(self, *args, **options):
+        shard_map = get_shard_map()
+        for alias in (options['source'], options['target']):
+            if alias and alias not in shard_map.shards:
+                raise CommandError(f'{alias} is not in DATABASE_SHARDS')
+        placements = UserShard.objects.order_by('user_id')
+        if options['users']:
+            user_ids = options['users']
+        else:
+            if options['source']:
+                placements = placements.filter(shard=options['source'])
+            user_ids = placements.values_list('user_id', flat=True).iterator()
+        users = rows = 0
+        for user_id in user_ids:
+            if options['limit'] is not None and users >= options['limit']:
+                break
+            target = options['target'] or shard_map.placement(user_id)
+            if shard_map.shard_for(user_id) == target:
+                continue
+            rows += shard_map.move(user_id, target)
+            users += 1
+            self.stdout.write(f'user {user_id} -> {target}')
+            time.sleep(options['pause'])
+        self.stdout.write(f'{users} users, {rows} rows moved')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.best_offers import BATCH_SIZE, refresh_best_offers
+from backend.models import BestOffer, Product
+
+
+class Command(BaseCommand):
+    help = ('Recompute the best-offer index for every product. Imports and partner state changes keep it up to '
+            'date afterwards; run this once after migrating and after bulk edits made outside the API.')
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.values_list('id', flat=True).iterator(chunk_size=BATCH_SIZE)
+        self.stdout.write(f'{refresh_best_offers(product_ids)} products refreshed, '
+                          f'{BestOffer.objects.count()} listed')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import StockCounter
+from backend.stock import rebuild_stock
+
+
+class Command(BaseCommand):
+    help = ('Recount in-stock offers per shop and category. Imports keep the counters up to date; run this after '
+            'quantities were edited outside partner/update (e.g. in the admin).')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_stock()
+        self.stdout.write(f'{StockCounter.objects.count()} counters rebuilt')
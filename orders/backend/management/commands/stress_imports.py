@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+
+from backend.imports import get_coordinator, import_price_list
+from backend.models import Parameter, Product, ProductInfo, ProductParameter, User
+
+EMAIL_PREFIX = 'stress-import-'
+
+
+class Command(BaseCommand):
+    help = ('Fire concurrent partner imports (several requests per shop at once) through the import coordinator, '
+            'check that every shop ends up with exactly its price list and no duplicate products or parameters, '
+            'and report aggregate import throughput. Run against PostgreSQL to exercise the advisory locks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partners', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=4, help='Concurrent requests per partner')
+        parser.add_argument('--goods', type=int, default=500, help='Goods per price list')
+        parser.add_argument('--keep-data', action='store_true')
+
+    def handle(self, *args, **options):
+        partners = [User.objects.create_user(email=f'{EMAIL_PREFIX}{uuid.uuid4().hex}@example.com',
+                                             password=None, username='stress-import', type='partner')
+                    for i in range(options['partners'])]
+        price_lists = {f'/{partner.id}.yaml': self.price_list(partner.id, options['goods']) for partner in partners}
+        server = self.serve(price_lists)
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        coordinator = get_coordinator()
+        runs, coalesced = coordinator.runs, coordinator.coalesced
+        errors = []
+
+        def request(partner):
+            try:
+                coordinator.run(partner.id, partial(import_price_list, partner.id, f'{base_url}/{partner.id}.yaml'))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=request, args=(partner,))
+                   for i in range(options['requests']) for partner in partners]
+        started = time.monotonic()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+            server.shutdown()
+            runs, coalesced = coordinator.runs - runs, coordinator.coalesced - coalesced
+            self.verify(partners, options['goods'], errors)
+        finally:
+            if not options['keep_data']:
+                User.objects.filter(email__startswith=EMAIL_PREFIX).delete()
+                Product.objects.filter(name__startswith=EMAIL_PREFIX).delete()
+        rows = runs * options['goods']
+        self.stdout.write(f'{len(threads)} requests, {runs} imports ran ({coalesced} coalesced), '
+                          f'{rows} rows in {elapsed:.2f} s: {rows / elapsed:.0f} rows/s')
+
+    def verify(self, partners, goods, errors):
+        if errors:
+            raise CommandError(f'{len(errors)} imports failed, first: {errors[0]!r}')
+        offers = dict(ProductInfo.objects.filter(shop__user__in=partners).values_list('shop__user_id')
+                      .annotate(offers=Count('id')))
+        wrong = {partner.id: offers.get(partner.id, 0) for partner in partners if offers.get(partner.id) != goods}
+        if wrong:
+            raise CommandError(f'Shops with a wrong number of offers: {wrong}')
+        parameters = ProductParameter.objects.filter(product_info__shop__user__in=partners).count()
+        if parameters != len(partners) * goods * 2:
+            raise CommandError(f'Expected {len(partners) * goods * 2} product parameters, found {parameters}')
+        for model, fields in ((Product, ('category_id', 'name_key')), (Parameter, ('name_key',))):
+            if model.objects.values(*fields).annotate(rows=Count('id')).filter(rows__gt=1).exists():
+                raise CommandError(f'Duplicate {model.__name__} rows')
+
+    @staticmethod
+    def price_list(partner_id, goods):
+        return yaml.dump({
+            'shop': f'{EMAIL_PREFIX}shop {partner_id}',
+            'categories': [{'id': 224, 'name': 'Смартфоны'}, {'id': 15, 'name': 'Аксессуары'}],
+            'goods': [{'id': i, 'category': (224, 15)[i % 2], 'model': f'model/{i}',
+                       'name': f'{EMAIL_PREFIX}product {i}', 'price': 1000 + i, 'price_rrc': 1200 + i,
+                       'quantity': i % 10, 'parameters': {'Цвет': ('черный', 'белый')[i % 2], 'Вес (г)': i}}
+                      for i in range(goods)],
+        }, allow_unicode=True).encode()
+
+    @staticmethod
+    def serve(price_lists):
+        class PriceListHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                content = price_lists.get(self.path)
+                self.send_response(200 if content else 404)
+                self.send_header('Content-Length', str(len(content or b'')))
+                self.end_headers()
+                self.wfile.write(content or b'')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), PriceListHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
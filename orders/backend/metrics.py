@@ -0,0 +1,305 @@
+import hmac
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .authentication import token_cache
+from .models import EmailOutbox
+from .pooled_postgresql.pool import pool_stats
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None, per_process=True, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.per_process = per_process
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        if self.function is None:
+            with self._lock:
+                return {key: self._copy(value) for key, value in self._values.items()}
+        value = self.function()
+        if isinstance(value, dict):
+            return {key if isinstance(key, tuple) else (str(key),): value for key, value in value.items()}
+        return {(): value}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def merge(current, value):
+        return current + value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, multiprocess_mode='sum', **kwargs):
+        super().__init__(*args, **kwargs)
+        if multiprocess_mode == 'max':
+            self.merge = max
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    @staticmethod
+    def merge(current, value):
+        return [a + b for a, b in zip(current, value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._flushed = 0.0
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+
+    @property
+    def directory(self):
+        return settings.METRICS_DIR
+
+    def flush_due(self):
+        return bool(self.directory) and time.monotonic() - self._flushed >= settings.METRICS_FLUSH_INTERVAL
+
+    def maybe_flush(self):
+        if self.flush_due():
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                for metric in self._metrics.values():
+                    metric.reset()
+                self._pid = os.getpid()
+            data = {metric.name: {json.dumps(key): value for key, value in metric.samples().items()}
+                    for metric in self._metrics.values() if metric.per_process}
+            path = Path(self.directory) / f'{self._pid}.json'
+            temporary = path.with_suffix('.tmp')
+            temporary.write_text(json.dumps(data))
+            os.replace(temporary, path)
+            self._flushed = time.monotonic()
+
+    def collect(self):
+        if not self.directory:
+            return {metric.name: metric.samples() for metric in self._metrics.values()}
+        self.flush()
+        merged = {name: {} for name in self._metrics}
+        for path in Path(self.directory).glob('*.json'):
+            alive = _process_alive(int(path.stem))
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for name, samples in data.items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                for key, value in samples.items():
+                    key = tuple(json.loads(key))
+                    current = merged[name].get(key)
+                    merged[name][key] = value if current is None else metric.merge(current, value)
+        for metric in self._metrics.values():
+            if not metric.per_process:
+                merged[metric.name] = metric.samples()
+        return merged
+
+    def render(self):
+        lines = []
+        for name, samples in self.collect().items():
+            metric = self._metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(samples.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + [("le", _number(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+
+
+def _token_cache_stat(name):
+    def stat():
+        return token_cache.stats()[name]
+    return stat
+
+
+def _pool_stat(name):
+    def stat():
+        return {(alias,): stats[name] for alias, stats in pool_stats().items()}
+    return stat
+
+
+def _outbox_depth():
+    return EmailOutbox.objects.filter(state='pending').count()
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by route', ('route', 'method'))
+REQUESTS = Counter('http_requests_total', 'Requests by route and status', ('route', 'method', 'status'))
+REQUEST_ERRORS = Counter('http_request_errors_total', 'Requests answered with a server error', ('route', 'method'))
+IMPORT_ROWS = Counter('import_rows_total', 'Goods imported through partner/update')
+IMPORT_SECONDS = Counter('import_seconds_total', 'Time spent importing through partner/update')
+IMPORT_ROWS_PER_SECOND = Gauge('import_rows_per_second', 'Throughput of the latest partner/update import',
+                               multiprocess_mode='max')
+OUTBOX_DEPTH = Gauge('email_outbox_pending', 'Emails waiting in the outbox', function=_outbox_depth,
+                     per_process=False)
+TOKEN_CACHE_HITS = Counter('token_cache_hits_total', 'Token authentication cache hits',
+                           function=_token_cache_stat('hits'))
+TOKEN_CACHE_MISSES = Counter('token_cache_misses_total', 'Token authentication cache misses',
+                             function=_token_cache_stat('misses'))
+TOKEN_CACHE_SIZE = Gauge('token_cache_entries', 'Token authentication cache entries',
+                         function=_token_cache_stat('size'))
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Open pooled connections', ('database',),
+                            function=_pool_stat('size'))
+DB_POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Pool checkouts', ('database',),
+                            function=_pool_stat('checkouts'))
+DB_POOL_WAITS = Counter('db_pool_waits_total', 'Pool checkouts that had to wait', ('database',),
+                        function=_pool_stat('waits'))
+DB_POOL_WAIT_SECONDS = Counter('db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection',
+                               ('database',), function=_pool_stat('wait_time'))
+DB_POOL_OPENED = Counter('db_pool_connections_opened_total', 'Connections opened by the pool', ('database',),
+                         function=_pool_stat('connections_opened'))
+DB_POOL_CLOSED = Counter('db_pool_connections_closed_total', 'Connections closed by the pool', ('database',),
+                         function=_pool_stat('connections_closed'))
+
+
+class MetricsMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        REGISTRY.maybe_flush()
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started)
+        if REGISTRY.flush_due():
+            await sync_to_async(REGISTRY.flush, thread_sensitive=False)()
+        return response
+
+    @staticmethod
+    def observe(request, response, duration):
+        route = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        REQUEST_LATENCY.observe(duration, route=route, method=request.method)
+        REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.inc(route=route, method=request.method)
+
+
+def metrics_allowed(request):
+    # METRICS_TOKEN as a bearer token, or a request from METRICS_ALLOWED_IPS
+    if settings.METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-19 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0020_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['user', 'phone'], name='contact_user_phone_idx'),
+        ),
+    ]
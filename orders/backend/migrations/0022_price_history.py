@@ -0,0 +1,51 @@
+# Generated by Django 5.0 on 2026-10-19 18:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0021_contact_phone_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(default=b'')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('external_id', models.PositiveIntegerField()),
+                ('last_time', models.DateTimeField()),
+                ('last_price', models.PositiveIntegerField()),
+                ('last_price_rrc', models.PositiveIntegerField()),
+                ('last_quantity', models.PositiveIntegerField()),
+                ('chunk', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.pricechunk')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_series', to='backend.product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_series', to='backend.shop')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pricechunk',
+            name='series',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='backend.priceseries'),
+        ),
+        migrations.AddConstraint(
+            model_name='priceseries',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='price_series_offer_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='pricechunk',
+            index=models.Index(fields=['series', 'start'], name='price_chunk_series_start_idx'),
+        ),
+    ]
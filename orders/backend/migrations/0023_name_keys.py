@@ -0,0 +1,41 @@
+# Generated by Django 5.0 on 2026-10-19 19:12
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def name_key(name):
+    # backend.models.name_key as of this migration
+    return hashlib.sha256(' '.join(str(name).split()).casefold().encode()).hexdigest()
+
+
+def fill_name_keys(apps, schema_editor):
+    for model_name in ('Product', 'Parameter'):
+        model = apps.get_model('backend', model_name)
+        rows = [model(id=row_id, name_key=name_key(name))
+                for row_id, name in model.objects.filter(name_key='').values_list('id', 'name').iterator()]
+        model.objects.bulk_update(rows, ['name_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0022_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameter',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0 on 2026-10-19 19:12
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+NATURAL_KEYS = {'Product': ('category_id', 'name_key'), 'Parameter': ('name_key',)}
+
+
+def name_key(name):
+    # backend.models.name_key as of this migration
+    return hashlib.sha256(' '.join(str(name).split()).casefold().encode()).hexdigest()
+
+
+def merge_duplicates(apps, schema_editor):
+    # rows added since 0023 get their key, then the oldest row of every key is kept, foreign keys are repointed
+    # to it and the rest are deleted
+    for model_name, fields in NATURAL_KEYS.items():
+        model = apps.get_model('backend', model_name)
+        rows = [model(id=row_id, name_key=name_key(name))
+                for row_id, name in model.objects.filter(name_key='').values_list('id', 'name').iterator()]
+        model.objects.bulk_update(rows, ['name_key'], batch_size=1000)
+        groups = (model.objects.values(*fields).annotate(rows=Count('id'), keep=Min('id'))
+                  .filter(rows__gt=1).order_by())
+        relations = [(related.related_model, related.field.name) for related in model._meta.related_objects
+                     if not related.many_to_many]
+        for group in groups:
+            keep = group.pop('keep')
+            del group['rows']
+            duplicates = list(model.objects.filter(**group).exclude(id=keep).values_list('id', flat=True))
+            for related_model, field in relations:
+                related_model.objects.filter(**{f'{field}__in': duplicates}).update(**{field: keep})
+            model.objects.filter(id__in=duplicates).delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # fire the deferred foreign key checks now, ALTER TABLE below refuses to run with trigger events pending
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0023_name_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='parameter',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('category', 'name_key'), name='product_category_name_unique'),
+        ),
+    ]
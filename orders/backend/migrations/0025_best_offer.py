@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-19 18:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0024_name_key_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestOffer',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='best_offer', serialize=False, to='backend.product')),
+                ('name', models.CharField(max_length=100)),
+                ('min_price', models.PositiveIntegerField()),
+                ('shop_count', models.PositiveIntegerField()),
+                ('best_shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.shop')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'min_price', 'product'], name='best_offer_price_idx'), models.Index(fields=['category', 'name', 'product'], name='best_offer_name_idx'), models.Index(fields=['category', 'shop_count', 'product'], name='best_offer_shops_idx')],
+            },
+        ),
+    ]
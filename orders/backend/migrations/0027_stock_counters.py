@@ -0,0 +1,54 @@
+# Generated by Django 5.0 on 2026-10-19 19:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_stock(apps, schema_editor):
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    StockCounter = apps.get_model('backend', 'StockCounter')
+    rows = (ProductInfo.objects.filter(quantity__gt=0).values_list('shop_id', 'product__category_id')
+            .annotate(Count('id')).order_by())
+    StockCounter.objects.bulk_create((StockCounter(shop_id=shop_id, category_id=category_id, in_stock=in_stock)
+                                      for shop_id, category_id, in_stock in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0026_related_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('in_stock', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['shop', 'product'], name='product_info_shop_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'shop'], name='product_info_product_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockcounter',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_counters', to='backend.category'),
+        ),
+        migrations.AddField(
+            model_name='stockcounter',
+            name='shop',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_counters', to='backend.shop'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockcounter',
+            constraint=models.UniqueConstraint(fields=('shop', 'category'), name='stock_counter_unique'),
+        ),
+        migrations.RunPython(count_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-19 19:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0027_stock_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confirmtoken',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
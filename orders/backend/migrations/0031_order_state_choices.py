@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-19 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0030_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='state',
+            field=models.CharField(choices=[('new', 'New'), ('in_progress', 'In_progress'), ('completed', 'Completed'), ('rejected', 'Rejected')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-19 19:50
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_dt(apps, schema_editor):
+    # existing baskets count as last changed when they were created; runs on every shard (see the hints)
+    Order = apps.get_model('backend', 'Order')
+    Order.objects.using(schema_editor.connection.alias).update(updated_at=F('dt'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0032_idempotency_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('state', 'new')), fields=['updated_at'], name='order_basket_updated_idx'),
+        ),
+        migrations.RunPython(copy_dt, migrations.RunPython.noop, hints={'model_name': 'order'}),
+    ]
@@ -1,9 +1,11 @@
+import hashlib
 import secrets
 
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.utils import timezone
 
 
 ORDER_STATE = (
@@ -13,6 +15,22 @@ ORDER_STATE = (
     ("rejected", "Rejected"),
 )
 
+ORDER_TRANSITIONS = {
+    "new": ("in_progress", "rejected"),
+    "in_progress": ("completed", "rejected"),
+    "completed": (),
+    "rejected": (),
+}
+# 'new' is the customer's basket: only the customer (checkout) and staff move it on
+PARTNER_ORDER_TRANSITIONS = {state: targets for state, targets in ORDER_TRANSITIONS.items() if state != "new"}
+PARTNER_ORDER_STATES = {target for targets in PARTNER_ORDER_TRANSITIONS.values() for target in targets}
+
+OUTBOX_STATE = (
+    ("pending", "Pending"),
+    ("sent", "Sent"),
+    ("failed", "Failed"),
+)
+
 USER_TYPE = (
     ("customer", "customer"),
     ("partner", "partner"),
@@ -105,17 +123,29 @@ class ShopCategory(models.Model):
     category = models.ForeignKey(Category, related_name='shop_category', on_delete=models.CASCADE)
 
 
+def name_key(name):
+    return hashlib.sha256(' '.join(str(name).split()).casefold().encode()).hexdigest()
+
+
 class Product(models.Model):
     objects = models.manager.Manager()
     name = models.CharField(max_length=100)
+    name_key = models.CharField(max_length=64, editable=False)
     category = models.ForeignKey(Category, related_name='product', on_delete=models.CASCADE)
 
     class Meta:
         verbose_name = 'Product'
+        constraints = [models.UniqueConstraint(fields=['category', 'name_key'], name='product_category_name_unique')]
+        # prefix search in the admin
+        indexes = [models.Index(fields=['name'], name='product_name_prefix_idx', opclasses=['varchar_pattern_ops'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = name_key(self.name)
+        return super().save(*args, **kwargs)
+
 
 class ProductInfo(models.Model):
     objects = models.manager.Manager()
@@ -129,6 +159,13 @@ class ProductInfo(models.Model):
 
     class Meta:
         verbose_name = 'ProductInfo'
+        indexes = [
+            models.Index(fields=['shop', 'product'], condition=models.Q(quantity__gt=0),
+                         name='product_info_shop_stock_idx'),
+            models.Index(fields=['product', 'shop'], condition=models.Q(quantity__gt=0),
+                         name='product_info_product_stock_idx'),
+            models.Index(fields=['name'], name='product_info_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
@@ -137,6 +174,7 @@ class ProductInfo(models.Model):
 class Parameter(models.Model):
     objects = models.manager.Manager()
     name = models.CharField(max_length=100)
+    name_key = models.CharField(max_length=64, unique=True, editable=False)
 
     class Meta:
         verbose_name = 'Parameter'
@@ -144,6 +182,10 @@ class Parameter(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = name_key(self.name)
+        return super().save(*args, **kwargs)
+
 
 class ProductParameter(models.Model):
     objects = models.manager.Manager()
@@ -154,26 +196,38 @@ class ProductParameter(models.Model):
 
 class Order(models.Model):
     objects = models.manager.Manager()
-    user = models.ForeignKey(User, related_name='order', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='order', db_constraint=False, on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True)
     state = models.CharField(choices=ORDER_STATE)
     total_sum = models.PositiveIntegerField(default=0, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # last change of the basket's items; maintenance purges baskets left untouched
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], condition=models.Q(state='new'), name='order_basket_updated_idx'),
+        ]
 
 
 class OrderItem(models.Model):
     objects = models.manager.Manager()
     order = models.ForeignKey(Order, related_name='order_item', on_delete=models.CASCADE)
-    product_info = models.ForeignKey(ProductInfo, related_name='order_item', default=1, on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo, related_name='order_item', default=1, db_constraint=False,
+                                     on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
 
 
 class Contact(models.Model):
     objects = models.manager.Manager()
-    user = models.ForeignKey(User, related_name='contact', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='contact', db_constraint=False, on_delete=models.CASCADE)
     value = models.CharField(max_length=100, blank=True)
     type = models.CharField(max_length=100, blank=True)
     phone = models.CharField(max_length=12, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['user', 'phone'], name='contact_user_phone_idx')]
+
 
 class Address(models.Model):
     objects = models.manager.Manager()
@@ -190,6 +244,7 @@ class ConfirmToken(models.Model):
     objects = models.manager.Manager()
     key = models.CharField(max_length=35)
     user = models.ForeignKey(User, default=15, related_name='confirm_token', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     @staticmethod
     def generate_verification_token():
@@ -199,3 +254,100 @@ class ConfirmToken(models.Model):
         if not self.key:
             self.key = self.generate_verification_token()
         return super(ConfirmToken, self).save(*args, **kwargs)
+
+
+class IdempotencyKey(models.Model):
+    objects = models.manager.Manager()
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64, blank=True)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    expires = models.DateTimeField(db_index=True)
+
+
+class EmailOutbox(models.Model):
+    objects = models.manager.Manager()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField()
+    state = models.CharField(choices=OUTBOX_STATE, max_length=8, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt'], condition=models.Q(state='pending'), name='outbox_pending_idx'),
+        ]
+
+
+class PriceSeries(models.Model):
+    objects = models.manager.Manager()
+    shop = models.ForeignKey(Shop, related_name='price_series', on_delete=models.CASCADE)
+    external_id = models.PositiveIntegerField()
+    product = models.ForeignKey(Product, related_name='price_series', on_delete=models.CASCADE)
+    chunk = models.ForeignKey('PriceChunk', related_name='+', null=True, on_delete=models.SET_NULL)
+    last_time = models.DateTimeField()
+    last_price = models.PositiveIntegerField()
+    last_price_rrc = models.PositiveIntegerField()
+    last_quantity = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['shop', 'external_id'], name='price_series_offer_unique')]
+
+
+class PriceChunk(models.Model):
+    objects = models.manager.Manager()
+    series = models.ForeignKey(PriceSeries, related_name='chunks', on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    points = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(default=b'')
+
+    class Meta:
+        indexes = [models.Index(fields=['series', 'start'], name='price_chunk_series_start_idx')]
+
+
+class BestOffer(models.Model):
+    objects = models.manager.Manager()
+    product = models.OneToOneField(Product, primary_key=True, related_name='best_offer', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    min_price = models.PositiveIntegerField()
+    shop_count = models.PositiveIntegerField()
+    best_shop = models.ForeignKey(Shop, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'min_price', 'product'], name='best_offer_price_idx'),
+            models.Index(fields=['category', 'name', 'product'], name='best_offer_name_idx'),
+            models.Index(fields=['category', 'shop_count', 'product'], name='best_offer_shops_idx'),
+        ]
+
+
+class RelatedProduct(models.Model):
+    objects = models.manager.Manager()
+    product = models.ForeignKey(Product, related_name='related_products', db_index=False, on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['product', '-score'], name='related_product_score_idx')]
+
+
+class StockCounter(models.Model):
+    objects = models.manager.Manager()
+    shop = models.ForeignKey(Shop, related_name='stock_counters', db_index=False, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='stock_counters', on_delete=models.CASCADE)
+    in_stock = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['shop', 'category'], name='stock_counter_unique')]
+
+
+class UserShard(models.Model):
+    objects = models.manager.Manager()
+    user = models.OneToOneField(User, primary_key=True, related_name='shard', on_delete=models.CASCADE)
+    shard = models.CharField(max_length=30)
@@ -0,0 +1,61 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(messages):
+    return EmailOutbox.objects.bulk_create([
+        EmailOutbox(subject=message.subject, body=message.body, from_email=message.from_email or '', to=message.to)
+        for message in messages
+    ])
+
+
+def drain(batch_size=None):
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(EmailOutbox.objects.select_for_update(skip_locked=True)
+                     .filter(state='pending', next_attempt__lte=now).order_by('next_attempt')[:batch_size])
+        if not batch:
+            return 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            for item in batch:
+                _retry(item, error, now)
+        else:
+            try:
+                for item in batch:
+                    message = EmailMultiAlternatives(subject=item.subject, body=item.body,
+                                                     from_email=item.from_email or None, to=item.to,
+                                                     connection=connection)
+                    try:
+                        connection.send_messages([message])
+                    except Exception as error:
+                        _retry(item, error, now)
+                    else:
+                        item.state = 'sent'
+                        item.attempts += 1
+            finally:
+                connection.close()
+        EmailOutbox.objects.bulk_update(batch, ['state', 'attempts', 'next_attempt', 'last_error'])
+    return sum(item.state == 'sent' for item in batch)
+
+
+def _retry(item, error, now):
+    item.attempts += 1
+    item.last_error = str(error)
+    if item.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        item.state = 'failed'
+        logger.error('Email %s to %s failed after %s attempts: %s', item.id, item.to, item.attempts, error)
+    else:
+        item.next_attempt = now + timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (item.attempts - 1))
@@ -0,0 +1,141 @@
+import heapq
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+request_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'render_time', 'render_started', 'slow_queries')
+
+    def __init__(self, keep_queries):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+        self.slow_queries = [] if keep_queries else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            if self.slow_queries is not None:
+                self.slow_queries.append((duration, sql))
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+                f'serializer;dur={self.serializer_time * 1000:.1f}, '
+                f'render;dur={self.render_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+@contextmanager
+def serializer_timing():
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_time += time.perf_counter() - started
+
+
+def serialized(serializer):
+    # serializer.data, counted as serializer time
+    with serializer_timing():
+        return serializer.data
+
+
+def validated(serializer):
+    # serializer.is_valid(), counted as serializer time
+    with serializer_timing():
+        return serializer.is_valid()
+
+
+class SerializerTimingMixin:
+    # for generic views, whose list() serializes the page
+    def list(self, request, *args, **kwargs):
+        with serializer_timing():
+            return super().list(request, *args, **kwargs)
+
+
+class PerformanceMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request = settings.PERFORMANCE_SLOW_REQUEST_MS
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings(keep_queries=self.slow_request is not None)
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, timings)
+                response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings(keep_queries=self.slow_request is not None)
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        # connections belong to the thread the request's queries run in, so the wrappers are installed there
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.wrap_connections)(stack, timings)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            request_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    @staticmethod
+    def wrap_connections(stack, timings):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings))
+
+    def finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        response['Server-Timing'] = timings.server_timing(total)
+        if self.slow_request is not None and total * 1000 >= self.slow_request:
+            slowest = heapq.nlargest(settings.PERFORMANCE_SLOW_QUERIES, timings.slow_queries)
+            logger.warning('Slow request %s %s: %.1f ms, %s queries in %.1f ms. Slowest queries:\n%s',
+                           request.method, request.path, total * 1000, timings.queries, timings.db_time * 1000,
+                           '\n'.join(f'{duration * 1000:.1f} ms: {sql}' for duration, sql in slowest))
+        return response
+
+    def process_template_response(self, request, response):
+        timings = request_timings.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(timings))
+        return response
+
+    @staticmethod
+    def rendered(timings):
+        timings.render_time += time.perf_counter() - timings.render_started
@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+# Connections inherited through fork() belong to the parent process. Closing them here would send
+# a Terminate message over the parent's socket, so they are only dropped from the pool and kept alive.
+_inherited = []
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, min_size=0, max_size=10, max_lifetime=1800, timeout=10, health_check_idle=10):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._pid = os.getpid()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.health_check_failures = 0
+
+    def getconn(self, connect):
+        self._check_fork()
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            self.checkouts += 1
+        while True:
+            connection = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = started + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f'No connection available in pool within {self.timeout} seconds')
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    connection, returned = self._idle.pop()
+                else:
+                    self._size += 1
+                self._record_wait(waited, started)
+                waited = False
+            if connection is None:
+                connection = self._open(connect)
+                if self.min_size > 1:
+                    self._fill(connect)
+                return connection
+            if self._usable(connection, returned):
+                return connection
+            with self._cond:
+                self._discard(connection)
+                self._cond.notify()
+
+    def putconn(self, connection):
+        if os.getpid() != self._pid:
+            _inherited.append(connection)
+            return
+        if not connection.closed and connection.status != extensions.STATUS_READY:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+        with self._cond:
+            if (connection.closed or connection.status != extensions.STATUS_READY
+                    or self._expired(connection) or len(self._idle) >= self.max_size):
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.popleft()[0])
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+                'connections_opened': self.connections_opened,
+                'connections_closed': self.connections_closed,
+                'health_check_failures': self.health_check_failures,
+            }
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created[id(connection)] = time.monotonic()
+            self.connections_opened += 1
+        return connection
+
+    def _fill(self, connect):
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self._open(connect)
+            except psycopg2.Error:
+                return
+            self.putconn(connection)
+
+    def _usable(self, connection, returned):
+        if connection.closed or self._expired(connection):
+            return False
+        if time.monotonic() - returned < self.health_check_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self.health_check_failures += 1
+            return False
+
+    def _expired(self, connection):
+        created = self._created.get(id(connection))
+        return created is None or time.monotonic() - created > self.max_lifetime
+
+    def _discard(self, connection):
+        self._created.pop(id(connection), None)
+        self._size -= 1
+        self.connections_closed += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _record_wait(self, waited, started):
+        if waited:
+            self.waits += 1
+            self.wait_time += time.monotonic() - started
+
+    def _check_fork(self):
+        if os.getpid() == self._pid:
+            return
+        with self._cond:
+            if os.getpid() != self._pid:
+                _inherited.extend(connection for connection, returned in self._idle)
+                self._idle.clear()
+                self._created.clear()
+                self._size = 0
+                self._pid = os.getpid()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                options = settings_dict.get('POOL', {})
+                pool = _pools[alias] = ConnectionPool(
+                    min_size=options.get('MIN_SIZE', 0),
+                    max_size=options.get('MAX_SIZE', 10),
+                    max_lifetime=options.get('MAX_LIFETIME', 1800),
+                    timeout=options.get('TIMEOUT', 10),
+                    health_check_idle=options.get('HEALTH_CHECK_IDLE', 10),
+                )
+    return pool
+
+
+def pool_stats():
+    return {alias: pool.stats() for alias, pool in _pools.items()}
@@ -0,0 +1,148 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import PriceChunk, PriceSeries
+
+FIELDS = ('price', 'price_rrc', 'quantity')
+# rows per INSERT/UPDATE statement; an import can change every offer of a shop
+BATCH_SIZE = 1000
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_point(out, seconds, previous, values):
+    # seconds since the previous point, a bit mask of the changed fields and their zigzag-encoded deltas
+    _write_varint(out, seconds)
+    deltas = [value - last for value, last in zip(values, previous)]
+    out.append(sum(1 << i for i, delta in enumerate(deltas) if delta))
+    for delta in deltas:
+        if delta:
+            _write_varint(out, delta * 2 if delta >= 0 else -delta * 2 - 1)
+
+
+def decode_chunk(chunk):
+    data = bytes(chunk.data)
+    moment = int(chunk.start.timestamp())
+    values = [0] * len(FIELDS)
+    position = 0
+    while position < len(data):
+        seconds, position = _read_varint(data, position)
+        moment += seconds
+        mask = data[position]
+        position += 1
+        for i in range(len(FIELDS)):
+            if mask & 1 << i:
+                delta, position = _read_varint(data, position)
+                values[i] += delta // 2 if not delta & 1 else -(delta + 1) // 2
+        yield (datetime.fromtimestamp(moment, dt_timezone.utc), *values)
+
+
+def _append(series, values, at, new_chunks, changed_chunks):
+    chunk = series.chunk
+    if chunk is None or chunk.points >= settings.PRICE_HISTORY_CHUNK_POINTS:
+        chunk = PriceChunk(series=series, start=at, end=at)
+        new_chunks.append(chunk)
+        previous = (0,) * len(FIELDS)
+    else:
+        changed_chunks.append(chunk)
+        previous = (series.last_price, series.last_price_rrc, series.last_quantity)
+    data = bytearray(chunk.data)
+    encode_point(data, max(0, int(at.timestamp()) - int(chunk.end.timestamp())), previous, values)
+    chunk.data = bytes(data)
+    chunk.points += 1
+    chunk.end = at
+    series.chunk = chunk
+    series.last_time = at
+    series.last_price, series.last_price_rrc, series.last_quantity = values
+
+
+def record_prices(shop_id, offers, at=None):
+    # offers are (external_id, product_id, price, price_rrc, quantity) for every offer of the import;
+    # offers missing from it are recorded with quantity 0
+    at = (at or timezone.now()).replace(microsecond=0)
+    series = {item.external_id: item for item in PriceSeries.objects.filter(shop_id=shop_id).select_related('chunk')}
+    new_series, changed, seen = [], [], set()
+    for external_id, product_id, *values in offers:
+        seen.add(external_id)
+        current = series.get(external_id)
+        if current is None:
+            current = series[external_id] = PriceSeries(shop_id=shop_id, external_id=external_id,
+                                                        product_id=product_id, last_time=at, last_price=values[0],
+                                                        last_price_rrc=values[1], last_quantity=values[2])
+            new_series.append(current)
+            changed.append((current, values))
+        elif [current.last_price, current.last_price_rrc, current.last_quantity] != values:
+            changed.append((current, values))
+        current.product_id = product_id
+    for external_id, current in series.items():
+        if external_id not in seen and current.last_quantity:
+            changed.append((current, [current.last_price, current.last_price_rrc, 0]))
+    if not changed:
+        return 0
+    with transaction.atomic():
+        PriceSeries.objects.bulk_create(new_series, batch_size=BATCH_SIZE)
+        new_chunks, changed_chunks = [], []
+        for current, values in changed:
+            _append(current, values, at, new_chunks, changed_chunks)
+        PriceChunk.objects.bulk_create(new_chunks, batch_size=BATCH_SIZE)
+        PriceChunk.objects.bulk_update(changed_chunks, ['end', 'points', 'data'], batch_size=BATCH_SIZE)
+        PriceSeries.objects.bulk_update([current for current, values in changed],
+                                        ['product', 'chunk', 'last_time', 'last_price', 'last_price_rrc',
+                                         'last_quantity'], batch_size=BATCH_SIZE)
+    return len(changed)
+
+
+def downsample(points, start, end, buckets):
+    width = (end - start) / buckets
+    index, current, result = 0, None, []
+    while index < len(points) and points[index][0] <= start:
+        current = points[index]
+        index += 1
+    for bucket in range(buckets):
+        bucket_end = start + width * (bucket + 1)
+        low = high = current[1] if current else None
+        while index < len(points) and points[index][0] <= bucket_end:
+            current = points[index]
+            index += 1
+            low = current[1] if low is None else min(low, current[1])
+            high = current[1] if high is None else max(high, current[1])
+        if current is None:
+            continue
+        row = {'time': start + width * bucket, 'price': current[1], 'price_min': low, 'price_max': high,
+               'price_rrc': current[2], 'quantity': current[3]}
+        if not result or any(result[-1][field] != row[field] for field in row if field != 'time'):
+            result.append(row)
+    return result
+
+
+def price_history(series, start, end, buckets):
+    series = list(series)
+    latest_before = (PriceChunk.objects.filter(series=OuterRef('series'), start__lte=start)
+                     .order_by('-start').values('id')[:1])
+    chunks = (PriceChunk.objects.filter(series__in=series, start__lte=end)
+              .filter(Q(end__gte=start) | Q(id=Subquery(latest_before))).order_by('series_id', 'start'))
+    points = {}
+    for chunk in chunks:
+        points.setdefault(chunk.series_id, []).extend(decode_chunk(chunk))
+    return [{'shop': item.shop_id, 'external_id': item.external_id, 'product': item.product_id,
+             'history': downsample(points.get(item.id, []), start, end, buckets)} for item in series]
@@ -0,0 +1,133 @@
+import itertools
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Order, OrderItem, Product, ProductInfo, RelatedProduct
+from .sharding import get_shard_map
+
+# orders completed within the last SETTLE may still be committing; they are left for the next run
+SETTLE = timedelta(minutes=1)
+BATCH_SIZE = 1000
+
+
+def _offer_products():
+    # offer id -> product id (-1 for gaps); order items may sit on a shard without the catalog to join
+    offers = np.fromiter(ProductInfo.objects.values_list('id', 'product_id').iterator(chunk_size=10000),
+                         dtype=np.dtype((np.int64, 2)))
+    products = np.full(offers[:, 0].max() + 1 if len(offers) else 0, -1, dtype=np.int64)
+    products[offers[:, 0]] = offers[:, 1]
+    return products
+
+
+def _baskets(orders, batch_lines):
+    # (order id, offer id) rows in blocks of about batch_lines that never split an order
+    items = (OrderItem.objects.using(orders.db).filter(order__in=orders).order_by('order_id')
+             .values_list('order_id', 'product_info_id').iterator(chunk_size=10000))
+    carry = np.empty((0, 2), dtype=np.int64)
+    while True:
+        block = np.fromiter(itertools.islice(items, batch_lines), dtype=np.dtype((np.int64, 2)))
+        exhausted = len(block) < batch_lines
+        block = np.concatenate([carry, block])
+        if exhausted:
+            if len(block):
+                yield block
+            return
+        cut = np.searchsorted(block[:, 0], block[-1, 0])
+        carry = block[cut:]
+        if cut:
+            yield block[:cut]
+
+
+def cooccurrence(orders, size, batch_lines, offer_products):
+    matrix = sparse.csr_matrix((size, size), dtype=np.int32)
+    for block in _baskets(orders, batch_lines):
+        known = block[:, 1] < len(offer_products)
+        block = block[known]
+        block[:, 1] = offer_products[block[:, 1]]
+        block = block[block[:, 1] >= 0]
+        if not len(block):
+            continue
+        rows = np.unique(block[:, 0], return_inverse=True)[1]
+        baskets = sparse.csr_matrix((np.ones(len(block), dtype=np.int32), (rows, block[:, 1])),
+                                    shape=(rows.max() + 1, size))
+        baskets.sum_duplicates()
+        baskets.data[:] = 1
+        matrix += baskets.T @ baskets
+    matrix -= sparse.diags(matrix.diagonal(), dtype=np.int32, format='csr')
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def top_k(matrix, product_ids, k):
+    # the k highest scores of every row, ties broken by the lower product id
+    rows = matrix[product_ids]
+    counts = np.diff(rows.indptr)
+    products = np.repeat(product_ids, counts)
+    order = np.lexsort((rows.indices, -rows.data, products))
+    keep = np.arange(len(order)) - np.repeat(rows.indptr[:-1], counts) < k
+    return products[order][keep], rows.indices[order][keep], rows.data[order][keep]
+
+
+def load_matrix(path):
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as stored:
+        matrix = sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']), shape=tuple(stored['shape']))
+        until = datetime.fromtimestamp(int(stored['until']) / 1e6, tz=dt_timezone.utc)
+    return matrix, until
+
+
+def _save_matrix(path, matrix, until):
+    temporary = f'{path}.tmp.npz'
+    np.savez(temporary, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape,
+             until=int(until.timestamp() * 1e6))
+    return temporary
+
+
+def build_recommendations(full=False, top=None, batch_lines=None):
+    # Adds the orders completed since the last run to the co-occurrence matrix kept in RECOMMENDATIONS_MATRIX
+    # and rewrites the neighbours of the products they contain; full=True (or no stored matrix) starts over.
+    path = str(settings.RECOMMENDATIONS_MATRIX)
+    top = top or settings.RECOMMENDATIONS_TOP_K
+    batch_lines = batch_lines or settings.RECOMMENDATIONS_BATCH_LINES
+    until = timezone.now() - SETTLE
+    matrix, since = (None, None) if full else load_matrix(path)
+    size = (Product.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    if matrix is None:
+        orders = Q(Q(completed_at__isnull=True) | Q(completed_at__lte=until), state='completed')
+        matrix = sparse.csr_matrix((size, size), dtype=np.int32)
+    else:
+        orders = Q(state='completed', completed_at__gt=since, completed_at__lte=until)
+        size = max(size, matrix.shape[0])
+        matrix.resize((size, size))
+    offer_products = _offer_products()
+    added = sparse.csr_matrix((size, size), dtype=np.int32)
+    for alias in get_shard_map().shards:
+        added += cooccurrence(Order.objects.using(alias).filter(orders).values('id'), size, batch_lines,
+                              offer_products)
+    matrix += added
+    touched = np.flatnonzero(np.diff((matrix if since is None else added).indptr))
+    products, related, scores = top_k(matrix, touched, top)
+    existing = np.fromiter(Product.objects.values_list('id', flat=True).iterator(chunk_size=10000), dtype=np.int64)
+    keep = np.isin(products, existing) & np.isin(related, existing)
+    temporary = _save_matrix(path, matrix, until)
+    with transaction.atomic():
+        if since is None:
+            RelatedProduct.objects.all().delete()
+        else:
+            for index in range(0, len(touched), BATCH_SIZE):
+                RelatedProduct.objects.filter(product_id__in=touched[index:index + BATCH_SIZE].tolist()).delete()
+        RelatedProduct.objects.bulk_create(
+            (RelatedProduct(product_id=product_id, related_id=related_id, score=score)
+             for product_id, related_id, score in zip(products[keep].tolist(), related[keep].tolist(),
+                                                      scores[keep].tolist())),
+            batch_size=BATCH_SIZE)
+    os.replace(temporary, path)
+    return len(touched)
@@ -0,0 +1,119 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+CATALOG_MODELS = {'shop', 'category', 'shopcategory', 'product', 'productinfo', 'parameter', 'productparameter'}
+# per-user rows kept on the user's shard; everything else lives on 'default'
+SHARDED_MODELS = {'order', 'orderitem', 'contact', 'address'}
+
+primary_pinned = ContextVar('primary_pinned', default=False)
+current_shard = ContextVar('current_shard', default=None)
+
+
+class ShardRouter:
+    # Sharded models go to the database of the instance they are reached from, then to the shard set by
+    # ShardMap.reading/writing for the current request, then to 'default'. Other aliases (except replicas)
+    # hold only the sharded tables.
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'backend' or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.model_name in SHARDED_MODELS and instance._state.db:
+            return instance._state.db
+        return current_shard.get() or 'default'
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db in settings.DATABASE_REPLICAS:
+            return None
+        if hints.get('shard_tables'):
+            return True
+        # The earlier migrations create the sharded tables with foreign keys to users and offers, which are not
+        # on a shard; a new shard gets them from 0034_shard_tables instead and runs nothing before it.
+        return app_label == 'backend' and model_name in SHARDED_MODELS and shard_has_tables(db)
+
+
+_shards_with_tables = set()
+
+
+def shard_has_tables(alias):
+    connection = connections[alias]
+    key = (alias, connection.settings_dict['NAME'])
+    if key not in _shards_with_tables:
+        with connection.cursor() as cursor:
+            if 'backend_order' not in connection.introspection.table_names(cursor):
+                return False
+        _shards_with_tables.add(key)
+    return True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (settings.DATABASE_REPLICAS and not primary_pinned.get()
+                and model._meta.app_label == 'backend' and model._meta.model_name in CATALOG_MODELS):
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaStickinessMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self.pin_key(request)
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        cache = caches[settings.REPLICA_PIN_CACHE]
+        pinned = writes or (key is not None and cache.get(key) is not None)
+        token = primary_pinned.set(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        if writes and key is not None and response.status_code < 400:
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key = self.pin_key(request)
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        cache = caches[settings.REPLICA_PIN_CACHE]
+        pinned = writes or (key is not None and await cache.aget(key) is not None)
+        token = primary_pinned.set(pinned)
+        try:
+            response = await self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        if writes and key is not None and response.status_code < 400:
+            await cache.aset(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    @staticmethod
+    def pin_key(request):
+        credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credentials:
+            return None
+        return f'replica-pin:{hashlib.sha1(credentials.encode()).hexdigest()}'
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import (User, Shop, ShopCategory, Order, OrderItem, Category, Contact,
-                     ConfirmToken, Address, Product, ProductInfo, ProductParameter, Parameter)
+                     ConfirmToken, Address, Product, ProductInfo, ProductParameter, Parameter, BestOffer,
+                     RelatedProduct)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -63,7 +64,7 @@ class OrderItemsInOrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OrderItem
-        fields = ('quantity', 'product_info',)
+        fields = ('id', 'quantity', 'product_info',)
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -87,3 +88,36 @@ class ContactSerializer(serializers.ModelSerializer):
         model = Contact
         fields = ('id', 'user', 'phone', 'address')
         read_only_fields = ('address',)
+
+
+class AddressInContactSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Address
+        fields = ('city', 'street', 'house', 'structure', 'building', 'apartment')
+
+
+class ContactBulkSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+    address = AddressInContactSerializer(many=True, required=False)
+
+    class Meta:
+        model = Contact
+        fields = ('id', 'phone', 'address')
+
+
+class BestOfferSerializer(serializers.ModelSerializer):
+    best_shop = ShopSerializer(read_only=True)
+
+    class Meta:
+        model = BestOffer
+        fields = ('product', 'name', 'category', 'min_price', 'shop_count', 'best_shop')
+
+
+class RelatedProductSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='related_id', read_only=True)
+    name = serializers.CharField(source='related.name', read_only=True)
+    category = serializers.IntegerField(source='related.category_id', read_only=True)
+
+    class Meta:
+        model = RelatedProduct
+        fields = ('id', 'name', 'category', 'score')
@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Address, Contact, Order, OrderItem, UserShard
+from .routers import current_shard
+
+# Rows of a user moved by ShardMap.move, parents first.
+USER_ROWS = ((Order, 'user_id'), (OrderItem, 'order__user_id'), (Contact, 'user_id'), (Address, 'contact__user_id'))
+# Shard n hands out ids from n * ID_RANGE on, so ids stay unique across shards and survive moves.
+ID_RANGE = 2 ** 40
+
+
+class ShardMap:
+    # A user is placed by id on first use and stays there until moved. Writes lock the user's UserShard row
+    # until the shard transaction commits, so a move waits for them and later writes see the new shard.
+    def __init__(self, shards, cache_alias, cache_ttl=None):
+        self.shards = list(shards)
+        self.cache = caches[cache_alias]
+        self.cache_ttl = cache_ttl
+
+    @staticmethod
+    def key(user_id):
+        return f'shard:{user_id}'
+
+    def placement(self, user_id):
+        return self.shards[user_id % len(self.shards)]
+
+    def shard_for(self, user_id):
+        if len(self.shards) == 1:
+            return self.shards[0]
+        alias = self.cache.get(self.key(user_id))
+        if alias is None:
+            alias = UserShard.objects.get_or_create(user_id=user_id,
+                                                    defaults={'shard': self.placement(user_id)})[0].shard
+            self.cache.set(self.key(user_id), alias, self.cache_ttl)
+        return alias
+
+    def _lock(self, user_id):
+        return UserShard.objects.select_for_update().get_or_create(user_id=user_id,
+                                                                   defaults={'shard': self.placement(user_id)})[0]
+
+    @contextmanager
+    def using(self, alias):
+        token = current_shard.set(alias)
+        try:
+            yield alias
+        finally:
+            current_shard.reset(token)
+
+    def reading(self, user_id):
+        return self.using(self.shard_for(user_id))
+
+    @contextmanager
+    def writing(self, user_id):
+        if len(self.shards) == 1:
+            with self.using(self.shards[0]) as alias:
+                yield alias
+            return
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            alias = self._lock(user_id).shard
+            with self.using(alias), transaction.atomic(using=alias):
+                yield alias
+
+    def move(self, user_id, target):
+        # copies the user's rows to target and deletes them from the source while holding the row lock;
+        # returns the number of rows moved
+        moved = 0
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            row = self._lock(user_id)
+            if row.shard == target:
+                return moved
+            with transaction.atomic(using=row.shard):
+                rows = [(model, list(model.objects.using(row.shard).filter(**{lookup: user_id})))
+                        for model, lookup in USER_ROWS]
+                with transaction.atomic(using=target):
+                    for model, objects in rows:
+                        model.objects.using(target).bulk_create(objects, batch_size=1000)
+                        moved += len(objects)
+                Order.objects.using(row.shard).filter(user_id=user_id).delete()
+                Contact.objects.using(row.shard).filter(user_id=user_id).delete()
+            row.shard = target
+            row.save(update_fields=['shard'])
+        self.cache.delete(self.key(user_id))
+        return moved
+
+
+def sharded(method):
+    # runs a per-user view method with its Order/OrderItem/Contact/Address queries on the user's shard
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        shard_map = get_shard_map()
+        scope = shard_map.reading if request.method in ('GET', 'HEAD', 'OPTIONS') else shard_map.writing
+        with scope(request.user.id):
+            return method(self, request, *args, **kwargs)
+    return wrapper
+
+
+def reserve_id_range(alias):
+    if alias not in settings.DATABASE_SHARDS:
+        return
+    start = settings.DATABASE_SHARDS.index(alias) * ID_RANGE
+    if not start:
+        return
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model, lookup in USER_ROWS:
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), %s) "
+                               f"WHERE (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)}) < %s",
+                               [table, start, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s AND seq < %s', [table, start])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                               'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                               [table, start, table])
+
+
+_shard_map = None
+_shard_map_lock = threading.Lock()
+
+
+def get_shard_map():
+    global _shard_map
+    if _shard_map is None:
+        with _shard_map_lock:
+            if _shard_map is None:
+                _shard_map = ShardMap(settings.DATABASE_SHARDS, settings.SHARD_MAP_CACHE, settings.SHARD_MAP_CACHE_TTL)
+    return _shard_map
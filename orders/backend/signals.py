@@ -1,13 +1,51 @@
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver, Signal
 from django_rest_passwordreset.signals import reset_password_token_created
-from .models import ConfirmToken, User
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .catalog import bump_catalog_version
+from .events import publish_orders
+from .models import Category, ConfirmToken, Shop, ShopCategory, User
+from .outbox import enqueue
+from .sharding import get_shard_map, reserve_id_range
 
 new_user_registered = Signal()
 
 new_order = Signal()
 
+orders_state_changed = Signal()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed_signal(instance, **kwargs):
+    token_cache.invalidate_user(instance.id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed_signal(instance, **kwargs):
+    token_cache.invalidate_key(instance.key)
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ShopCategory)
+@receiver(post_delete, sender=ShopCategory)
+def catalog_changed_signal(**kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_migrate)
+def shard_migrated_signal(app_config, using, **kwargs):
+    if app_config.label == 'backend':
+        reserve_id_range(using)
+
 
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, **kwargs):
@@ -16,7 +54,7 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
                                  from_email=settings.EMAIL_HOST_USER,
                                  to=[reset_password_token.user.email]
                                  )
-    msg.send()
+    enqueue([msg])
 
 
 @receiver(new_user_registered)
@@ -28,7 +66,7 @@ def new_user_registered_signal(user_id, **kwargs):
                                  from_email=settings.EMAIL_HOST_USER,
                                  to=[token.user.email]
                                  )
-    msg.send()
+    enqueue([msg])
 
 
 @receiver(new_order)
@@ -40,4 +78,30 @@ def new_order_signal(user_id, **kwargs):
                                  from_email=settings.EMAIL_HOST_USER,
                                  to=[user.email]
                                  )
-    msg.send()
+    enqueue([msg])
+
+
+@receiver(new_order)
+def new_order_event(user_id, order_id=None, **kwargs):
+    if order_id is not None:
+        publish_orders({order_id}, 'order.created', 'in_progress', get_shard_map().shard_for(user_id))
+
+
+@receiver(orders_state_changed)
+def orders_state_changed_event(orders, state, using=None, **kwargs):
+    publish_orders({order_id for order_id, user_id in orders}, 'order.state', state, using)
+
+
+@receiver(orders_state_changed)
+def orders_state_changed_signal(orders, state, **kwargs):
+    order_ids = {}
+    for order_id, user_id in orders:
+        order_ids.setdefault(user_id, []).append(order_id)
+    emails = User.objects.filter(id__in=list(order_ids)).values_list('id', 'email')
+    messages = [EmailMultiAlternatives(subject="Order status update",
+                                       body=f"Orders {', '.join(map(str, sorted(order_ids[user_id])))} are {state}",
+                                       from_email=settings.EMAIL_HOST_USER,
+                                       to=[email]
+                                       )
+                for user_id, email in emails]
+    enqueue(messages)
@@ -0,0 +1,33 @@
+from django.db.models import Count, Sum
+
+from .models import ProductInfo, StockCounter
+
+
+def replace_shop_stock(shop_id, counts):
+    # counts: {category id: offers with quantity > 0}, known to the import without counting rows
+    StockCounter.objects.filter(shop_id=shop_id).delete()
+    StockCounter.objects.bulk_create(StockCounter(shop_id=shop_id, category_id=category_id, in_stock=in_stock)
+                                     for category_id, in_stock in sorted(counts.items()) if in_stock)
+
+
+def rebuild_stock(batch_size=1000):
+    # full recount
+    StockCounter.objects.all().delete()
+    rows = (ProductInfo.objects.filter(quantity__gt=0).values_list('shop_id', 'product__category_id')
+            .annotate(Count('id')).order_by())
+    StockCounter.objects.bulk_create((StockCounter(shop_id=shop_id, category_id=category_id, in_stock=in_stock)
+                                      for shop_id, category_id, in_stock in rows.iterator()), batch_size=batch_size)
+
+
+def stock_counts(shop_id=None, category_id=None):
+    counters = StockCounter.objects.filter(shop__state=True)
+    if shop_id:
+        counters = counters.filter(shop_id=shop_id)
+    if category_id:
+        counters = counters.filter(category_id=category_id)
+    return {
+        'categories': [{'id': row_id, 'in_stock': in_stock} for row_id, in_stock in
+                       counters.values_list('category_id').annotate(Sum('in_stock')).order_by('category_id')],
+        'shops': [{'id': row_id, 'in_stock': in_stock} for row_id, in_stock in
+                  counters.values_list('shop_id').annotate(Sum('in_stock')).order_by('shop_id')],
+    }
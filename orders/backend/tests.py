@@ -1,3 +1,1498 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+import statistics
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import asynccontextmanager
+from functools import partial
+from itertools import count
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import yaml
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.mail import EmailMultiAlternatives
+from django.http import HttpResponse
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Count
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import async_views, sharding
+from .async_views import read_view
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .metrics import REQUESTS, Counter, Histogram, Registry
+from .models import (Address, Category, ConfirmToken, Contact, EmailOutbox, IdempotencyKey, Order, OrderItem,
+                     Parameter, Product, PriceChunk, PriceSeries, ProductInfo, ProductParameter, RelatedProduct, Shop,
+                     User, UserShard, name_key)
+from .basket import BasketBusy, CacheBasket
+from .best_offers import refresh_best_offers
+from .dedup import merge_duplicates
+from .events import EventBus, MemoryBackend
+from .idempotency import DatabaseIdempotencyStore, MemoryIdempotencyStore
+from .imports import ImportBusy, ImportCoordinator
+from .loadclient import HttpClient
+from .maintenance import run_maintenance
+from .outbox import drain, enqueue
+from .price_history import price_history, record_prices
+from .recommendations import build_recommendations
+from .pooled_postgresql.pool import ConnectionPool, PoolTimeout
+from .routers import ReplicaRouter, ReplicaStickinessMiddleware
+from .sharding import ID_RANGE, ShardMap, reserve_id_range
+from .signals import new_order
+from .transitions import change_orders_state
+from .views import BasketView, CategoryView, OrderView, ProductInfoView, ShopView
+
+# only ShardingTests spread rows over shards; everything else runs on 'default' whatever DATABASE_SHARDS says
+_single_shard = override_settings(DATABASE_SHARDS=['default'])
+
+
+def setUpModule():
+    _single_shard.enable()
+    sharding._shard_map = None
+
+
+def tearDownModule():
+    _single_shard.disable()
+    sharding._shard_map = None
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(TestCase):
+    def test_signal_enqueues_instead_of_sending(self):
+        user = User.objects.create_user(email='customer@example.com', password='password', username='customer')
+        new_order.send(sender=self.__class__, user_id=user.id)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.filter(state='pending', to=['customer@example.com']).count(), 1)
+
+    def test_drain_sends_batch_over_one_connection(self):
+        enqueue([EmailMultiAlternatives(subject=f'Subject {i}', body='Body', to=[f'user{i}@example.com'])
+                 for i in range(5)])
+        with mock.patch('backend.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(drain(batch_size=3), 3)
+            self.assertEqual(drain(batch_size=3), 2)
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(drain(), 0)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_send_is_retried_with_backoff(self):
+        item = enqueue([EmailMultiAlternatives(subject='Subject', body='Body', to=['user@example.com'])])[0]
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(drain(), 0)
+            item.refresh_from_db()
+            self.assertEqual((item.state, item.attempts), ('pending', 1))
+            self.assertGreater(item.next_attempt, item.created)
+            EmailOutbox.objects.update(next_attempt=item.created)
+            drain()
+        item.refresh_from_db()
+        self.assertEqual((item.state, item.attempts, item.last_error), ('failed', 2, 'down'))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class MaintenanceTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(days=60)
+        self.user = User.objects.create_user(email='user@example.com', password=None, username='user',
+                                             is_active=True)
+        inactive = User.objects.create_user(email='inactive@example.com', password=None, username='inactive',
+                                            is_active=False)
+        shop = Shop.objects.create(name='Shop', user=self.user)
+        product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        offer = ProductInfo.objects.create(product=product, shop=shop, quantity=1, price=1, price_rrc=1)
+        for state in ('new', 'new', 'in_progress'):
+            order = Order.objects.create(user=self.user, state=state)
+            OrderItem.objects.create(order=order, product_info=offer, quantity=1)
+        self.fresh_basket = order.id - 1
+        Order.objects.exclude(id=self.fresh_basket).update(dt=old, updated_at=old)
+        self.offer = offer
+        ConfirmToken.objects.create(user=self.user, created_at=old)
+        ConfirmToken.objects.create(user=self.user)
+        Token.objects.create(user=self.user)
+        Token.objects.create(user=inactive)
+        ResetPasswordToken.objects.create(user=self.user)
+        ResetPasswordToken.objects.update(created_at=old)
+        for state in ('sent', 'sent', 'pending'):
+            EmailOutbox.objects.create(subject='Subject', body='Body', from_email='from@example.com',
+                                       to=['to@example.com'], state=state)
+        EmailOutbox.objects.update(created=old)
+        IdempotencyKey.objects.create(key='expired', expires=old)
+        IdempotencyKey.objects.create(key='live', expires=timezone.now() + timedelta(hours=1))
+
+    def test_purges_in_batches(self):
+        sleeps = []
+        removed = run_maintenance(batch_size=1, duty_cycle=0.5, wait_off_peak=False, sleep=sleeps.append)
+        self.assertEqual(removed, {'abandoned baskets': 1, 'confirm tokens': 1, 'inactive user tokens': 1,
+                                   'password reset tokens': 1, 'sent emails': 2, 'idempotency keys': 1})
+        self.assertEqual(len(sleeps), 7)
+        self.assertEqual(set(Order.objects.values_list('state', flat=True)), {'new', 'in_progress'})
+        self.assertTrue(Order.objects.filter(id=self.fresh_basket).exists())
+        self.assertEqual(OrderItem.objects.count(), 2)
+        self.assertEqual(ConfirmToken.objects.count(), 1)
+        self.assertEqual(list(Token.objects.values_list('user', flat=True)), [self.user.id])
+        self.assertFalse(ResetPasswordToken.objects.exists())
+        self.assertEqual(list(EmailOutbox.objects.values_list('state', flat=True)), ['pending'])
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['live'])
+
+    def test_waits_out_peak_hours(self):
+        sleeps = []
+        with mock.patch('backend.maintenance.off_peak', side_effect=[False, False] + [True] * 20):
+            removed = run_maintenance(wait_off_peak=True, sleep=sleeps.append)
+        self.assertEqual(sleeps, [60, 60])
+        self.assertEqual(removed['sent emails'], 2)
+
+    def test_old_basket_changed_recently_is_kept(self):
+        Order.objects.filter(id=self.fresh_basket).delete()
+        basket = Order.objects.get(state='new')
+        auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.get(user=self.user).key}'}
+        token_cache.clear()
+        response = self.client.post('/api/v1/basket',
+                                    {'items': json.dumps([{'product_info': self.offer.id, 'quantity': 1}])}, **auth)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(run_maintenance(wait_off_peak=False, sleep=lambda seconds: None)['abandoned baskets'], 0)
+        self.assertTrue(Order.objects.filter(id=basket.id).exists())
+
+    def test_cache_basket_in_use_is_kept(self):
+        Order.objects.filter(id=self.fresh_basket).delete()
+        basket = CacheBasket(self.user.id)
+        caches[settings.BASKET_CACHE].clear()
+        basket.add([{'product_info': self.offer.id, 'quantity': 1}])
+        order = Order.objects.get(state='new')
+        Order.objects.filter(id=order.id).update(updated_at=timezone.now() - timedelta(days=60))
+        with mock.patch('backend.basket.time.time', return_value=time.time() + CacheBasket.touch_interval):
+            basket.update([{'id': 1, 'quantity': 2}])
+        self.assertEqual(run_maintenance(wait_off_peak=False, sleep=lambda seconds: None)['abandoned baskets'], 0)
+        self.assertTrue(Order.objects.filter(id=order.id).exists())
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='customer@example.com', password=None, username='customer',
+                                        is_active=True)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'}
+        shop = Shop.objects.create(name='Shop', user=user)
+        product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        self.offer = ProductInfo.objects.create(product=product, shop=shop, quantity=5, price=10, price_rrc=12)
+        token_cache.clear()
+
+    def stores(self):
+        for store in (MemoryIdempotencyStore(ttl=60, max_keys=10), DatabaseIdempotencyStore(ttl=60, lease=30)):
+            with self.subTest(store=type(store).__name__), mock.patch('backend.idempotency._store', store):
+                OrderItem.objects.all().delete()
+                yield store
+
+    def post(self, key, quantity=1):
+        return self.client.post('/api/v1/basket', {'items': json.dumps([{'product_info': self.offer.id,
+                                                                         'quantity': quantity}])},
+                                HTTP_IDEMPOTENCY_KEY=key, **self.auth)
+
+    def test_retry_is_replayed(self):
+        for store in self.stores():
+            first, second = self.post('replay'), self.post('replay')
+            self.assertEqual((first.status_code, second.status_code), (201, 201))
+            self.assertEqual(second.json(), first.json())
+            self.assertEqual(second['Idempotent-Replayed'], 'true')
+            self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_key_reused_with_other_body(self):
+        for store in self.stores():
+            self.assertEqual(self.post('reused').status_code, 201)
+            response = self.post('reused', quantity=2)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(OrderItem.objects.get().quantity, 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1)
+    def test_request_in_flight(self):
+        for store in self.stores():
+            # the first request has not finished: its reservation outlives the wait timeout
+            with mock.patch.object(store, 'save'):
+                self.assertEqual(self.post('slow').status_code, 201)
+            time.sleep(0.2)
+            self.assertEqual(self.post('slow').status_code, 409)
+            self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_abandoned_reservation_expires_after_lease(self):
+        store = DatabaseIdempotencyStore(ttl=24 * 60 * 60, lease=30)
+        store.reserve('crashed', 'body', timeout=0)
+        expires = IdempotencyKey.objects.get(key='crashed').expires
+        self.assertLessEqual(expires, timezone.now() + timedelta(seconds=30))
+        with mock.patch('backend.idempotency.timezone.now', return_value=expires):
+            self.assertIsNone(store.reserve('crashed', 'body', timeout=0))
+        store.save('crashed', 201, {'Status': True})
+        self.assertGreater(IdempotencyKey.objects.get(key='crashed').expires, timezone.now() + timedelta(hours=23))
+
+
+class CacheBasketTests(TestCase):
+    def setUp(self):
+        caches[settings.BASKET_CACHE].clear()
+        self.user = User.objects.create_user(email='customer@example.com', password=None, username='customer',
+                                             is_active=True)
+        shop = Shop.objects.create(name='Shop', user=self.user)
+        product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        self.offers = [ProductInfo.objects.create(product=product, shop=shop, name=f'Offer {i}', quantity=5,
+                                                  price=10 * (i + 1), price_rrc=12) for i in range(2)]
+        self.basket = CacheBasket(self.user.id)
+
+    def add(self, *quantities):
+        return self.basket.add([{'product_info': offer.id, 'quantity': quantity}
+                                for offer, quantity in zip(self.offers, quantities)])
+
+    def test_add_update_delete(self):
+        self.assertEqual(self.add(1, 2), 2)
+        self.assertEqual(self.basket.update([{'id': 1, 'quantity': 3}, {'id': 9, 'quantity': 1}]), 1)
+        [representation] = self.basket.to_representation()
+        self.assertEqual(representation['total_sum'], 3 * 10 + 2 * 20)
+        self.assertEqual([(item['id'], item['quantity']) for item in representation['order_item']], [(1, 3), (2, 2)])
+        self.assertEqual(self.basket.delete([2, 9]), 1)
+        [representation] = self.basket.to_representation()
+        self.assertEqual((representation['state'], representation['total_sum']), ('new', 30))
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_checkout_writes_items(self):
+        self.add(1, 2)
+        order_id = self.basket.load()['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.basket.checkout(order_id), 1)
+        order = Order.objects.get(id=order_id)
+        self.assertEqual((order.state, order.total_sum, order.order_item.count()), ('in_progress', 50, 2))
+        self.assertIsNone(self.basket.load())
+        self.assertEqual(self.basket.to_representation(), [])
+
+    def test_checkout_after_header_was_purged(self):
+        self.add(1)
+        order_id = self.basket.load()['id']
+        Order.objects.filter(id=order_id).delete()
+        contact = Contact.objects.create(user=self.user, phone='79000000000')
+        auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.user).key}'}
+        with override_settings(BASKET_STORE='cache'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/order', {'id': str(order_id), 'contact': str(contact.id)}, **auth)
+        self.assertTrue(response.json()['Status'])
+        order = Order.objects.get(id=order_id)
+        self.assertEqual((order.user_id, order.state, order.total_sum), (self.user.id, 'in_progress', 10))
+
+    def test_expires_after_ttl(self):
+        with override_settings(BASKET_CACHE_TTL=60):
+            self.add(1)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.basket.load())
+            self.assertEqual(self.basket.to_representation(), [])
+
+    def test_concurrent_changes_are_not_lost(self):
+        self.add(1)
+
+        def add_items():
+            for i in range(5):
+                CacheBasket(self.user.id).add([{'product_info': self.offers[0].id, 'quantity': 1}])
+        threads = [threading.Thread(target=add_items) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.basket.load()['items']), 41)
+
+    def test_busy_basket(self):
+        self.basket.acquire()
+        with override_settings(BASKET_LOCK_TIMEOUT=0.05), self.assertRaises(BasketBusy):
+            self.add(1)
+        self.basket.release()
+        self.assertEqual(self.add(1), 1)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        caches[settings.TOKEN_CACHE].clear()
+        self.user = User.objects.create_user(email='partner@example.com', password='password', username='partner')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_warm_cache_needs_no_queries(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_user_change_invalidates_entry(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.type = 'partner'
+        self.user.save()
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.type, 'partner')
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_rotated_token_is_rejected(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.token.delete()
+        Token.objects.create(user=self.user)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_change_during_lookup_is_not_cached(self):
+        lookup = TokenAuthentication.authenticate_credentials
+
+        def racing_lookup(auth, key):
+            cached = lookup(auth, key)
+            User.objects.filter(id=self.user.id).update(is_active=False)
+            token_cache.invalidate_user(self.user.id)
+            return cached
+
+        with mock.patch.object(TokenAuthentication, 'authenticate_credentials', racing_lookup):
+            self.auth.authenticate_credentials(self.token.key)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_invalidation_reaches_other_processes(self):
+        other = TokenCache(60, 100, caches[settings.TOKEN_CACHE])
+        other.set(self.token.key, (self.user, self.token), other.version(self.user.id))
+        self.assertIsNotNone(other.get(self.token.key))
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(other.get(self.token.key))
+        self.assertEqual(other.stats()['size'], 0)
+
+
+class LoadTestCommandTests(TestCase):
+    def test_refuses_to_send_emails(self):
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend'):
+            with self.assertRaisesMessage(CommandError, 'EMAIL_BACKEND'):
+                call_command('loadtest', duration=0, stdout=io.StringIO())
+
+    def test_requires_products_in_stock(self):
+        with self.assertRaisesMessage(CommandError, 'No products in stock'):
+            call_command('loadtest', duration=0, stdout=io.StringIO())
+
+
+class LoadClientTests(SimpleTestCase):
+    @asynccontextmanager
+    async def serve(self, *responses, close_after=None):
+        # answers each request with the next response; closes the connection after `close_after` of them
+        self.connections = 0
+        responses = iter(responses)
+
+        async def handle(reader, writer):
+            self.connections += 1
+            served = 0
+            while await reader.readline():
+                length = 0
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                await reader.readexactly(length)
+                writer.write(next(responses))
+                await writer.drain()
+                served += 1
+                if served == close_after:
+                    break
+            writer.close()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        client = HttpClient(f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}')
+        try:
+            yield client
+        finally:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+
+    async def test_keep_alive_and_chunked_bodies(self):
+        async with self.serve(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}',
+                              b'HTTP/1.1 201 Created\r\nTransfer-Encoding: chunked\r\n\r\n'
+                              b'3;name=value\r\n[1,\r\n2\r\n2]\r\n0\r\n\r\n') as client:
+            first = await client.request('GET', '/first')
+            second = await client.request('POST', '/second', {'a': 1})
+        self.assertEqual((first.status, first.json()), (200, {}))
+        self.assertEqual((second.status, second.json()), (201, [1, 2]))
+        self.assertEqual(self.connections, 1)
+
+    async def test_reconnects_after_close(self):
+        async with self.serve(b'HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 1\r\n\r\n1',
+                              b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n2',
+                              b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n3', close_after=1) as client:
+            # the client closes the first connection (Connection: close), the server silently closes the second
+            bodies = [(await client.request('GET', '/')).body for i in range(3)]
+        self.assertEqual(bodies, [b'1', b'2', b'3'])
+        self.assertEqual(self.connections, 3)
+
+
+class FakeConnection:
+    closed = 0
+    status = 1
+
+    def rollback(self):
+        self.status = 1
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(TestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(FakeConnection), connection)
+        self.assertEqual(pool.stats()['connections_opened'], 1)
+
+    def test_closed_and_expired_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=2, max_lifetime=0)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['connections_closed'], 1)
+        self.assertIsNot(pool.getconn(FakeConnection), connection)
+
+    def test_checkout_waits_for_returned_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        connection = pool.getconn(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        pool.timeout = 5
+        threading.Timer(0.05, pool.putconn, [connection]).start()
+        self.assertIs(pool.getconn(FakeConnection), connection)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        caches[settings.REPLICA_PIN_CACHE].clear()
+
+    def test_only_catalog_reads_go_to_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(ProductInfo), 'replica1')
+        self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertEqual(router.db_for_write(ProductInfo), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'backend'))
+
+    def test_client_reads_from_primary_after_write(self):
+        used = []
+
+        def view(request):
+            used.append(ReplicaRouter().db_for_read(Shop))
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token first'))
+        middleware(factory.post('/', HTTP_AUTHORIZATION='Token first'))
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token first'))
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token second'))
+        self.assertEqual(used, ['replica1', 'default', 'default', 'replica1'])
+
+    async def test_async_client_reads_from_primary_after_write(self):
+        used = []
+
+        async def view(request):
+            used.append(ReplicaRouter().db_for_read(Shop))
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = AsyncRequestFactory()
+        await middleware(factory.get('/', headers={'Authorization': 'Token first'}))
+        await middleware(factory.post('/', headers={'Authorization': 'Token first'}))
+        await middleware(factory.get('/', headers={'Authorization': 'Token first'}))
+        self.assertEqual(used, ['replica1', 'default', 'default'])
+
+
+@override_settings(PERFORMANCE_TIMING=True)
+class PerformanceMiddlewareTests(TestCase):
+    def test_server_timing_header(self):
+        response = self.client.get('/api/v1/categories')
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="1 queries", serializer;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    async def test_server_timing_header_under_asgi(self):
+        response = await self.async_client.get('/api/v1/categories')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", serializer;dur=[\d.]+, ')
+
+
+class MetricsTests(TestCase):
+    def test_endpoint_reports_route_latency(self):
+        self.client.get('/api/v1/categories')
+        response = self.client.get('/api/v1/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket{route="categories",method="GET",le="+Inf"}',
+                      response.content)
+        self.assertIn(b'email_outbox_pending 0', response.content)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_endpoint_requires_token_or_allowed_address(self):
+        self.assertEqual(self.client.get('/api/v1/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get('/api/v1/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    async def test_async_requests_are_counted(self):
+        before = REQUESTS.samples().get(('categories', 'GET', '200'), 0)
+        await self.async_client.get('/api/v1/categories')
+        self.assertEqual(REQUESTS.samples()[('categories', 'GET', '200')], before + 1)
+
+    def test_samples_from_several_processes_are_merged(self):
+        registry = Registry()
+        requests = Counter('requests_total', 'Requests', ('route',), registry=registry)
+        latency = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1), registry=registry)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            requests.inc(route='basket')
+            latency.observe(0.5)
+            registry.flush()
+            other = Path(directory) / '1.json'
+            other.write_text((Path(directory) / f'{os.getpid()}.json').read_text())
+            rendered = registry.render()
+        self.assertIn('requests_total{route="basket"} 2', rendered)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', rendered)
+        self.assertIn('latency_seconds_count 2', rendered)
+
+
+class PriceHistoryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='partner@example.com', password='password', username='partner')
+        self.shop = Shop.objects.create(name='Shop', user=user)
+        self.product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        self.start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def test_only_changes_are_stored(self):
+        for hour, price in enumerate([100, 100, 120, 120, 90]):
+            record_prices(self.shop.id, [(1, self.product.id, price, 150, 5), (2, self.product.id, 10, 15, 1)],
+                          at=self.start + timedelta(hours=hour))
+        record_prices(self.shop.id, [(2, self.product.id, 10, 15, 1)], at=self.start + timedelta(hours=5))
+        series = PriceSeries.objects.get(external_id=1)
+        self.assertEqual(list(series.chunks.values_list('points', flat=True)), [4])
+        self.assertLess(len(series.chunk.data), 20)
+        self.assertEqual(PriceSeries.objects.get(external_id=2).chunk.points, 1)
+        history = price_history(PriceSeries.objects.filter(external_id=1), self.start + timedelta(minutes=30),
+                                self.start + timedelta(hours=6), 11)[0]['history']
+        self.assertEqual([(row['price'], row['price_min'], row['price_max'], row['quantity']) for row in history],
+                         [(100, 100, 100, 5), (120, 100, 120, 5), (120, 120, 120, 5), (90, 90, 120, 5),
+                          (90, 90, 90, 5), (90, 90, 90, 0)])
+
+    @override_settings(PRICE_HISTORY_CHUNK_POINTS=2)
+    def test_history_spans_chunks(self):
+        for day in range(10):
+            record_prices(self.shop.id, [(1, self.product.id, 100 + day, 150, 5)],
+                          at=self.start + timedelta(days=day))
+        self.assertEqual(PriceChunk.objects.count(), 5)
+        history = price_history(PriceSeries.objects.all(), self.start + timedelta(days=3, hours=12),
+                                self.start + timedelta(days=8), 2)[0]['history']
+        self.assertEqual([(row['price_min'], row['price_max'], row['price']) for row in history],
+                         [(103, 105, 105), (105, 108, 108)])
+
+    @mock.patch('backend.price_history.BATCH_SIZE', 2)
+    def test_large_import_is_written_in_batches(self):
+        statements = []
+        for hour in range(2):
+            offers = [(external_id, self.product.id, 100 + hour, 150, 5) for external_id in range(5)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(record_prices(self.shop.id, offers, at=self.start + timedelta(hours=hour)), 5)
+            statements.append(sum(query['sql'].startswith(('INSERT', 'UPDATE')) for query in queries.captured_queries))
+        # three statements of at most two rows for each bulk write: series and chunks created, series updated,
+        # then chunks and series updated
+        self.assertEqual(statements, [9, 6])
+        self.assertEqual(list(PriceSeries.objects.values_list('last_price', flat=True).distinct()), [101])
+        self.assertEqual(set(PriceChunk.objects.values_list('points', flat=True)), {2})
+
+
+class CatalogDedupTests(TestCase):
+    def test_names_are_normalized(self):
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Phone  X', category=category)
+        Product.objects.bulk_create([Product(name='phone x', name_key=name_key('phone x'), category=category)],
+                                    update_conflicts=True, unique_fields=['category', 'name_key'],
+                                    update_fields=['name'])
+        self.assertEqual(list(Product.objects.values_list('id', 'name')), [(product.id, 'phone x')])
+
+
+
+class CatalogDedupMergeTests(TransactionTestCase):
+    def setUp(self):
+        self.constraints = Product._meta.constraints
+        with mock.patch.object(Product._meta, 'constraints', []), connection.schema_editor() as editor:
+            editor.remove_constraint(Product, self.constraints[0])
+
+    def tearDown(self):
+        Product.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(Product, self.constraints[0])
+
+    def test_duplicates_are_merged(self):
+        user = User.objects.create_user(email='partner@example.com', password='password', username='partner')
+        shop = Shop.objects.create(name='Shop', user=user)
+        category = Category.objects.create(name='Category')
+        products = [Product.objects.create(name=name, category=category) for name in ('Phone', 'phone', 'Phone ')]
+        parameter = Parameter.objects.create(name='Color')
+        for product in products:
+            offer = ProductInfo.objects.create(name='Offer', product=product, shop=shop, quantity=1, price=1,
+                                               price_rrc=1)
+            ProductParameter.objects.create(product_info=offer, parameter=parameter, value='red')
+        self.assertEqual(merge_duplicates(Product, dry_run=True), 2)
+        self.assertEqual(merge_duplicates(Product), 2)
+        self.assertEqual(list(Product.objects.values_list('id', flat=True)), [products[0].id])
+        self.assertEqual(list(ProductInfo.objects.values_list('product_id', flat=True)), [products[0].id] * 3)
+        self.assertEqual(ProductParameter.objects.count(), 3)
+
+
+class DataMigrationTests(TransactionTestCase):
+    # the data migrations run on the historical models only, so they keep working as the app changes
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('backend', target)])
+        return executor.loader.project_state(('backend', target)).apps
+
+    def tearDown(self):
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes('backend')[0][1])
+
+    def test_name_keys_and_stock_counters(self):
+        apps = self.migrate('0022_price_history')
+        user = apps.get_model('backend', 'User').objects.create(email='partner@example.com', username='partner')
+        shop = apps.get_model('backend', 'Shop').objects.create(name='Shop', user_id=user.id)
+        category = apps.get_model('backend', 'Category').objects.create(name='Category')
+        products = [apps.get_model('backend', 'Product').objects.create(name=name, category_id=category.id)
+                    for name in ('Phone', 'phone ', 'Case')]
+        for product in products:
+            apps.get_model('backend', 'ProductInfo').objects.create(
+                name='Offer', product_id=product.id, shop_id=shop.id, quantity=1, price=1, price_rrc=1)
+        apps = self.migrate('0027_stock_counters')
+        Product = apps.get_model('backend', 'Product')
+        self.assertEqual(sorted(Product.objects.values_list('id', 'name_key')),
+                         [(products[0].id, name_key('Phone')), (products[2].id, name_key('Case'))])
+        self.assertEqual(list(apps.get_model('backend', 'StockCounter').objects.values_list('in_stock', flat=True)),
+                         [3])
+
+
+class ImportCoordinatorTests(TestCase):
+    def run_in_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def test_requests_for_busy_shop_are_coalesced(self):
+        coordinator = ImportCoordinator(max_concurrency=2, queue_timeout=5)
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], {}
+
+        def job(number):
+            calls.append(number)
+            if number == 0:
+                started.set()
+                release.wait(5)
+            return number
+
+        def request(number):
+            results[number] = coordinator.run('shop', partial(job, number))
+
+        self.run_in_thread(request, 0)
+        started.wait(5)
+        followers = [self.run_in_thread(request, number) for number in (1, 2, 3)]
+        while coordinator.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in followers:
+            thread.join()
+        self.assertEqual((len(calls), calls[0], coordinator.runs), (2, 0, 2))
+        self.assertEqual(results, {0: 0, 1: calls[1], 2: calls[1], 3: calls[1]})
+
+    def test_concurrency_is_capped(self):
+        coordinator = ImportCoordinator(max_concurrency=2, queue_timeout=5)
+        active, peak = [], []
+
+        def job():
+            active.append(1)
+            peak.append(len(active))
+            time.sleep(0.02)
+            active.pop()
+
+        threads = [self.run_in_thread(coordinator.run, f'shop {i}', job) for i in range(6)]
+        for thread in threads:
+            thread.join()
+        self.assertEqual((coordinator.runs, max(peak)), (6, 2))
+
+    def test_queue_timeout(self):
+        coordinator = ImportCoordinator(max_concurrency=1, queue_timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+        self.run_in_thread(coordinator.run, 'first', lambda: started.set() or release.wait(5))
+        started.wait(5)
+        with self.assertRaises(ImportBusy):
+            coordinator.run('second', lambda: None)
+        release.set()
+
+
+class BestOfferTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Category')
+        self.shops = []
+        for name in ('First', 'Second'):
+            user = User.objects.create_user(email=f'{name}@example.com', password='password', username=name,
+                                            type='partner')
+            self.shops.append(Shop.objects.create(name=name, user=user))
+        self.products = [Product.objects.create(name=f'Product {i}', category=self.category) for i in range(3)]
+        for shop, prices in zip(self.shops, ((100, 200, 300), (150, 120, None))):
+            for product, price in zip(self.products, prices):
+                if price:
+                    ProductInfo.objects.create(name='Offer', product=product, shop=shop, price=price, price_rrc=price,
+                                               quantity=1)
+        refresh_best_offers(product.id for product in self.products)
+        user = User.objects.create_user(email='customer@example.com', password='password', username='customer')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'}
+
+    def best(self, query=''):
+        return self.client.get(f'/api/v1/products/best?category_id={self.category.id}{query}', **self.auth).json()
+
+    def test_cheapest_shop_per_product(self):
+        results = self.best()['results']
+        self.assertEqual([(row['name'], row['min_price'], row['shop_count'], row['best_shop']['name'])
+                          for row in results],
+                         [('Product 0', 100, 2, 'First'), ('Product 1', 120, 2, 'Second'),
+                          ('Product 2', 300, 1, 'First')])
+
+    def test_sorted_pages(self):
+        page = self.best('&ordering=-price&page_size=2')
+        self.assertEqual([row['min_price'] for row in page['results']], [300, 120])
+        page = self.client.get(page['next'], **self.auth).json()
+        self.assertEqual(([row['min_price'] for row in page['results']], page['next']), ([100], None))
+
+    def test_partner_state_updates_index(self):
+        token = Token.objects.create(user=self.shops[0].user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/partner/state', {'state': 'off'}, HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual([(row['name'], row['min_price'], row['shop_count']) for row in self.best()['results']],
+                         [('Product 1', 120, 1), ('Product 0', 150, 1)])
+
+
+SHOP_YAML = Path(settings.BASE_DIR).parent / 'data' / 'shop1.yaml'
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = override_settings(RECOMMENDATIONS_MATRIX=Path(directory.name) / 'matrix.npz',
+                                    RECOMMENDATIONS_BATCH_LINES=2)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        category = Category.objects.create(name='Category')
+        self.user = User.objects.create_user(email='customer@example.com', password='password', username='customer')
+        shop = Shop.objects.create(name='Shop', user=self.user)
+        self.products = [Product.objects.create(name=f'Product {i}', category=category) for i in range(4)]
+        self.offers = [ProductInfo.objects.create(name='Offer', product=product, shop=shop, price=1, price_rrc=1,
+                                                  quantity=1) for product in self.products]
+        self.now = timezone.now()
+        for products in ((0, 1, 2), (0, 1, 1), (0, 2)):
+            self.order(products, 'completed', self.now - timedelta(hours=1))
+        self.order((0, 3), 'in_progress')
+
+    def order(self, products, state, completed_at=None):
+        order = Order.objects.create(user=self.user, state=state, completed_at=completed_at)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product_info=self.offers[i], quantity=1)
+                                      for i in products)
+
+    def build(self, at, **kwargs):
+        with mock.patch('backend.recommendations.timezone.now', return_value=at):
+            return build_recommendations(**kwargs)
+
+    def related(self):
+        ids = {product.id: i for i, product in enumerate(self.products)}
+        return {(ids[product_id], ids[related_id], score) for product_id, related_id, score
+                in RelatedProduct.objects.values_list('product_id', 'related_id', 'score')}
+
+    def test_counts_completed_orders(self):
+        self.assertEqual(self.build(self.now), 3)
+        self.assertEqual(self.related(), {(0, 1, 2), (0, 2, 2), (1, 0, 2), (1, 2, 1), (2, 0, 2), (2, 1, 1)})
+
+    def test_incremental_run_matches_full_rebuild(self):
+        self.build(self.now)
+        self.order((1, 3), 'completed', self.now)
+        self.assertEqual(self.build(self.now + timedelta(minutes=2)), 2)
+        incremental = self.related()
+        self.build(self.now + timedelta(minutes=2), full=True)
+        self.assertEqual(incremental, self.related())
+        self.assertIn((3, 1, 1), incremental)
+
+    def test_endpoint(self):
+        self.build(self.now)
+        auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.user).key}'}
+        response = self.client.get(f'/api/v1/products/{self.products[1].id}/related?limit=1', **auth)
+        self.assertEqual(response.json(), [{'id': self.products[0].id, 'name': 'Product 0',
+                                            'category': self.products[0].category_id, 'score': 2}])
+
+
+class OrderEventTests(TestCase):
+    def setUp(self):
+        self.bus = EventBus(MemoryBackend(buffer=3), queue_size=10)
+        patcher = mock.patch('backend.events._bus', self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.partner = User.objects.create_user(email='partner@example.com', password=None, username='partner',
+                                                type='partner', is_active=True)
+        self.token = Token.objects.create(user=self.partner).key
+        token_cache.clear()
+
+    def test_buffer_resume(self):
+        ids = [self.bus.publish({self.partner.id, 2}, 'order.state', {'order': i}) for i in range(4)]
+        self.bus.publish({2}, 'order.state', {'order': 4})
+        self.assertEqual([event[0] for event in self.bus.backend.since(self.partner.id, 0)], ids[2:])
+        self.assertEqual([event[3] for event in self.bus.backend.since(self.partner.id, ids[2])], [{'order': 3}])
+
+    def test_state_change_is_published(self):
+        shop = Shop.objects.create(name='Shop', user=self.partner)
+        product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        offer = ProductInfo.objects.create(product=product, shop=shop, quantity=1, price=1, price_rrc=1)
+        order = Order.objects.create(user=self.partner, state='in_progress')
+        OrderItem.objects.create(order=order, product_info=offer, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            change_orders_state({order.id}, 'completed')
+        [event] = self.bus.backend.since(self.partner.id, 0)
+        self.assertEqual(event[2:], ('order.state', {'order': order.id, 'state': 'completed'}))
+
+    async def test_stream(self):
+        first = self.bus.publish({self.partner.id}, 'order.created', {'order': 1, 'state': 'in_progress'})
+        response = await self.async_client.get('/api/v1/partner/events', headers={
+            'Authorization': f'Token {self.token}', 'Last-Event-ID': str(first - 1)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertIn(b'id: %d\nevent: order.created\n' % first, await anext(stream))
+        self.assertEqual(await anext(stream), b': connected\n\n')
+        second = self.bus.publish({self.partner.id}, 'order.state', {'order': 1, 'state': 'sent'})
+        self.assertEqual(await anext(stream),
+                         b'id: %d\nevent: order.state\ndata: {"order": 1, "state": "sent"}\n\n' % second)
+
+    async def test_closed_stream_unsubscribes(self):
+        stream = self.bus.stream(self.partner.id)
+        self.assertEqual(await anext(stream), ': connected\n\n')
+        self.assertTrue(self.bus._subscriptions)
+        await stream.aclose()
+        self.assertFalse(self.bus._subscriptions)
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='admin@example.com', password=None, username='admin')
+        self.client.force_login(self.admin)
+        partner = User.objects.create_user(email='partner@example.com', password=None, username='partner',
+                                           type='partner', is_active=True)
+        shop = Shop.objects.create(name='Shop', user=partner)
+        category = Category.objects.create(name='Category')
+        self.offers = [ProductInfo.objects.create(product=Product.objects.create(name=f'Phone {i}', category=category),
+                                                  shop=shop, name=f'Phone {i}', quantity=i, price=1, price_rrc=1)
+                       for i in range(3)]
+        self.orders = [Order.objects.create(user=partner, state=state)
+                       for state in ('in_progress', 'in_progress', 'new')]
+        for order in self.orders:
+            OrderItem.objects.create(order=order, product_info=self.offers[1], quantity=1)
+
+    def test_changelists(self):
+        for model in ('user', 'shop', 'product', 'productinfo', 'order', 'orderitem'):
+            response = self.client.get(f'/admin/backend/{model}/')
+            self.assertEqual(response.status_code, 200, model)
+        response = self.client.get('/admin/backend/productinfo/', {'q': 'Phone 2', 'in_stock': '1'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.offers[2]])
+        response = self.client.get('/admin/backend/orderitem/', {'q': str(self.orders[0].id)})
+        self.assertEqual([item.order_id for item in response.context['cl'].result_list], [self.orders[0].id])
+        for term in ('9' * 30, '²'):
+            response = self.client.get('/admin/backend/orderitem/', {'q': term})
+            self.assertEqual((response.status_code, list(response.context['cl'].result_list)), (200, []), term)
+        response = self.client.get('/admin/autocomplete/', {'app_label': 'backend', 'model_name': 'orderitem',
+                                                            'field_name': 'product_info', 'term': 'Phone 1'})
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.offers[1].id)])
+
+    def test_change_forms_leave_stock_prices_and_states_alone(self):
+        offer = self.offers[1]
+        response = self.client.post(f'/admin/backend/productinfo/{offer.id}/change/',
+                                    {'name': 'Renamed', 'quantity': 100, 'price': 1000, 'price_rrc': 1000})
+        self.assertEqual(response.status_code, 302)
+        offer.refresh_from_db()
+        self.assertEqual((offer.name, offer.quantity, offer.price), ('Renamed', 1, 1))
+        order = self.orders[2]
+        self.client.post(f'/admin/backend/order/{order.id}/change/',
+                         {'state': 'completed', 'total_sum': 5, 'order_item-TOTAL_FORMS': '1',
+                          'order_item-INITIAL_FORMS': '1', 'order_item-0-id': order.order_item.get().id,
+                          'order_item-0-order': order.id, 'order_item-0-quantity': 10})
+        order.refresh_from_db()
+        self.assertEqual((order.state, order.total_sum, order.order_item.get().quantity), ('new', 0, 1))
+        for model in ('productinfo', 'order', 'orderitem'):
+            self.assertEqual(self.client.get(f'/admin/backend/{model}/add/').status_code, 403, model)
+
+    def test_lists_say_which_shard_they_show(self):
+        self.assertIsNone(self.client.get('/admin/backend/order/').context.get('subtitle'))
+        with mock.patch('backend.admin.get_shard_map', return_value=ShardMap(['default', 'shard1'], 'default')):
+            response = self.client.get('/admin/backend/order/')
+        self.assertEqual(response.context['subtitle'],
+                         'Only the default shard is listed; orders on shard1 are not shown')
+
+    def test_state_action_on_whole_selection(self):
+        with mock.patch('backend.admin.BATCH_SIZE', 1):
+            self.client.post('/admin/backend/order/', {'action': 'make_completed', 'select_across': '1',
+                                                       '_selected_action': [self.orders[0].id], 'index': '0'})
+        self.assertEqual([order.state for order in Order.objects.order_by('id')], ['completed', 'completed', 'new'])
+
+
+@unittest.skipUnless('shard1' in settings.DATABASES, 'needs a shard1 database alias')
+@override_settings(DATABASE_SHARDS=['default', 'shard1'])
+class ShardingTests(TestCase):
+    databases = {'default', 'shard1'} & set(settings.DATABASES)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        patcher = mock.patch('backend.sharding._shard_map', ShardMap(['default', 'shard1'], 'default'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reserve_id_range('shard1')
+        self.partner = User.objects.create_user(email='partner@example.com', password=None, username='partner',
+                                                type='partner', is_active=True)
+        self.customer = User.objects.create_user(email='customer@example.com', password=None, username='customer',
+                                                 is_active=True)
+        UserShard.objects.create(user=self.customer, shard='shard1')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.customer).key}'}
+        shop = Shop.objects.create(name='Shop', user=self.partner)
+        product = Product.objects.create(name='Product', category=Category.objects.create(name='Category'))
+        self.offer = ProductInfo.objects.create(product=product, shop=shop, quantity=5, price=10, price_rrc=12)
+
+    def test_customer_rows_stay_on_their_shard(self):
+        response = self.client.post('/api/v1/user/contact', {
+            'phone': '79000000000', 'city': 'Moscow', 'street': 'Tverskaya', 'house': '1', 'structure': '1',
+            'building': '1', 'apartment': '1'}, **self.auth)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/v1/basket', {'items': json.dumps([{'product_info': self.offer.id,
+                                                                              'quantity': 2}])}, **self.auth)
+        self.assertEqual(response.status_code, 201)
+        basket = Order.objects.using('shard1').get(user=self.customer)
+        contact = Contact.objects.using('shard1').get(user=self.customer)
+        self.assertGreaterEqual(basket.id, ID_RANGE)
+        with self.captureOnCommitCallbacks(execute=True, using='shard1'):
+            response = self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(contact.id)},
+                                        **self.auth)
+        self.assertTrue(response.json()['Status'])
+        self.assertFalse(Order.objects.using('default').exists())
+        self.assertFalse(Contact.objects.using('default').exists())
+        [order] = self.client.get('/api/v1/order', **self.auth).json()
+        self.assertEqual((order['id'], order['state'], order['total_sum']), (basket.id, 'in_progress', 20))
+        self.assertEqual(change_orders_state({basket.id}, 'completed', partner_id=self.partner.id),
+                         [(basket.id, self.customer.id)])
+        self.assertEqual(Order.objects.using('shard1').get().state, 'completed')
+
+    def test_rebalance_moves_rows(self):
+        order = Order.objects.using('shard1').create(user=self.customer, state='completed')
+        OrderItem.objects.using('shard1').create(order=order, product_info=self.offer, quantity=1)
+        contact = Contact.objects.using('shard1').create(user=self.customer, phone='79000000000')
+        Address.objects.using('shard1').create(contact=contact, city='Moscow', street='Tverskaya', house='1')
+        call_command('rebalance_shards', '--from', 'shard1', '--to', 'default', stdout=io.StringIO())
+        self.assertEqual(UserShard.objects.get(user=self.customer).shard, 'default')
+        self.assertFalse(Order.objects.using('shard1').exists())
+        self.assertFalse(Address.objects.using('shard1').exists())
+        self.assertEqual(Order.objects.using('default').get().id, order.id)
+        self.assertEqual(Address.objects.using('default').get().contact_id, contact.id)
+        [listed] = self.client.get('/api/v1/order', **self.auth).json()
+        self.assertEqual(listed['id'], order.id)
+
+    def test_placements_expire_and_are_dropped_on_move(self):
+        shard_map = ShardMap(['default', 'shard1'], 'shared', 60)
+        caches['shared'].clear()
+        self.assertEqual(shard_map.shard_for(self.customer.id), 'shard1')
+        UserShard.objects.filter(user=self.customer).update(shard='default')
+        self.assertEqual(shard_map.shard_for(self.customer.id), 'shard1')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(shard_map.shard_for(self.customer.id), 'default')
+        shard_map.move(self.customer.id, 'shard1')
+        self.assertEqual(shard_map.shard_for(self.customer.id), 'shard1')
+
+
+@unittest.skipUnless('shard1' in settings.DATABASES, 'needs a shard1 database alias')
+class ShardMigrationTests(TransactionTestCase):
+    databases = {'default', 'shard1'} & set(settings.DATABASES)
+
+    def test_new_shard_is_migrated(self):
+        connection = connections['shard1']
+        with connection.schema_editor() as editor:
+            for model in (Address, Contact, OrderItem, Order):
+                editor.delete_model(model)
+        MigrationRecorder(connection).migration_qs.all().delete()
+        with mock.patch('backend.routers._shards_with_tables', set()), CaptureQueriesContext(connection) as queries:
+            call_command('migrate', database='shard1', verbosity=0)
+        # PostgreSQL refuses constraints to tables that are not there
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if 'REFERENCES "backend_user"' in query['sql']
+                          or 'REFERENCES "backend_productinfo"' in query['sql']])
+        with connection.cursor() as cursor:
+            tables = set(connection.introspection.table_names(cursor))
+            references = {constraint['foreign_key'][0] for table in tables
+                          for constraint in connection.introspection.get_constraints(cursor, table).values()
+                          if constraint['foreign_key']}
+        self.assertLessEqual({'backend_order', 'backend_orderitem', 'backend_contact', 'backend_address'}, tables)
+        self.assertNotIn('backend_user', tables)
+        self.assertLessEqual(references, tables)
+        user = User.objects.create(email='customer@example.com', username='customer')
+        order = Order.objects.using('shard1').create(user=user, state='new')
+        OrderItem.objects.using('shard1').create(order=order, product_info_id=1, quantity=1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ScaledDataTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='password',
+                                                username='customer', is_active=True)
+        cls.partner = User.objects.create_user(email='partner@example.com', password='password', username='partner',
+                                               type='partner', is_active=True)
+        cls.customer_auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=cls.customer).key}'}
+        cls.partner_auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=cls.partner).key}'}
+        with mock.patch('backend.imports.get') as get:
+            get.return_value.content = SHOP_YAML.read_bytes()
+            cls.client_class().post('/api/v1/partner/update', {'url': 'http://example.com/shop1.yaml'},
+                                    **cls.partner_auth)
+        cls.shop = Shop.objects.get(user=cls.partner)
+        cls.offers = list(ProductInfo.objects.filter(shop=cls.shop))
+        cls.basket = Order.objects.create(user=cls.customer, state='new')
+        OrderItem.objects.bulk_create(OrderItem(order=cls.basket, product_info=offer, quantity=1)
+                                      for offer in cls.offers)
+        partner_order = Order.objects.create(user=cls.partner, state='completed')
+        OrderItem.objects.create(order=partner_order, product_info=cls.offers[0], quantity=1)
+        cls.contact = Contact.objects.create(user=cls.customer, phone='79000000000')
+        Address.objects.create(contact=cls.contact, city='Moscow', street='Tverskaya', house='1', structure='1',
+                               building='1', apartment='1')
+        cls.unique = count()
+
+    def scale_up(self, factor):
+        category = Category.objects.first()
+        parameter = Parameter.objects.first()
+        for i in range(factor):
+            n = next(self.unique)
+            user = User.objects.create_user(email=f'partner{n}@example.com', password='password',
+                                            username=f'partner{n}', type='partner')
+            shop = Shop.objects.create(name=f'Shop {n}', user=user)
+            category.shops.add(shop)
+            product = Product.objects.create(name=f'Product {n}', category=category)
+            offers = ProductInfo.objects.bulk_create(
+                ProductInfo(name=f'Offer {n}.{j}', product=product, shop=shop, quantity=j, price=100 + j,
+                            price_rrc=120 + j) for j in range(factor))
+            ProductParameter.objects.bulk_create(ProductParameter(product_info=offer, parameter=parameter, value='1')
+                                                 for offer in offers)
+            orders = Order.objects.bulk_create([Order(user=self.customer, state='in_progress'),
+                                                Order(user=self.partner, state='completed')])
+            OrderItem.objects.bulk_create(OrderItem(order=order, product_info=offer, quantity=1)
+                                          for order in orders for offer in offers)
+            OrderItem.objects.bulk_create(OrderItem(order=self.basket, product_info=offer, quantity=1)
+                                          for offer in offers[:3])
+            contact = Contact.objects.create(user=self.customer, phone=f'7{n:010}')
+            Address.objects.bulk_create(Address(contact=contact, city='Moscow', street=f'Street {j}', house='1',
+                                                structure='1', building='1', apartment='1') for j in range(3))
+
+
+class EndpointQueryCountTests(ScaledDataTestCase):
+    scale = 20
+
+    def assertQueriesBounded(self, bound, prepare, status=200):
+        counts = []
+        for factor in (0, self.scale):
+            self.scale_up(factor)
+            request = prepare()
+            token_cache.clear()
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertEqual(response.status_code, status, response.content)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1], f'query count grows with data size: {counts}')
+        self.assertLessEqual(counts[0], bound)
+
+    def get(self, path, auth):
+        return lambda: lambda: self.client.get(path, **auth)
+
+    def send(self, method, path, data, auth):
+        return getattr(self.client, method)(path, urlencode(data), content_type='application/x-www-form-urlencoded',
+                                            **auth)
+
+    def new_user(self):
+        n = next(self.unique)
+        return User.objects.create_user(email=f'user{n}@example.com', password='password', username=f'user{n}')
+
+    def test_register(self):
+        def prepare():
+            n = next(self.unique)
+            return lambda: self.client.post('/api/v1/user/register', {
+                'first_name': 'First', 'last_name': 'Last', 'email': f'new{n}@example.com', 'password': 'Secret123!',
+                'company': 'Company', 'position': 'Position'})
+        self.assertQueriesBounded(9, prepare, status=201)
+
+    def test_email_confirm(self):
+        def prepare():
+            user = self.new_user()
+            token = ConfirmToken.objects.create(user=user)
+            return lambda: self.client.post('/api/v1/user/register/confirm', {'email': user.email, 'token': token.key})
+        self.assertQueriesBounded(5, prepare)
+
+    def test_login(self):
+        self.assertQueriesBounded(4, lambda: lambda: self.client.post('/api/v1/user/login', {
+            'username': self.customer.email, 'password': 'password'}))
+
+    def test_password_reset(self):
+        def prepare():
+            user = self.new_user()
+            return lambda: self.client.post('/api/v1/user/password_reset', {'email': user.email})
+        self.assertQueriesBounded(7, prepare)
+
+    def test_password_reset_confirm(self):
+        def prepare():
+            token = ResetPasswordToken.objects.create(user=self.new_user())
+            return lambda: self.client.post('/api/v1/user/password_reset/confirm', {
+                'token': token.key, 'password': 'AnotherSecret123!'})
+        self.assertQueriesBounded(8, prepare)
+
+    def test_user_details(self):
+        self.assertQueriesBounded(2, self.get('/api/v1/user/details', self.customer_auth))
+        self.assertQueriesBounded(3, lambda: lambda: self.client.post('/api/v1/user/details', {
+            'password': 'password', 'company': 'Other'}, **self.customer_auth))
+
+    def test_contact(self):
+        self.assertQueriesBounded(4, self.get('/api/v1/user/contact', self.customer_auth))
+        self.assertQueriesBounded(6, lambda: lambda: self.client.post('/api/v1/user/contact', {
+            'city': 'Moscow', 'street': 'Arbat', 'house': '2', 'structure': '1', 'building': '1', 'apartment': '1',
+            'phone': self.contact.phone}, **self.customer_auth), status=201)
+        self.assertQueriesBounded(6, lambda: lambda: self.send('put', '/api/v1/user/contact', {
+            'id': self.contact.id, 'city': 'Moscow', 'street': 'Arbat', 'house': '3', 'structure': '1',
+            'building': '1', 'apartment': '1'}, self.customer_auth))
+
+        def delete():
+            contact = Contact.objects.create(user=self.customer, phone=f'8{next(self.unique):010}')
+            return lambda: self.send('delete', '/api/v1/user/contact', {'items': str(contact.id)},
+                                     self.customer_auth)
+        self.assertQueriesBounded(7, delete)
+
+    def test_bulk_contacts(self):
+        sizes = iter((1, 40))
+
+        def prepare():
+            n = next(self.unique)
+            contacts = [{'phone': f'9{n:05}{i:05}', 'address': [
+                {'city': 'Moscow', 'street': f'Street {j}', 'house': '1', 'structure': '1', 'building': '1',
+                 'apartment': str(j)} for j in range(3)]} for i in range(next(sizes))]
+            return lambda: self.client.post('/api/v1/user/contact', {'contacts': json.dumps(contacts)},
+                                            **self.customer_auth)
+        self.assertQueriesBounded(7, prepare, status=201)
+
+        def edit():
+            contacts = list(Contact.objects.filter(user=self.customer).values_list('id', flat=True))
+            payload = [{'id': contact_id, 'phone': f'6{contact_id:010}', 'address': [
+                {'city': 'Moscow', 'street': 'Arbat', 'house': '1', 'structure': '1', 'building': '1',
+                 'apartment': '1'}]} for contact_id in contacts]
+            return lambda: self.send('put', '/api/v1/user/contact', {'contacts': json.dumps(payload)},
+                                     self.customer_auth)
+        self.assertQueriesBounded(7, edit)
+
+        def delete():
+            ids = ','.join(map(str, Contact.objects.filter(user=self.customer).values_list('id', flat=True)))
+            return lambda: self.send('delete', '/api/v1/user/contact', {'items': ids}, self.customer_auth)
+        self.assertQueriesBounded(7, delete)
+        self.assertFalse(Address.objects.filter(contact__user=self.customer).exists())
+
+    def test_catalog(self):
+        self.assertQueriesBounded(1, self.get('/api/v1/categories', {}))
+        self.assertQueriesBounded(1, self.get('/api/v1/shops', {}))
+        self.assertQueriesBounded(3, self.get('/api/v1/catalog', {}))
+        self.assertQueriesBounded(3, self.get('/api/v1/products', self.customer_auth))
+        self.assertQueriesBounded(3, self.get(f'/api/v1/products?shop_id={self.shop.id}', self.customer_auth))
+
+    def test_catalog_tree_is_rendered_once_per_version(self):
+        caches[settings.CATALOG_CACHE].clear()
+        response = self.client.get('/api/v1/catalog')
+        tree = {category['id']: category for category in response.json()}
+        self.assertEqual(tree[224]['shops'], [{'id': self.shop.id, 'name': self.shop.name, 'offers': 4}])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/catalog').content, response.content)
+            self.assertEqual(self.client.get('/api/v1/catalog', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                             304)
+        self.client.post('/api/v1/partner/state', {'state': 'off'}, **self.partner_auth)
+        tree = {category['id']: category for category in self.client.get('/api/v1/catalog').json()}
+        self.assertEqual((tree[224]['shops'], tree[224]['offers']), ([], 0))
+
+    def test_partner_update(self):
+        def prepare():
+            get = mock.patch('backend.imports.get').start()
+            self.addCleanup(mock.patch.stopall)
+            get.return_value.content = SHOP_YAML.read_bytes()
+            return lambda: self.client.post('/api/v1/partner/update', {'url': 'http://example.com/shop1.yaml'},
+                                            **self.partner_auth)
+        self.assertQueriesBounded(20, prepare)
+
+    def test_price_history(self):
+        self.assertQueriesBounded(5, self.get(f'/api/v1/products/history?offer_id={self.offers[0].id}',
+                                              self.customer_auth))
+        self.assertQueriesBounded(4, self.get(f'/api/v1/products/history?product_id={self.offers[0].product_id}',
+                                              self.customer_auth))
+
+    def test_best_offers(self):
+        refresh_best_offers(ProductInfo.objects.values_list('product_id', flat=True))
+        self.assertQueriesBounded(3, self.get('/api/v1/products/best?category_id=224&ordering=-price',
+                                              self.customer_auth))
+
+    def test_stock(self):
+        self.assertQueriesBounded(4, self.get('/api/v1/products/stock', self.customer_auth))
+
+    def test_related_products(self):
+        product = self.offers[0].product_id
+        self.assertQueriesBounded(3, self.get(f'/api/v1/products/{product}/related', self.customer_auth))
+
+    def test_partner_state(self):
+        self.assertQueriesBounded(3, self.get('/api/v1/partner/state', self.partner_auth))
+        self.assertQueriesBounded(6, lambda: lambda: self.client.post('/api/v1/partner/state', {'state': 'on'},
+                                                                      **self.partner_auth))
+
+    def test_partner_orders(self):
+        self.assertQueriesBounded(5, self.get('/api/v1/partner/orders', self.partner_auth))
+
+        def change_state():
+            order = Order.objects.create(user=self.customer, state='in_progress')
+            OrderItem.objects.create(order=order, product_info=self.offers[0], quantity=1)
+            return lambda: self.client.post('/api/v1/partner/orders/state', {'items': str(order.id),
+                                                                              'state': 'completed'},
+                                            **self.partner_auth)
+        self.assertQueriesBounded(6, change_state)
+
+    def test_basket(self):
+        self.assertQueriesBounded(5, self.get('/api/v1/basket', self.customer_auth))
+        items = json.dumps([{'product_info': self.offers[0].id, 'quantity': 1}])
+        self.assertQueriesBounded(8, lambda: lambda: self.client.post('/api/v1/basket', {'items': items},
+                                                                      **self.customer_auth), status=201)
+        item = self.basket.order_item.first()
+        self.assertQueriesBounded(7, lambda: lambda: self.send('put', '/api/v1/basket', {
+            'items': json.dumps([{'id': item.id, 'quantity': 2}])}, self.customer_auth))
+
+        def delete():
+            item = OrderItem.objects.create(order=self.basket, product_info=self.offers[0], quantity=1)
+            return lambda: self.send('delete', '/api/v1/basket', {'items': str(item.id)}, self.customer_auth)
+        self.assertQueriesBounded(7, delete)
+
+    def test_order(self):
+        self.assertQueriesBounded(5, self.get('/api/v1/order', self.customer_auth))
+
+        def checkout():
+            Order.objects.filter(user=self.customer, state='new').update(state='in_progress')
+            basket = Order.objects.create(user=self.customer, state='new')
+            OrderItem.objects.create(order=basket, product_info=self.offers[0], quantity=1)
+            return lambda: self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(self.contact.id)},
+                                            **self.customer_auth)
+        self.assertQueriesBounded(7, checkout)
+
+    def test_metrics(self):
+        self.assertQueriesBounded(1, self.get('/api/v1/metrics', {}))
+
+
+class PartnerOrderStateTests(ScaledDataTestCase):
+    def post(self, order_id, state):
+        return self.client.post('/api/v1/partner/orders/state', {'items': str(order_id), 'state': state},
+                                **self.partner_auth)
+
+    def test_partner_cannot_move_basket(self):
+        self.assertEqual(self.post(self.basket.id, 'in_progress').status_code, 400)
+        response = self.post(self.basket.id, 'rejected')
+        self.assertEqual(response.json()['Rejected'], [self.basket.id])
+        self.basket.refresh_from_db()
+        self.assertEqual(self.basket.state, 'new')
+
+    def test_partner_moves_placed_order(self):
+        order = Order.objects.create(user=self.customer, state='in_progress')
+        OrderItem.objects.create(order=order, product_info=self.offers[0], quantity=1)
+        self.assertEqual(self.post(order.id, 'rejected').json()['Rejected'], [])
+        order.refresh_from_db()
+        self.assertEqual(order.state, 'rejected')
+
+
+@override_settings(ASYNC_READ_VIEWS=True)
+class AsyncReadViewTests(ScaledDataTestCase):
+    views = {'products': (ProductInfoView, async_views.products, True),
+             'categories': (CategoryView, async_views.categories, False),
+             'shops': (ShopView, async_views.shops, False),
+             'basket': (BasketView, async_views.basket, True),
+             'order': (OrderView, async_views.orders, True)}
+
+    @staticmethod
+    def sync_get(view_class, path, query, headers):
+        response = view_class.as_view()(RequestFactory().get(path, query, headers=headers))
+        response.render()
+        return response
+
+    async def assertSameResponse(self, name, query=None, headers=None):
+        view_class, async_get, login_required = self.views[name]
+        path = f'/api/v1/{name}'
+        async_response = await read_view(view_class, async_get, login_required)(
+            AsyncRequestFactory().get(path, query, headers=headers))
+        sync_response = await sync_to_async(self.sync_get)(view_class, path, query, headers)
+        self.assertEqual((async_response.status_code, async_response.content),
+                         (sync_response.status_code, sync_response.content), name)
+        return async_response
+
+    async def test_responses_match_sync_views(self):
+        auth = {'Authorization': self.customer_auth['HTTP_AUTHORIZATION']}
+        for name in self.views:
+            response = await self.assertSameResponse(name, headers=auth)
+            self.assertEqual(response.status_code, 200)
+        await self.assertSameResponse('products', {'shop_id': self.shop.id, 'in_stock': '1'}, auth)
+        product = await Product.objects.aget(id=self.offers[0].product_id)
+        await self.assertSameResponse('products', {'category_id': product.category_id}, auth)
+
+    async def test_rejected_credentials_match_sync_views(self):
+        inactive = await User.objects.acreate(email='inactive@example.com', username='inactive', is_active=False)
+        token = await Token.objects.acreate(user=inactive)
+        for headers in (None, {'Authorization': 'Token unknown'}, {'Authorization': 'Token a b'},
+                        {'Authorization': f'Token {token.key}'}):
+            for name in ('products', 'basket', 'order'):
+                response = await self.assertSameResponse(name, headers=headers)
+                self.assertEqual(response.status_code, 401)
+        response = await self.assertSameResponse('categories', headers={'Authorization': 'Token unknown'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_other_methods_use_sync_view(self):
+        view = read_view(BasketView, async_views.basket)
+        items = json.dumps([{'product_info': self.offers[0].id, 'quantity': 1}])
+        request = AsyncRequestFactory().post('/api/v1/basket', {'items': items},
+                                             headers={'Authorization': self.customer_auth['HTTP_AUTHORIZATION']})
+        response = await view(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await OrderItem.objects.filter(order=self.basket).acount(), len(self.offers) + 1)
+
+
+class StockCounterTests(ScaledDataTestCase):
+    def counts(self, query=''):
+        return self.client.get(f'/api/v1/products/stock{query}', **self.customer_auth).json()
+
+    def expected(self, shops=None):
+        offers = ProductInfo.objects.filter(quantity__gt=0, shop__state=True)
+        return {
+            'categories': [{'id': category_id, 'in_stock': count} for category_id, count in
+                           offers.values_list('product__category_id').annotate(Count('id'))
+                           .order_by('product__category_id')],
+            'shops': [{'id': shop_id, 'in_stock': count} for shop_id, count in
+                      offers.values_list('shop_id').annotate(Count('id')).order_by('shop_id')],
+        }
+
+    def test_import_maintains_counters(self):
+        self.assertEqual(self.counts(), self.expected())
+        source = yaml.safe_load(SHOP_YAML.read_bytes())
+        for item in source['goods'][::2]:
+            item['quantity'] = 0
+        with mock.patch('backend.imports.get') as get:
+            get.return_value.content = yaml.dump(source, allow_unicode=True).encode()
+            self.client.post('/api/v1/partner/update', {'url': 'http://example.com/shop1.yaml'}, **self.partner_auth)
+        self.assertEqual(self.counts(), self.expected())
+        self.assertEqual(self.counts(f'?shop_id={self.shop.id}')['shops'], self.expected()['shops'])
+
+    def test_inactive_shops_and_rebuild(self):
+        self.scale_up(2)
+        self.assertNotEqual(self.counts(), self.expected())
+        call_command('rebuild_stock_counters', stdout=io.StringIO())
+        self.assertEqual(self.counts(), self.expected())
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        self.assertEqual(self.counts(), self.expected())
+
+    def test_in_stock_filter(self):
+        ProductInfo.objects.filter(id=self.offers[0].id).update(quantity=0)
+        offers = self.client.get('/api/v1/products?in_stock=1', **self.customer_auth).json()
+        self.assertEqual(len(offers), len(self.offers) - 1)
+
+
+class PartnerExportTests(ScaledDataTestCase):
+    def export(self, path, **extra):
+        response = self.client.get(f'/api/v1/partner/export/{path}', **self.partner_auth, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_catalog_round_trips(self):
+        response, content = self.export('catalog')
+        exported, source = yaml.safe_load(content), yaml.safe_load(SHOP_YAML.read_bytes())
+        for item in source['goods']:
+            item['parameters'] = {name: str(value) for name, value in item['parameters'].items()}
+        self.assertEqual(exported['shop'], source['shop'])
+        self.assertCountEqual(exported['categories'], source['categories'])
+        self.assertEqual(exported['goods'], source['goods'])
+
+    def test_gzip(self):
+        response, content = self.export('catalog', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content), self.export('catalog')[1])
+        for header in ('gzip;q=0, deflate', 'identity', '*;q=0', 'gzip;q=0, *'):
+            self.assertNotIn('Content-Encoding', self.export('catalog', HTTP_ACCEPT_ENCODING=header)[0], header)
+        for header in ('deflate, GZIP;q=0.5', '*', 'x-gzip'):
+            self.assertEqual(self.export('catalog', HTTP_ACCEPT_ENCODING=header)[0]['Content-Encoding'], 'gzip', header)
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        response = await self.async_client.get('/api/v1/partner/export/catalog',
+                                               headers={'Authorization': self.partner_auth['HTTP_AUTHORIZATION']})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, (await sync_to_async(self.export)('catalog'))[1])
+
+    def test_orders_csv(self):
+        rows = list(csv.reader(self.export('orders')[1].decode().splitlines()))
+        self.assertEqual(rows[0][0], 'order')
+        self.assertEqual(len(rows) - 1, OrderItem.objects.filter(product_info__shop=self.shop).count())
+        rows = list(csv.reader(self.export('orders?state=completed')[1].decode().splitlines()))
+        self.assertEqual([int(row[3]) for row in rows[1:]], [self.offers[0].id])
+
+    def test_queries_do_not_grow(self):
+        counts = []
+        for factor in (0, 20):
+            self.scale_up(factor)
+            ProductInfo.objects.filter(shop__user__username__startswith='partner').update(shop=self.shop)
+            token_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.export('catalog')
+                self.export('orders')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+@unittest.skipUnless(os.environ.get('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run timing benchmarks')
+class EndpointBenchmarks(ScaledDataTestCase):
+    scale = 50
+    runs = 20
+    budget_ms = 250
+
+    def assertFast(self, path, auth):
+        self.scale_up(self.scale)
+        self.client.get(path, **auth)
+        durations = []
+        for i in range(self.runs):
+            started = time.perf_counter()
+            self.client.get(path, **auth)
+            durations.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(durations)
+        print(f'\n{path}: median {median:.1f} ms, max {max(durations):.1f} ms over {self.runs} runs')
+        self.assertLess(median, self.budget_ms)
+
+    def test_products_latency(self):
+        self.assertFast('/api/v1/products', self.customer_auth)
+
+    def test_orders_latency(self):
+        self.assertFast('/api/v1/order', self.customer_auth)
+
+    def test_basket_latency(self):
+        self.assertFast('/api/v1/basket', self.customer_auth)
@@ -0,0 +1,37 @@
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductInfo, ORDER_TRANSITIONS, PARTNER_ORDER_TRANSITIONS
+from .sharding import get_shard_map
+from .signals import orders_state_changed
+
+
+def change_orders_state(order_ids, state, partner_id=None, sender=None):
+    transitions = ORDER_TRANSITIONS if partner_id is None else PARTNER_ORDER_TRANSITIONS
+    from_states = [from_state for from_state, targets in transitions.items() if state in targets]
+    completed_at = {'completed_at': timezone.now()} if state == 'completed' else {}
+    offers = None
+    changed = []
+    for alias in get_shard_map().shards:
+        orders = Order.objects.using(alias).filter(id__in=order_ids, state__in=from_states)
+        if partner_id is not None:
+            # the catalog is only on 'default'; other shards filter by the partner's offer ids
+            if alias == DEFAULT_DB_ALIAS:
+                items = OrderItem.objects.filter(product_info__shop__user_id=partner_id)
+            else:
+                if offers is None:
+                    offers = list(ProductInfo.objects.filter(shop__user_id=partner_id).values_list('id', flat=True))
+                items = OrderItem.objects.filter(product_info_id__in=offers)
+            orders = orders.filter(Exists(items.filter(order_id=OuterRef('pk'))))
+        with transaction.atomic(using=alias):
+            shard_changed = list(orders.select_for_update().values_list('id', 'user_id'))
+            if shard_changed:
+                Order.objects.using(alias).filter(id__in=[order_id for order_id, user_id in shard_changed]).update(
+                    state=state, **completed_at)
+                transaction.on_commit(partial(orders_state_changed.send, sender=sender, orders=shard_changed,
+                                              state=state, using=alias), using=alias)
+        changed += shard_changed
+    return changed
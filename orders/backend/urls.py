@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
 from .views import UserRegister, EmailConfirm, UserLogin, ContactView, UserDetails, CategoryView, ShopView, \
-    PartnerUpdate, PartnerState, PartnerOrders, BasketView, OrderView, ProductInfoView
+    PartnerUpdate, PartnerState, PartnerOrders, PartnerOrderState, PartnerExportCatalog, PartnerExportOrders, \
+    BasketView, CacheBasketView, OrderView, ProductInfoView, PriceHistoryView, BestOfferView, \
+    RelatedProductView, StockView
+from . import async_views
+from .async_views import read_view
+from .metrics import metrics_view
+from .catalog import catalog_view
 
 app_name = 'backend'
 
@@ -13,12 +20,23 @@ urlpatterns = [
     path('user/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('user/details', UserDetails.as_view(), name='user-details'),
     path('user/contact', ContactView.as_view(), name='contact'),
-    path('categories', CategoryView.as_view(), name='categories'),
-    path('shops', ShopView.as_view(), name='shops'),
+    path('categories', read_view(CategoryView, async_views.categories, login_required=False), name='categories'),
+    path('shops', read_view(ShopView, async_views.shops, login_required=False), name='shops'),
+    path('catalog', catalog_view, name='catalog'),
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
-    path('basket', BasketView.as_view(), name='basket'),
-    path('order', OrderView.as_view(), name='order'),
-    path('products', ProductInfoView.as_view(), name='shops'),
+    path('partner/orders/state', PartnerOrderState.as_view(), name='partner-orders-state'),
+    path('partner/events', async_views.authenticated(async_views.partner_events), name='partner-events'),
+    path('partner/export/catalog', PartnerExportCatalog.as_view(), name='partner-export-catalog'),
+    path('partner/export/orders', PartnerExportOrders.as_view(), name='partner-export-orders'),
+    path('basket', read_view(CacheBasketView if settings.BASKET_STORE == 'cache' else BasketView, async_views.basket),
+         name='basket'),
+    path('order', read_view(OrderView, async_views.orders), name='order'),
+    path('products', read_view(ProductInfoView, async_views.products), name='products'),
+    path('products/best', BestOfferView.as_view(), name='best-offers'),
+    path('products/<int:product_id>/related', RelatedProductView.as_view(), name='related-products'),
+    path('products/stock', StockView.as_view(), name='stock'),
+    path('products/history', PriceHistoryView.as_view(), name='price-history'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,17 +1,33 @@
 import json
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.generics import ListAPIView
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.request import Request
-from yaml import load as load_yaml, Loader
-from requests import get
-from .models import (User, Shop, ShopCategory, Order, OrderItem, Category, Contact, Address,
-                     ConfirmToken, Product, ProductInfo, ProductParameter, Parameter)
+from .models import (Shop, Order, OrderItem, Category, Contact, Address, ConfirmToken, ProductInfo, PriceSeries,
+                     BestOffer, RelatedProduct, ORDER_TRANSITIONS, PARTNER_ORDER_STATES)
 from .serializers import (UserSerializer, ShopSerializer, OrderSerializer, OrderItemSerializer, CategorySerializer,
-                          ContactSerializer, ProductSerializer, ProductInfoSerializer, ProductParameterSerializer,
-                          ParameterSerializer, AddressSerializer)
+                          ContactSerializer, ProductInfoSerializer, AddressInContactSerializer,
+                          ContactBulkSerializer, BestOfferSerializer, RelatedProductSerializer)
 from .signals import new_user_registered, new_order
+from .idempotency import idempotent
+from .sharding import sharded
+from .basket import BasketBusy, CacheBasket, basket_total
+from .transitions import change_orders_state
+from .imports import ImportBusy, get_coordinator, import_price_list
+from .catalog import bump_catalog_version
+from .best_offers import schedule_refresh
+from .exports import catalog_chunks, order_chunks, stream_response
+from .price_history import price_history
+from .stock import stock_counts
+from .performance import SerializerTimingMixin, serialized, validated
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 
@@ -23,7 +39,7 @@ class UserRegister(APIView):
             request.data._mutable = True
             request.data.update({})
             user_serializer = UserSerializer(data=request.data)
-            if user_serializer.is_valid():
+            if validated(user_serializer):
                 user = user_serializer.save()
                 user.set_password(request.data['password'])
                 user.save()
@@ -70,92 +86,105 @@ class UserLogin(APIView):
 
 class ContactView(APIView):
 
+    @sharded
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-        contact = Contact.objects.filter(user_id=request.user.id)
+        contact = Contact.objects.filter(user_id=request.user.id).prefetch_related('address')
         serializer = ContactSerializer(contact, many=True)
-        return Response(serializer.data)
+        return Response(serialized(serializer))
 
+    @sharded
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-
-        if {'city', 'street', 'phone'}.issubset(request.data):
-            request.data._mutable = True
-            request.data.update({'user': request.user.id})
-            contact_serializer = ContactSerializer(data=request.data)
-            adr_serializer = AddressSerializer(data=request.data)
-            if contact_serializer.is_valid():
-                if adr_serializer.is_valid():
-                    contact_id = Contact.objects.filter(phone=(request.data['phone'])).first()
-                    if contact_id:
-                        adr_serializer.save(contact=contact_id)
-                        return Response({'Status': True, 'Comment': f'New address created for {request.data['phone']}'}, status=201)
-                    else:
-                        contact_serializer.save()
-                        contact_id = Contact.objects.filter(phone=(request.data['phone'])).first()
-                        adr_serializer.save(contact=contact_id)
-                        return Response({'Status': True, 'Comment': 'New contact with address created'}, status=201)
-                else:
-                    return Response({'Status': False, 'Comment': 'Error', 'Errors': adr_serializer.errors}, status=400)
-            else:
-                return Response({'Status': False, 'Comment': 'Error', 'Errors': contact_serializer.errors}, status=400)
-        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
-
+        contacts = self.contacts_from_request(request.data, ('phone', 'city', 'street'))
+        if contacts is None:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+        serializer = ContactBulkSerializer(data=contacts, many=True)
+        if not validated(serializer):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': serializer.errors}, status=400)
+        if not all('phone' in contact for contact in serializer.validated_data):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Phone is required'}, status=400)
+        with transaction.atomic():
+            existing = {contact.phone: contact for contact in Contact.objects.filter(
+                user_id=request.user.id, phone__in=[contact['phone'] for contact in serializer.validated_data])}
+            new_contacts = {}
+            for contact in serializer.validated_data:
+                if contact['phone'] not in existing:
+                    new_contacts.setdefault(contact['phone'], Contact(user_id=request.user.id, phone=contact['phone']))
+            existing.update((contact.phone, contact) for contact in Contact.objects.bulk_create(new_contacts.values()))
+            addresses = Address.objects.bulk_create(
+                Address(contact=existing[contact['phone']], **address)
+                for contact in serializer.validated_data for address in contact.get('address', ()))
+        return Response({'Status': True,
+                         'Comment': f'{len(new_contacts)} contacts and {len(addresses)} addresses created'}, status=201)
+
+    @sharded
     def delete(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
 
-        items_sting = request.data.get('items')
-        if items_sting:
-            items_list = items_sting.strip().split(',')
-            contact_query = Q()
-            adr_query = Q()
-            objects_deleted = False
-            for contact_id in items_list:
-                if contact_id.isdigit():
-                    contact_query = contact_query | Q(user_id=request.user.id, id=contact_id)
-                    adr_query = adr_query | Q(contact=contact_id)
-                    objects_deleted = True
-                else:
-                    return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id must be integer'}, status=400)
-            if objects_deleted:
-                deleted_adr = Address.objects.filter(adr_query).delete()[0]
-                deleted_count = Contact.objects.filter(contact_query).delete()[0]
-                return Response({'Status': True,
-                                 'Comment': f'Deleted {deleted_count} contacts and {deleted_adr} addresses'})
-            else:
-                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Contact ids not found'}, status=400)
+        items_sting = request.data.get('items', '')
+        addresses_sting = request.data.get('addresses', '')
+        if items_sting or addresses_sting:
+            contact_ids = [item for item in items_sting.strip().split(',') if item]
+            address_ids = [item for item in addresses_sting.strip().split(',') if item]
+            if not all(item.strip().isdigit() for item in contact_ids + address_ids):
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id must be integer'}, status=400)
+            with transaction.atomic():
+                deleted_adr = Address.objects.filter(id__in=address_ids, contact__user_id=request.user.id).delete()[0]
+                deleted = Contact.objects.filter(user_id=request.user.id, id__in=contact_ids).delete()[1]
+            deleted_count = deleted.get(Contact._meta.label, 0)
+            deleted_adr += deleted.get(Address._meta.label, 0)
+            return Response({'Status': True,
+                             'Comment': f'Deleted {deleted_count} contacts and {deleted_adr} addresses'})
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
+    @sharded
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-        if 'id' in request.data:
-            if request.data['id'].isdigit():
-                contact = Contact.objects.filter(id=request.data['id'], user_id=request.user.id).first()
-                if contact:
-                    contact_serializer = ContactSerializer(contact, data=request.data, partial=True)
-                    adr_serializer = AddressSerializer(data=request.data)
-                    if contact_serializer.is_valid():
-                        if adr_serializer.is_valid():
-                            contact_serializer.save()
-                            adr_serializer.save(contact=contact)
-                            return Response({'Status': True, 'Comment': 'Contact edited, address added'})
-                        else:
-                            return Response({'Status': False,
-                                             'Comment': 'Error', 'Errors': adr_serializer.errors}, status=400)
-                    else:
-                        return Response({'Status': False,
-                                         'Comment': 'Error', 'Errors': contact_serializer.errors}, status=400)
-                else:
-                    return Response({'Status': False,
-                                     'Comment': 'Error', 'Errors': 'Contact id is not found in database'}, status=400)
-            else:
-                return Response({'Status': False,
-                                 'Comment': 'Error', 'Errors': 'Incorrect id'}, status=400)
-        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id is not found in request'}, status=400)
+        contacts = self.contacts_from_request(request.data, ('id',))
+        if contacts is None:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id is not found in request'}, status=400)
+        serializer = ContactBulkSerializer(data=contacts, many=True)
+        if not validated(serializer):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': serializer.errors}, status=400)
+        ids = {contact.get('id') for contact in serializer.validated_data}
+        if None in ids:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Incorrect id'}, status=400)
+        with transaction.atomic():
+            found = Contact.objects.select_for_update().filter(user_id=request.user.id, id__in=ids).in_bulk()
+            if ids - set(found):
+                return Response({'Status': False, 'Comment': 'Error',
+                                 'Errors': f'Contact id {sorted(ids - set(found))} is not found in database'},
+                                status=400)
+            changed = []
+            for contact in serializer.validated_data:
+                if 'phone' in contact:
+                    found[contact['id']].phone = contact['phone']
+                    changed.append(found[contact['id']])
+            Contact.objects.bulk_update(changed, ['phone'])
+            addresses = Address.objects.bulk_create(
+                Address(contact_id=contact['id'], **address)
+                for contact in serializer.validated_data for address in contact.get('address', ()))
+        return Response({'Status': True, 'Comment': f'{len(found)} contacts edited, {len(addresses)} addresses added'})
+
+    @staticmethod
+    def contacts_from_request(data, required):
+        if 'contacts' in data:
+            try:
+                contacts = json.loads(data['contacts'])
+            except ValueError:
+                return None
+            return contacts if isinstance(contacts, list) and contacts else None
+        if not set(required).issubset(data):
+            return None
+        contact = {field: data[field] for field in ('id', 'phone') if field in data}
+        if 'city' in data:
+            contact['address'] = [{field: data.get(field) for field in AddressInContactSerializer.Meta.fields}]
+        return [contact]
 
 
 class UserDetails(APIView):
@@ -164,7 +193,7 @@ class UserDetails(APIView):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
         serializer = UserSerializer(request.user)
-        return Response(serializer.data)
+        return Response(serialized(serializer))
 
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -172,19 +201,19 @@ class UserDetails(APIView):
         else:
             request.user.set_password(request.data['password'])
         user_serializer = UserSerializer(request.user, data=request.data, partial=True)
-        if user_serializer.is_valid():
+        if validated(user_serializer):
             user_serializer.save()
             return Response({'Status': True, 'Comment': 'Edited'}, status=200)
         else:
             return Response({'Status': False, 'Comment': 'Error', 'Errors': user_serializer.errors}, status=400)
 
 
-class CategoryView(ListAPIView):
+class CategoryView(SerializerTimingMixin, ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
-class ShopView(ListAPIView):
+class ShopView(SerializerTimingMixin, ListAPIView):
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
 
@@ -193,36 +222,15 @@ class PartnerUpdate(APIView):
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-        user_type = User.objects.filter(id=request.user.id).values('type')
-        if user_type[0]['type'] != 'partner':
+        if request.user.type != 'partner':
             return Response({'Status': False, 'Comment': 'Error',
                              'Error': 'Function is available only for partners'}, status=403)
         url = request.data.get('url')
         if url:
-            stream = get(url).content
-            data = load_yaml(stream, Loader=Loader)
-            shop, i = Shop.objects.get_or_create(name=data['shop'], url=url, user_id=request.user.id)
-            for category in data['categories']:
-                category_object, i = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                category_object.shops.add(shop.id)
-                category_object.save()
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-            for item in data['goods']:
-                product, i = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-                product_info = ProductInfo.objects.create(product_id=product.id,
-                                                          external_id=item['id'],
-                                                          name=item['model'],
-                                                          price=item['price'],
-                                                          price_rrc=item['price_rrc'],
-                                                          quantity=item['quantity'],
-                                                          shop_id=shop.id)
-                for name, value in item['parameters'].items():
-                    parameter_object, i = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(product_info_id=product_info.id,
-                                                    parameter_id=parameter_object.id,
-                                                    value=value)
-
+            try:
+                get_coordinator().run(request.user.id, partial(import_price_list, request.user.id, url))
+            except ImportBusy as error:
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': str(error)}, status=503)
             return Response({'Status': True, 'Comment': 'Partner is updated'})
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
@@ -249,7 +257,11 @@ class PartnerState(APIView):
         if state:
             if state in ['on', 'off']:
                 state = True if state == 'on' else False
-                Shop.objects.filter(user_id=request.user.id).update(state=state)
+                with transaction.atomic():
+                    Shop.objects.filter(user_id=request.user.id).update(state=state)
+                    schedule_refresh(ProductInfo.objects.filter(shop__user_id=request.user.id)
+                                     .values_list('product_id', flat=True).distinct())
+                bump_catalog_version()
                 return Response({'Status': True, 'Comment': 'Partner\'s state updated'})
             else:
                 return Response({'Status': False, 'Errors': 'State field is incorrect'}, status=400)
@@ -257,52 +269,112 @@ class PartnerState(APIView):
 
 
 class PartnerOrders(APIView):
+    @sharded
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
         if request.user.type != 'partner':
             return Response({'Status': False, 'Comment': 'Error',
                              'Error': 'Function is available only for partners'}, status=403)
-        order = Order.objects.filter(user_id=request.user.id)
+        order = Order.objects.filter(user_id=request.user.id).prefetch_related('order_item__product_info')
         serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        return Response(serialized(serializer))
+
+
+class PartnerOrderState(APIView):
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        if request.user.type != 'partner':
+            return Response({'Status': False, 'Comment': 'Error',
+                             'Error': 'Function is available only for partners'}, status=403)
+        items_sting = request.data.get('items')
+        state = request.data.get('state')
+        if items_sting and state:
+            if state not in PARTNER_ORDER_STATES:
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'State field is incorrect'}, status=400)
+            items_list = items_sting.strip().split(',')
+            if not all(order_id.strip().isdigit() for order_id in items_list):
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id must be integer'}, status=400)
+            order_ids = {int(order_id) for order_id in items_list}
+            changed = change_orders_state(order_ids, state, partner_id=request.user.id, sender=self.__class__)
+            rejected = sorted(order_ids - {order_id for order_id, user_id in changed})
+            return Response({'Status': True, 'Comment': f'{len(changed)} orders are {state}', 'Rejected': rejected})
+        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+
+
+class PartnerExportCatalog(APIView):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        if request.user.type != 'partner':
+            return Response({'Status': False, 'Comment': 'Error',
+                             'Error': 'Function is available only for partners'}, status=403)
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if shop is None:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Shop is not found'}, status=404)
+        return stream_response(request, catalog_chunks(shop), 'application/x-yaml; charset=utf-8', 'catalog.yaml')
+
+
+class PartnerExportOrders(APIView):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        if request.user.type != 'partner':
+            return Response({'Status': False, 'Comment': 'Error',
+                             'Error': 'Function is available only for partners'}, status=403)
+        state = request.query_params.get('state')
+        if state and state not in ORDER_TRANSITIONS:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'State field is incorrect'}, status=400)
+        return stream_response(request, order_chunks(request.user.id, state), 'text/csv; charset=utf-8',
+                               'orders.csv')
 
 
 class OrderView(APIView):
+    @sharded
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-        order = Order.objects.filter(user_id=request.user.id)
+        order = Order.objects.filter(user_id=request.user.id).prefetch_related('order_item__product_info')
         serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        return Response(serialized(serializer))
 
+    @idempotent
+    @sharded
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
         if {'id', 'contact'}.issubset(request.data):
             if request.data['id'].isdigit():
-                order = Order.objects.filter(user_id=request.user.id, id=request.data['id'])
-                if order:
-                    is_updated = (Order.objects.filter(user_id=request.user.id, id=request.data['id'])
-                                  .update(state='in_progress'))
-                    if is_updated:
-                        new_order.send(sender=self.__class__, user_id=request.user.id)
-                        return Response({'Status': True, 'Comment': 'Order in progress'})
+                order_id = int(request.data['id'])
+                if settings.BASKET_STORE == 'cache':
+                    try:
+                        is_updated = CacheBasket(request.user.id).checkout(order_id)
+                    except BasketBusy as error:
+                        return Response({'Status': False, 'Comment': 'Error', 'Errors': str(error)}, status=409)
                 else:
-                    Response({'Status': False, 'Comment': 'Error', 'Errors': 'Order is not found'}, status=400)
+                    is_updated = Order.objects.filter(user_id=request.user.id, id=order_id).update(state='in_progress')
+                if is_updated:
+                    new_order.send(sender=self.__class__, user_id=request.user.id, order_id=order_id)
+                    return Response({'Status': True, 'Comment': 'Order in progress'})
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Order is not found'}, status=400)
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
 
 class BasketView(APIView):
+    @sharded
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
-        basket = Order.objects.filter(user_id=request.user.id, state='new')
+        basket = (Order.objects.filter(user_id=request.user.id, state='new')
+                  .prefetch_related('order_item__product_info'))
         serializer = OrderSerializer(basket, many=True)
         if serializer:
-            return Response(serializer.data, status=200)
+            return Response(serialized(serializer), status=200)
         return Response({'Status': False, 'Comment': 'Error', 'Error': 'Bad request'}, status=401)
 
+    @idempotent
+    @sharded
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
@@ -317,16 +389,17 @@ class BasketView(APIView):
                 pi = ProductInfo.objects.filter(id=order_item["product_info"])[0]
                 total_sum += pi.price * order_item["quantity"]
                 serializer = OrderItemSerializer(data=order_item)
-                if serializer.is_valid():
+                if validated(serializer):
                     serializer.save()
                     objects_created += 1
                 else:
                     return Response({'Status': False, 'Comment': f'Error in item. {objects_created} objects created',
                                      'Errors': serializer.errors}, status=400)
-            ts = Order.objects.filter(id=basket.id).update(total_sum=total_sum)
+            ts = Order.objects.filter(id=basket.id).update(total_sum=total_sum, updated_at=timezone.now())
             return Response({'Status': True, 'Comment': f'{objects_created} objects are created'}, status=201)
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
+    @sharded
     def delete(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
@@ -342,17 +415,14 @@ class BasketView(APIView):
                     objects_deleted = True
             if objects_deleted:
                 deleted_count = OrderItem.objects.filter(query).delete()[0]
-                order_items = OrderItem.objects.filter(order=basket.id)
-                total_sum = 0
-                for pib in order_items:
-                    pi = ProductInfo.objects.filter(id=pib.product_info_id)[0]
-                    total_sum += pi.price * pib.quantity
-                ts = Order.objects.filter(id=basket.id).update(total_sum=total_sum)
+                ts = Order.objects.filter(id=basket.id).update(total_sum=basket_total(basket.id),
+                                                               updated_at=timezone.now())
                 return Response({'Status': True, 'Comment': f'{deleted_count} deleted'}, status=200)
             else:
                 return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Items are not found'}, status=400)
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
+    @sharded
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
@@ -369,18 +439,81 @@ class BasketView(APIView):
                     else:
                         return Response({'Status': False, 'Comment': f'Error in item. {objects_updated} updated',
                                          'Errors': f'Incorrect value in item {order_item}'}, status=400)
-                order_items = OrderItem.objects.filter(order=basket.id)
-                total_sum = 0
-                for pib in order_items:
-                    pi = ProductInfo.objects.filter(id=pib.product_info_id)[0]
-                    total_sum += pi.price * pib.quantity
-                ts = Order.objects.filter(id=basket.id).update(total_sum=total_sum)
+                ts = Order.objects.filter(id=basket.id).update(total_sum=basket_total(basket.id),
+                                                               updated_at=timezone.now())
                 return Response({'Status': True, 'Comment': f'{objects_updated} updated'}, status=200)
             else:
                 Response({'Status': False, 'Comment': 'Error', 'Errors': 'Basket is not found'}, status=400)
         return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
 
 
+class CacheBasketView(BasketView):
+    def handle_exception(self, exc):
+        if isinstance(exc, BasketBusy):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': str(exc)}, status=409)
+        return super().handle_exception(exc)
+
+    @sharded
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        return Response(CacheBasket(request.user.id).to_representation(), status=200)
+
+    @idempotent
+    @sharded
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        items_sting = request.data.get('items')
+        if items_sting:
+            items_dict = json.loads(items_sting)
+            for order_item in items_dict:
+                if not (isinstance(order_item.get('product_info'), int) and isinstance(order_item.get('quantity'), int)
+                        and order_item['quantity'] > 0):
+                    return Response({'Status': False, 'Comment': 'Error in item. 0 objects created',
+                                     'Errors': f'Incorrect value in item {order_item}'}, status=400)
+            product_ids = {order_item['product_info'] for order_item in items_dict}
+            found = set(ProductInfo.objects.filter(id__in=product_ids).values_list('id', flat=True))
+            if product_ids - found:
+                return Response({'Status': False, 'Comment': 'Error in item. 0 objects created',
+                                 'Errors': f'Product info {sorted(product_ids - found)} is not found'}, status=400)
+            objects_created = CacheBasket(request.user.id).add(items_dict)
+            return Response({'Status': True, 'Comment': f'{objects_created} objects are created'}, status=201)
+        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+
+    @sharded
+    def delete(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        items_sting = request.data.get('items')
+        if items_sting:
+            items_list = [int(item_id) for item_id in items_sting.split(',') if item_id.isdigit()]
+            if items_list:
+                deleted_count = CacheBasket(request.user.id).delete(items_list)
+                return Response({'Status': True, 'Comment': f'{deleted_count} deleted'}, status=200)
+            else:
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Items are not found'}, status=400)
+        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+
+    @sharded
+    def put(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        items_sting = request.data.get('items')
+        if items_sting:
+            items_dict = json.loads(items_sting)
+            for order_item in items_dict:
+                if not (isinstance(order_item.get('id'), int) and isinstance(order_item.get('quantity'), int)):
+                    return Response({'Status': False, 'Comment': 'Error in item. 0 updated',
+                                     'Errors': f'Incorrect value in item {order_item}'}, status=400)
+            basket = CacheBasket(request.user.id)
+            if basket.load() is None:
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Basket is not found'}, status=400)
+            objects_updated = basket.update(items_dict)
+            return Response({'Status': True, 'Comment': f'{objects_updated} updated'}, status=200)
+        return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+
+
 class ProductInfoView(APIView):
     def get(self, request: Request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -388,10 +521,91 @@ class ProductInfoView(APIView):
         query = Q(shop__state=True)
         shop_id = request.query_params.get('shop_id')
         category_id = request.query_params.get('category_id')
+        if request.query_params.get('in_stock') in ('1', 'true'):
+            query = query & Q(quantity__gt=0)
         if shop_id:
             query = query & Q(shop_id=shop_id)
         if category_id:
             query = query & Q(product__category_id=category_id)
         queryset = ProductInfo.objects.filter(query)
         serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data, status=200)
+        return Response(serialized(serializer), status=200)
+
+
+class StockView(APIView):
+    def get(self, request: Request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        shop_id = request.query_params.get('shop_id', '')
+        category_id = request.query_params.get('category_id', '')
+        if not all(value.isdigit() for value in (shop_id, category_id) if value):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Id must be integer'}, status=400)
+        return Response(stock_counts(shop_id, category_id))
+
+
+class PriceHistoryView(APIView):
+    def get(self, request: Request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        offer_id = request.query_params.get('offer_id', '')
+        product_id = request.query_params.get('product_id', '')
+        points = request.query_params.get('points', '100')
+        if not (offer_id or product_id) or not all(value.isdigit() for value in (offer_id or product_id, points)):
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Bad request'}, status=400)
+        end, start = request.query_params.get('to'), request.query_params.get('from')
+        end = parse_datetime(end) if end else timezone.now()
+        start = parse_datetime(start) if start else end - timedelta(days=30)
+        if start is None or end is None or start >= end:
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Incorrect date range'}, status=400)
+        start, end = (timezone.make_aware(moment) if timezone.is_naive(moment) else moment for moment in (start, end))
+        if offer_id:
+            offer = ProductInfo.objects.filter(id=offer_id).values('shop_id', 'external_id').first()
+            if offer is None:
+                return Response({'Status': False, 'Comment': 'Error', 'Errors': 'Offer is not found'}, status=404)
+            series = PriceSeries.objects.filter(**offer)
+        else:
+            series = PriceSeries.objects.filter(product_id=product_id)
+        points = min(max(int(points), 1), settings.PRICE_HISTORY_MAX_POINTS)
+        return Response(price_history(series.order_by('shop_id', 'external_id'), start, end, points))
+
+
+class RelatedProductView(APIView):
+    def get(self, request: Request, product_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        limit = request.query_params.get('limit', str(settings.RECOMMENDATIONS_TOP_K))
+        if not limit.isdigit():
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'limit must be integer'}, status=400)
+        queryset = (RelatedProduct.objects.filter(product_id=product_id).select_related('related')
+                    .order_by('-score', 'related_id')[:int(limit)])
+        return Response(serialized(RelatedProductSerializer(queryset, many=True)))
+
+
+class BestOfferPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    orderings = {'price': 'min_price', 'name': 'name', 'shops': 'shop_count'}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering', 'price')
+        field = self.orderings.get(ordering.lstrip('-'), 'min_price')
+        descending = '-' if ordering.startswith('-') else ''
+        return (f'{descending}{field}', f'{descending}product')
+
+
+class BestOfferView(SerializerTimingMixin, ListAPIView):
+    serializer_class = BestOfferSerializer
+    pagination_class = BestOfferPagination
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Comment': 'Error', 'Error': 'Not authenticated'}, status=401)
+        category_id = request.query_params.get('category_id', '')
+        if not category_id.isdigit():
+            return Response({'Status': False, 'Comment': 'Error', 'Errors': 'category_id is required'}, status=400)
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return (BestOffer.objects.filter(category_id=self.request.query_params['category_id'])
+                .select_related('best_shop'))
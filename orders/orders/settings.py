@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.performance.PerformanceMiddleware',
+    'backend.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.routers.ReplicaStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'orders.urls'
@@ -81,17 +84,62 @@ WSGI_APPLICATION = 'orders.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+DB_POOL = os.environ.get('DB_POOL', 'false').lower() == 'true'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'backend.pooled_postgresql' if DB_POOL else 'django.db.backends.postgresql',
         'NAME': os.environ["DB_NAME"],
         'HOST': os.environ["DB_HOST"],
         'PORT': os.environ["DB_PORT"],
         'USER': os.environ["DB_USER"],
-        'PASSWORD': os.environ["DB_PASSWORD"]
+        'PASSWORD': os.environ["DB_PASSWORD"],
+        # Used by backend.pooled_postgresql: connections are returned to the pool at the end of each request.
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            'MAX_LIFETIME': 30 * 60,
+            'TIMEOUT': 10,
+            'HEALTH_CHECK_IDLE': 10,
+        },
     }
 }
 
+# Catalog reads go to these aliases; a client that wrote is pinned to 'default' for REPLICA_STICKY_SECONDS.
+# The pins live in REPLICA_PIN_CACHE so that every worker sees them.
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Orders, order items, contacts and addresses of each user live on one of DATABASE_SHARDS; users, the catalog
+# and everything else stay on 'default'. DB_SHARDS lists extra shard databases as `name` or `host/name`.
+# Users are placed by id on first use and moved online with `manage.py rebalance_shards`; placements are cached
+# in SHARD_MAP_CACHE (shared by all workers) for SHARD_MAP_CACHE_TTL seconds and dropped when a user is moved.
+# Writes always read the placement from the database. A new shard database gets its tables from `migrate`.
+DATABASE_SHARDS = ['default']
+for number, shard in enumerate(filter(None, os.environ.get('DB_SHARDS', '').split(',')), start=1):
+    host, _, name = shard.rpartition('/')
+    DATABASES[f'shard{number}'] = dict(DATABASES['default'], HOST=host or DATABASES['default']['HOST'], NAME=name)
+    DATABASE_SHARDS.append(f'shard{number}')
+SHARD_MAP_CACHE = 'shared'
+SHARD_MAP_CACHE_TTL = 60
+
+DATABASE_ROUTERS = ['backend.routers.ShardRouter', 'backend.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 5
+REPLICA_PIN_CACHE = 'shared'
+
+
+# 'shared' holds state every worker has to see (baskets, placements, versions, revocations); point REDIS_URL
+# at a Redis server when running more than one process. Without it 'shared' is a per-process LocMemCache.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': ({'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL} if REDIS_URL else
+               {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared',
+                'OPTIONS': {'MAX_ENTRIES': 100000}}),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -136,7 +184,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'backend.User'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.mail.ru'
 EMAIL_HOST_USER = os.environ["EMAIL_HOST_USER"]
 EMAIL_HOST_PASSWORD = os.environ["EMAIL_HOST_PASSWORD"]
@@ -147,6 +195,101 @@ SERVER_EMAIL = EMAIL_HOST_USER
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.authentication.CachedTokenAuthentication',
     ),
 }
+
+# Token -> user lookups are cached per process for TOKEN_CACHE_TTL seconds. Token and User changes replace a
+# per-user version in TOKEN_CACHE (shared by all workers) that every lookup checks.
+TOKEN_CACHE = 'shared'
+TOKEN_CACHE_TTL = 30
+TOKEN_CACHE_SIZE = 10000
+
+# Idempotency-Key support for basket and order mutations.
+# 'memory' keeps responses in a bounded per-process store, 'db' shares them between workers. A retry waits up to
+# IDEMPOTENCY_WAIT_TIMEOUT for the first request to finish and then gets 409; a different body with the key gets 422.
+# With 'db' an unfinished request holds its key for IDEMPOTENCY_LEASE seconds, so a crashed worker does not block it.
+IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'memory')
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_MAX_KEYS = 10000
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_LEASE = 3 * IDEMPOTENCY_WAIT_TIMEOUT
+
+# 'cache' keeps the new basket in BASKET_CACHE and writes OrderItem rows only at checkout. Changes to one
+# basket are serialized with a lock in the same cache, held for at most BASKET_LOCK_TIMEOUT seconds.
+BASKET_STORE = os.environ.get('BASKET_STORE', 'db')
+BASKET_CACHE = 'shared'
+BASKET_CACHE_TTL = 7 * 24 * 60 * 60
+BASKET_LOCK_TIMEOUT = 5
+
+# Outgoing emails are queued in EmailOutbox and delivered by `manage.py drain_outbox`.
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
+
+# `manage.py maintenance` purges abandoned baskets, old confirm and password reset tokens, tokens of inactive
+# users, sent emails and expired idempotency keys. Batches of MAINTENANCE_BATCH_SIZE rows run in their own
+# transactions, deleting at most MAINTENANCE_DUTY_CYCLE of the time and waiting out MAINTENANCE_PEAK_HOURS.
+# TTLs are in seconds; password reset tokens use DJANGO_REST_MULTITOKENAUTH_RESET_TOKEN_EXPIRY_TIME.
+MAINTENANCE_BATCH_SIZE = 1000
+MAINTENANCE_DUTY_CYCLE = 0.2
+MAINTENANCE_PEAK_HOURS = range(9, 23)
+MAINTENANCE_BASKET_TTL = 30 * 24 * 60 * 60
+MAINTENANCE_CONFIRM_TOKEN_TTL = 7 * 24 * 60 * 60
+MAINTENANCE_OUTBOX_TTL = 7 * 24 * 60 * 60
+
+# api/v1/catalog is rendered once per catalog version and kept in each process; the version lives in
+# CATALOG_CACHE (shared by all workers) and is bumped by imports and partner state changes.
+CATALOG_CACHE = 'shared'
+
+# partner/update appends changed price, price_rrc and quantity values to delta-encoded chunks of
+# PRICE_HISTORY_CHUNK_POINTS points; products/history downsamples to at most PRICE_HISTORY_MAX_POINTS.
+PRICE_HISTORY_CHUNK_POINTS = 256
+PRICE_HISTORY_MAX_POINTS = 1000
+
+# partner/update runs one import per shop at a time (PostgreSQL advisory lock); requests for a shop that is
+# importing are coalesced into one follow-up run. IMPORT_MAX_CONCURRENCY caps imports per process and
+# IMPORT_DB_SLOTS across all processes (None disables); waiting longer than IMPORT_QUEUE_TIMEOUT answers 503.
+IMPORT_MAX_CONCURRENCY = 4
+IMPORT_DB_SLOTS = 8
+IMPORT_QUEUE_TIMEOUT = 60
+
+# partner/export/* stream rows from server-side cursors EXPORT_CHUNK_SIZE at a time and flush output
+# (gzip-compressed when the client accepts it) every EXPORT_BUFFER_BYTES.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_BYTES = 64 * 1024
+
+# partner/events streams order creation and state changes as Server-Sent Events (serve with ASGI). The backend
+# numbers events and keeps the last `buffer` for Last-Event-ID resumes; a client that falls
+# ORDER_EVENTS_QUEUE_SIZE events behind is disconnected and resumes from there.
+ORDER_EVENTS_BACKEND = {'BACKEND': 'backend.events.MemoryBackend', 'OPTIONS': {'buffer': 10000}}
+ORDER_EVENTS_QUEUE_SIZE = 1000
+ORDER_EVENTS_KEEPALIVE = 15
+
+# `manage.py build_recommendations` adds newly completed orders to the product co-occurrence matrix stored in
+# RECOMMENDATIONS_MATRIX and keeps the RECOMMENDATIONS_TOP_K neighbours per product for products/<id>/related.
+RECOMMENDATIONS_MATRIX = os.environ.get('RECOMMENDATIONS_MATRIX', BASE_DIR / 'recommendations.npz')
+RECOMMENDATIONS_TOP_K = 20
+RECOMMENDATIONS_BATCH_LINES = 1_000_000
+
+# Serve GET on products, categories, shops, basket and order with native async views (use with orders.asgi).
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', 'false').lower() == 'true'
+
+# Server-Timing headers with SQL, serializer and render time (off by default); requests slower than
+# PERFORMANCE_SLOW_REQUEST_MS are logged with their slowest queries (None disables the log).
+PERFORMANCE_TIMING = os.environ.get('PERFORMANCE_TIMING', 'false').lower() == 'true'
+PERFORMANCE_SLOW_REQUEST_MS = 500
+PERFORMANCE_SLOW_QUERIES = 5
+
+# Prometheus metrics on api/v1/metrics. With several worker processes point METRICS_DIR to a directory
+# shared by all of them (cleared on deploy); each process writes its samples there every METRICS_FLUSH_INTERVAL.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1
+# Scrapers send `Authorization: Bearer METRICS_TOKEN` or connect from METRICS_ALLOWED_IPS (REMOTE_ADDR, so behind a
+# proxy this is the proxy's address); everyone else gets 403.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
+
+# Admin lists of large tables show PostgreSQL's row estimates instead of COUNT(*) once they pass
+# ADMIN_EXACT_COUNT_LIMIT rows.
+ADMIN_EXACT_COUNT_LIMIT = 10000